@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import time
+
+import toml
+from config_batch import generate_batch
+from zk_relay.bitcoin_mock.synthetic_chain import SyntheticChain
+from zk_relay.encoder import encode_input
+from zk_relay.reference import EPOCH_LENGTH, batch_retarget_hint, predict_outputs, time_and_bits_word
+from zokrates_libs.zokrates import UNIVERSAL_SCHEMES, WITNESS_HANDOFF, Zokrates
+
+FAKE_ZOKRATES_PATH = os.path.dirname(os.path.abspath(__file__)) + "/zokrates_libs/fake_zokrates.py"
+
+
+def file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def synthetic_input(chain: SyntheticChain, batch_num: int, target_division: str) -> list:
+    """ encodes the first batch_num headers of a synthetic chain as Actor.build_input does, rejecting a range the circuit would """
+    raw_headers = chain.store.get_range(chain.base_height, chain.base_height + batch_num - 1)
+    epoch_head_time_and_bits = time_and_bits_word(chain.store.get(chain.base_height))
+    predict_outputs(epoch_head_time_and_bits, raw_headers)
+    encoded_input = encode_input(epoch_head_time_and_bits, raw_headers)
+    if target_division == "hint":
+        # the quotient and remainder update_target_hint.zok checks against target * time delta
+        encoded_input += list(batch_retarget_hint(epoch_head_time_and_bits, raw_headers))
+    return encoded_input
+
+
+def linear_fit(xs: list, ys: list) -> dict:
+    """ least squares y = per_header * x + fixed """
+    points = [(x, y) for x, y in zip(xs, ys) if y is not None]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum([x for x, _ in points]) / n
+    mean_y = sum([y for _, y in points]) / n
+    var_x = sum([(x - mean_x) ** 2 for x, _ in points])
+    if var_x == 0:
+        return None
+    slope = sum([(x - mean_x) * (y - mean_y) for x, y in points]) / var_x
+    return {"per_header": slope, "fixed": mean_y - slope * mean_x}
+
+
+def benchmark_batch(config_path: str, batch_num: int, target_division: str, encoded_input: list, encode_time: float, witness_transport: str,
+                    witness_handoffs: list = None) -> dict:
+    zok = Zokrates(config_path)
+    stages = dict()
+    stages["compile"] = zok.compile().to_dict()
+    stages["setup"] = zok.setup().to_dict()
+    stages["compute_witness"] = zok.compute_witness(encoded_input, transport=witness_transport).to_dict()
+    stages["generate_proof"] = zok.generate_proof().to_dict()
+    constraints = stages["compile"]["constraints"]
+    witness_size = file_size(zok.witness_path)
+
+    # end-to-end proving time (compute-witness + generate-proof) per witness handoff
+    handoff_times = dict()
+    zok.witness_transport = witness_transport
+    for witness_handoff in [] if witness_handoffs is None else witness_handoffs:
+        started = time.monotonic()
+        zok.prove(encoded_input, handoff=witness_handoff)
+        handoff_times[witness_handoff] = time.monotonic() - started
+    return {
+        "batch_num": batch_num,
+        "proving_scheme": zok.proving_scheme,
+        "target_division": target_division,
+        "constraints": constraints,
+        "encode_time": encode_time,
+        "stages": stages,
+        "handoff_times": handoff_times,
+        "sizes": {
+            "program": file_size(zok.prog_path),
+            "proving_key": file_size(zok.pkey_path),
+            "verification_key": file_size(zok.vkey_path),
+            "witness": witness_size,
+            "proof": file_size(zok.proof_path)
+        },
+        "per_header": {
+            "constraints": constraints / batch_num if constraints is not None else None,
+            "setup_time": stages["setup"]["wall_time"] / batch_num,
+            "prove_time": (stages["compute_witness"]["wall_time"] + stages["generate_proof"]["wall_time"]) / batch_num
+        }
+    }
+
+
+def compare_divisions(results: list) -> list:
+    """ hint vs in-circuit retarget division, per batch size benchmarked with both """
+    by_key = {(result["batch_num"], result["target_division"]): result for result in results}
+    comparison = list()
+    for batch_num in sorted(set([result["batch_num"] for result in results])):
+        if (batch_num, "circuit") not in by_key or (batch_num, "hint") not in by_key:
+            continue
+        circuit, hint = by_key[(batch_num, "circuit")], by_key[(batch_num, "hint")]
+        comparison.append({
+            "batch_num": batch_num,
+            "constraints_saved": circuit["constraints"] - hint["constraints"] if circuit["constraints"] is not None else None,
+            "generate_proof_time_ratio": hint["stages"]["generate_proof"]["wall_time"] / circuit["stages"]["generate_proof"]["wall_time"],
+            "setup_time_ratio": hint["stages"]["setup"]["wall_time"] / circuit["stages"]["setup"]["wall_time"]
+        })
+    return comparison
+
+
+def compare_setups(results: list, universal_setups: dict) -> dict:
+    """ per-circuit g16 setup vs marlin keys derived from one universal setup, per batch size and for the whole menu """
+    by_key = {(result["batch_num"], result["proving_scheme"], result["target_division"]): result for result in results}
+    per_batch = list()
+    for batch_num, proving_scheme, target_division in sorted(by_key.keys()):
+        if proving_scheme != "g16" or (batch_num, "marlin", target_division) not in by_key:
+            continue
+        g16, marlin = by_key[(batch_num, "g16", target_division)], by_key[(batch_num, "marlin", target_division)]
+        per_batch.append({
+            "batch_num": batch_num,
+            "target_division": target_division,
+            "g16_setup_time": g16["stages"]["setup"]["wall_time"],
+            "marlin_setup_time": marlin["stages"]["setup"]["wall_time"],
+            "setup_time_ratio": marlin["stages"]["setup"]["wall_time"] / g16["stages"]["setup"]["wall_time"],
+            "generate_proof_time_ratio": marlin["stages"]["generate_proof"]["wall_time"] / g16["stages"]["generate_proof"]["wall_time"]
+        })
+    if len(per_batch) == 0 or "marlin" not in universal_setups:
+        return None
+    return {
+        "universal_setup_time": universal_setups["marlin"]["wall_time"],
+        # setting up the whole menu: one setup per size, against one SRS plus a derivation per size
+        "menu_g16_setup_time": sum([row["g16_setup_time"] for row in per_batch]),
+        "menu_marlin_setup_time": universal_setups["marlin"]["wall_time"] + sum([row["marlin_setup_time"] for row in per_batch]),
+        "per_batch": per_batch
+    }
+
+
+def compare_handoffs(results: list) -> list:
+    """ seconds saved per proof against the witness file in the data dir, per batch size """
+    comparison = list()
+    for result in results:
+        handoff_times = result["handoff_times"]
+        if "file" not in handoff_times or len(handoff_times) < 2:
+            continue
+        comparison.append({
+            "batch_num": result["batch_num"],
+            "proving_scheme": result["proving_scheme"],
+            "target_division": result["target_division"],
+            "witness_size": result["sizes"]["witness"],
+            "prove_time": handoff_times,
+            "saved_time": {handoff: handoff_times["file"] - prove_time for handoff, prove_time in handoff_times.items() if handoff != "file"}
+        })
+    return comparison
+
+
+def cost_curves(results: list) -> dict:
+    batch_nums = [result["batch_num"] for result in results]
+    curves = {"constraints": linear_fit(batch_nums, [result["constraints"] for result in results]),
+              "proving_key": linear_fit(batch_nums, [result["sizes"]["proving_key"] for result in results])}
+    for stage in ["compile", "setup", "compute_witness", "generate_proof"]:
+        curves[stage + "_time"] = linear_fit(batch_nums, [result["stages"][stage]["wall_time"] for result in results])
+        curves[stage + "_peak_rss"] = linear_fit(batch_nums, [result["stages"][stage]["peak_rss"] for result in results])
+    return curves
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="batch size scaling benchmark of the relay circuit")
+    parser.add_argument("--project_root", "-r", required=False, default=os.path.dirname(os.path.abspath(__file__)) + "/", type=str)
+    parser.add_argument("--zokrates_bin_path", "-z", required=False, default="/Users/dc/research_project/ZoKrates/target/release/zokrates", type=str)
+    parser.add_argument("--stdlib_path", "-s", required=False, default="/Users/dc/research_project/ZoKrates/zokrates_stdlib/stdlib", type=str)
+    parser.add_argument("--proving_scheme", "-p", required=False, default=["g16"], type=str, nargs="+")
+    parser.add_argument("--universal_setup_size", "-u", required=False, default=None, type=int, help="SRS size exponent (marlin)")
+    parser.add_argument("--batch_nums", "-b", required=False, default=[2, 4, 8, 16], type=int, nargs="+")
+    parser.add_argument("--stub", required=False, action="store_true", help="use a fake zokrates executable")
+    parser.add_argument("--rpc_config", required=False, default=None, type=str, help="build real inputs through Actor")
+    parser.add_argument("--from_height", required=False, default=647136, type=int, help="epoch head, so that no batch crosses a retarget")
+    parser.add_argument("--target_division", "-d", required=False, default=["circuit"], type=str, nargs="+", choices=["circuit", "hint"])
+    parser.add_argument("--witness_transport", "-t", required=False, default="argv", type=str, choices=["argv", "stdin", "file"])
+    parser.add_argument("--witness_handoff", "-w", required=False, default=None, type=str, nargs="+", choices=WITNESS_HANDOFF,
+                        help="also time whole proofs with each witness handoff")
+    parser.add_argument("--output", "-o", required=False, default="./bench/report.json", type=str)
+
+    # parse configuration arguments
+    args = parser.parse_args()
+    zokrates_bin_path = FAKE_ZOKRATES_PATH if args.stub else args.zokrates_bin_path
+    bench_dir = os.path.dirname(os.path.abspath(args.output)) + "/"
+    os.makedirs(bench_dir + "conf/", exist_ok=True)
+
+    if max(args.batch_nums) > EPOCH_LENGTH:
+        print("[Error] A batch can not cross a retarget boundary: {} headers".format(max(args.batch_nums)))
+        exit()
+    chain = None
+    if args.rpc_config is not None:
+        from bitcoinpy.client import BitcoinClient
+        from zk_relay.actor import Actor
+        rpc_config = toml.load(args.rpc_config)
+        btc_cli = BitcoinClient(rpc_config["url"], rpc_config["id"], rpc_config["pwd"], rpc_config["wallet_name"])
+    else:
+        # valid headers at an easy target, mined once and kept next to the report
+        chain = SyntheticChain(bench_dir + "synthetic_headers.dat")
+        if chain.tip_height < max(args.batch_nums) - 1:
+            chain.mine(max(args.batch_nums) - 1 - chain.tip_height)
+
+    results = list()
+    universal_setups = dict()
+    for proving_scheme in args.proving_scheme:
+        for target_division in args.target_division:
+            for batch_num in args.batch_nums:
+                print(">>> benchmark batch {} ({}, {} division)".format(batch_num, proving_scheme, target_division))
+                config_path = generate_batch(batch_num, args.project_root, zokrates_bin_path, args.stdlib_path, proving_scheme,
+                                             data_dir="bench/batch{}_{}_{}/".format(batch_num, target_division, proving_scheme),
+                                             conf_dir=bench_dir + "conf/", suffix="_{}_{}".format(target_division, proving_scheme),
+                                             target_division=target_division, universal_setup_size=args.universal_setup_size)
+                if proving_scheme in UNIVERSAL_SCHEMES and proving_scheme not in universal_setups:
+                    # generated (and timed) once per run, shared by every batch size below
+                    universal_result = Zokrates(config_path).universal_setup(use_cache=False)
+                    universal_setups[proving_scheme] = universal_result.to_dict()
+                started = time.monotonic()
+                if args.rpc_config is not None:
+                    encoded_input = Actor(btc_cli, config_path).build_input(args.from_height, args.from_height + batch_num - 1)
+                else:
+                    encoded_input = synthetic_input(chain, batch_num, target_division)
+                encode_time = time.monotonic() - started
+                results.append(benchmark_batch(config_path, batch_num, target_division, encoded_input, encode_time, args.witness_transport,
+                                               args.witness_handoff))
+
+    report = {
+        "zokrates_version": Zokrates(config_path).version(),
+        "stub": args.stub,
+        "proving_scheme": args.proving_scheme,
+        "witness_transport": args.witness_transport,
+        "results": results,
+        "universal_setups": universal_setups,
+        "curves": {scheme: {division: cost_curves([result for result in results if result["target_division"] == division and result["proving_scheme"] == scheme])
+                            for division in args.target_division} for scheme in args.proving_scheme},
+        "division_comparison": compare_divisions([result for result in results if result["proving_scheme"] == args.proving_scheme[0]]),
+        "setup_comparison": compare_setups(results, universal_setups),
+        "handoff_comparison": compare_handoffs(results)
+    }
+    with open(args.output, "w") as f:
+        f.write(json.dumps(report, indent=4))
+    if chain is not None:
+        chain.close()
+    print("[Success] Benchmark report is written to {}".format(args.output))
@@ -1,8 +1,12 @@
 import argparse
+import copy
+import json
 import os
 
 import toml
 
+FAKE_ZOKRATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zokrates_libs/fake_zokrates.py")
+
 static_config: dict = {
     'zokrates': {
         'BIN_PATH': 'ToBeSet',
@@ -13,7 +17,8 @@ static_config: dict = {
         'ROOT_DIR': 'ToBeSet',
         'code': {
             'CODE_DIR': 'code/',
-            'CODE_FILE_NAME': 'ToBeSet'
+            'CODE_FILE_NAME': 'ToBeSet',
+            'TARGET_DIVISION': 'ToBeSet'
         },
         'data': {
             'DATA_DIR': 'ToBeSet',
@@ -37,11 +42,11 @@ import "utils/pack/u32/nonStrictUnpack256.zok" as unpack256
 import "utils/pack/u32/pack128.zok" as pack128
 import "utils/pack/u32/unpack128.zok" as unpack128
 
-import "./libs/update_target.zok" as update_target
+{update_target_import}
 import "./libs/to_big_endian256.zok" as to_big_endian256
-import "./libs/validate_block_header.zok" as validate_block_header
+{validator_import}
 
-def main(field epoch_head_time_and_bits, private u32[{num}][32] blocks) -> (field, field, field, field):
+def main(field epoch_head_time_and_bits, private u32[{num}][32] blocks{hint_params}) -> (field, field, field, field):
     // parsing inputs
     u32[4] unpacked_old_tb = unpack128(epoch_head_time_and_bits)
     u32 little_head_time = unpacked_old_tb[1]
@@ -61,9 +66,32 @@ def main(field epoch_head_time_and_bits, private u32[{num}][32] blocks) -> (fiel
 intermediate_code_block = """    little_prev_hash = validate_block_header(little_head_bits, little_prev_hash, blocks[{loop}])
 """
 
+# loop mode: one generic call looping over blocks instead of one unrolled line per header
+loop_code_block = """    little_prev_hash = validate_blocks(little_head_bits, little_prev_hash, blocks)
+"""
+
+# hint: quotient/remainder of the retarget division are private inputs, the circuit only checks them
+update_target_codes = {
+    "circuit": {
+        "update_target_import": 'import "./libs/update_target.zok" as update_target',
+        "hint_params": "",
+        "update_target_call": "update_target(little_head_time, little_head_bits, little_tail_time)"
+    },
+    "hint": {
+        "update_target_import": 'import "./libs/update_target_hint.zok" as update_target',
+        "hint_params": ", private field target_quotient, private field target_remainder",
+        "update_target_call": "update_target(little_head_time, little_head_bits, little_tail_time, target_quotient, target_remainder)"
+    }
+}
+
+validator_imports = {
+    "unrolled": 'import "./libs/validate_block_header.zok" as validate_block_header',
+    "loop": 'import "./libs/validate_blocks.zok" as validate_blocks'
+}
+
 tail_static_code = """
     // validate target
-    field big_updated_target = update_target(little_head_time, little_head_bits, little_tail_time)
+    field big_updated_target = {update_target_call}
 
     // calculate final hash
     field big_final_hash = pack256(to_big_endian256(little_prev_hash))
@@ -71,42 +99,128 @@ tail_static_code = """
 """
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="batch num (integer)")
-    parser.add_argument("--project_root", "-r", required=False, default=os.path.dirname(os.path.abspath(__file__)) + "/", type=str)
-    parser.add_argument("--zokrates_bin_path", "-z", required=False, default="/Users/dc/research_project/ZoKrates/target/release/zokrates", type=str)
-    parser.add_argument("--stdlib_path", "-s", required=False, default="/Users/dc/research_project/ZoKrates/zokrates_stdlib/stdlib", type=str)
-    parser.add_argument("--proving_scheme", "-p", required=False, default="g16", type=str)
-    parser.add_argument("--batch_num", "-b", required=True, type=int, nargs=1)
+def generate_code(batch_num: int, mode: str = "unrolled", target_division: str = "circuit") -> str:
+    update_target_code = update_target_codes[target_division]
+    head_code = head_static_code.format(num=batch_num, num_minus_one=(batch_num-1), num_minus_two=(batch_num-2),
+                                        validator_import=validator_imports[mode],
+                                        update_target_import=update_target_code["update_target_import"],
+                                        hint_params=update_target_code["hint_params"])
+    if mode == "loop":
+        body_code = loop_code_block
+    else:
+        body_code = "".join([intermediate_code_block.format(loop=i) for i in range(batch_num)])
+    return head_code + body_code + tail_static_code.format(update_target_call=update_target_code["update_target_call"])
 
-    # parse configuration arguments
-    args = parser.parse_args()
-    project_root = args.project_root
-    zokrates_bin_path = args.zokrates_bin_path
-    stdlib_path = args.stdlib_path
-    proving_scheme = args.proving_scheme
-    batch_num = args.batch_num[0]
-
-    # set arguments to static_config dictionary
-    config = static_config
+
+def make_config(zokrates_bin_path: str, stdlib_path: str, proving_scheme: str, root_dir: str, code_file_name: str, data_dir: str,
+                contract_file_name: str, target_division: str = "circuit", universal_setup_size: int = None) -> dict:
+    """ static_config with every ToBeSet field filled """
+    config = copy.deepcopy(static_config)
     config["zokrates"]["BIN_PATH"] = zokrates_bin_path
     config["zokrates"]["STDLIB_PATH"] = stdlib_path
     config["context"]["PROVING_SCHEME_NAME"] = proving_scheme
-    config["context"]["ROOT_DIR"] = project_root + "zk_relay/zok_src/"
-    config["context"]["code"]["CODE_FILE_NAME"] = "validate_batch{}.zok".format(batch_num)
-    config["context"]["data"]["DATA_DIR"] = "data/batch{}/".format(batch_num)
-    config["context"]["contract"]["CONTRACT_FILE_NAME"] = "verifier{}.sol".format(batch_num)
+    if universal_setup_size is not None:
+        # exponent of the SRS shared by all batch sizes (marlin); size it for the largest batch of the menu
+        config["zokrates"]["UNIVERSAL_SETUP_SIZE"] = universal_setup_size
+    config["context"]["ROOT_DIR"] = root_dir
+    config["context"]["code"]["CODE_FILE_NAME"] = code_file_name
+    config["context"]["code"]["TARGET_DIVISION"] = target_division
+    config["context"]["data"]["DATA_DIR"] = data_dir
+    config["context"]["contract"]["CONTRACT_FILE_NAME"] = contract_file_name
+    return config
+
+
+def generate_batch(batch_num: int, project_root: str, zokrates_bin_path: str, stdlib_path: str, proving_scheme: str,
+                   data_dir: str = None, conf_dir: str = None, mode: str = "unrolled", suffix: str = "",
+                   target_division: str = "circuit", universal_setup_size: int = None) -> str:
+    """ writes validate_batch{batch_num}{suffix}.zok and its configuration toml, returns the configuration path """
+    config = make_config(zokrates_bin_path, stdlib_path, proving_scheme, project_root + "zk_relay/zok_src/",
+                         "validate_batch{}{}.zok".format(batch_num, suffix),
+                         "data/batch{}/".format(batch_num) if data_dir is None else data_dir,
+                         "verifier{}.sol".format(batch_num), target_division, universal_setup_size)
 
     # export configuration toml file
-    with open(project_root + "/zk_relay/conf/config_batch{}.toml".format(batch_num), "w") as f:
+    conf_dir = project_root + "/zk_relay/conf/" if conf_dir is None else conf_dir
+    config_path = conf_dir + "config_batch{}{}.toml".format(batch_num, suffix)
+    with open(config_path, "w") as f:
         config_toml = toml.dumps(config)
         f.write(config_toml)
 
-    head_code = head_static_code.format(num=batch_num, num_minus_one=(batch_num-1), num_minus_two=(batch_num-2))
-    body_code = "".join([intermediate_code_block.format(loop=i) for i in range(batch_num)])
-    code = head_code + body_code + tail_static_code
-
+    code = generate_code(batch_num, mode, target_division)
     code_path = config["context"]["ROOT_DIR"] + config["context"]["code"]["CODE_DIR"] + config["context"]["code"]["CODE_FILE_NAME"]
     with open(code_path, "w") as f:
         f.write(code)
-    print("[Success] Configuration for batch {} completes.".format(batch_num))
+    return config_path
+
+
+def generate_test_config(root_dir: str, batch_num: int = None, proving_scheme: str = "g16", data_dir: str = "data/",
+                         config_path: str = None, universal_setup_size: int = None) -> str:
+    """
+    for tests: a configuration run by zokrates_libs/fake_zokrates.py, with its code under root_dir; returns its path
+    batch_num: validate_batch{batch_num}.zok as generate_code writes it, None for a one-line example.zok
+    """
+    if batch_num is None:
+        code_file_name, code = "example.zok", "def main(private field a, field b) -> bool:\n    return a * a == b\n"
+    else:
+        code_file_name, code = "validate_batch{}.zok".format(batch_num), generate_code(batch_num)
+    config = make_config(FAKE_ZOKRATES_PATH, root_dir + "stdlib", proving_scheme, root_dir, code_file_name, data_dir, "verifier.sol",
+                         universal_setup_size=universal_setup_size)
+    if config_path is None:
+        config_path = root_dir + ("config.toml" if batch_num is None else "config_batch{}.toml".format(batch_num))
+    os.makedirs(os.path.dirname(config_path), exist_ok=True)
+    os.makedirs(root_dir + "code", exist_ok=True)
+    with open(config_path, "w") as f:
+        toml.dump(config, f)
+    with open(root_dir + "code/" + code_file_name, "w") as f:
+        f.write(code)
+    return config_path
+
+
+def compare_modes(batch_nums: list, project_root: str, zokrates_bin_path: str, stdlib_path: str, proving_scheme: str,
+                  target_division: str = "circuit") -> list:
+    """ compiles the unrolled and the loop form of every batch size, returns compile time/memory/constraints of both """
+    from zokrates_libs.zokrates import Zokrates
+
+    compare_dir = project_root + "zk_relay/zok_src/compare/"
+    os.makedirs(compare_dir, exist_ok=True)
+    report = list()
+    for batch_num in batch_nums:
+        row = {"batch_num": batch_num, "target_division": target_division}
+        for mode in ["unrolled", "loop"]:
+            config_path = generate_batch(batch_num, project_root, zokrates_bin_path, stdlib_path, proving_scheme,
+                                         data_dir="compare/batch{}_{}/".format(batch_num, mode), conf_dir=compare_dir,
+                                         mode=mode, suffix="_" + mode, target_division=target_division)
+            row[mode] = Zokrates(config_path).compile().to_dict()
+        print("batch {}: unrolled {:.1f}s {} constraints, loop {:.1f}s {} constraints".format(
+            batch_num, row["unrolled"]["wall_time"], row["unrolled"]["constraints"], row["loop"]["wall_time"], row["loop"]["constraints"]))
+        report.append(row)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="batch num (integer)")
+    parser.add_argument("--project_root", "-r", required=False, default=os.path.dirname(os.path.abspath(__file__)) + "/", type=str)
+    parser.add_argument("--zokrates_bin_path", "-z", required=False, default="/Users/dc/research_project/ZoKrates/target/release/zokrates", type=str)
+    parser.add_argument("--stdlib_path", "-s", required=False, default="/Users/dc/research_project/ZoKrates/zokrates_stdlib/stdlib", type=str)
+    parser.add_argument("--proving_scheme", "-p", required=False, default="g16", type=str)
+    parser.add_argument("--batch_num", "-b", required=True, type=int, nargs="+")
+    parser.add_argument("--mode", "-m", required=False, default="unrolled", type=str, choices=["unrolled", "loop"])
+    parser.add_argument("--target_division", "-t", required=False, default="circuit", type=str, choices=["circuit", "hint"])
+    parser.add_argument("--compare", "-c", required=False, action="store_true", help="compile both forms and report compile cost")
+    parser.add_argument("--report", required=False, default=None, type=str, help="json path of the comparison report")
+    parser.add_argument("--universal_setup_size", "-u", required=False, default=None, type=int, help="SRS size exponent (marlin)")
+
+    # parse configuration arguments
+    args = parser.parse_args()
+
+    for batch_num in args.batch_num:
+        generate_batch(batch_num, args.project_root, args.zokrates_bin_path, args.stdlib_path, args.proving_scheme,
+                       mode=args.mode, target_division=args.target_division, universal_setup_size=args.universal_setup_size)
+        print("[Success] Configuration for batch {} completes.".format(batch_num))
+
+    if args.compare:
+        compare_report = compare_modes(args.batch_num, args.project_root, args.zokrates_bin_path, args.stdlib_path, args.proving_scheme,
+                                       args.target_division)
+        if args.report is not None:
+            with open(args.report, "w") as f:
+                f.write(json.dumps(compare_report, indent=4))
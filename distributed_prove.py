@@ -0,0 +1,70 @@
+import argparse
+
+import toml
+from bitcoinpy.client import BitcoinClient
+from zk_relay.epoch_index import EpochIndex
+from zk_relay.header_fetcher import HeaderFetcher
+from zk_relay.header_tree import HeaderTree
+from zk_relay.planner import BatchPlanner
+from zk_relay.proof_store import ProofStore
+from zk_relay.reorg import ReorgWatcher
+from zk_relay.work_queue import LEASE_TIMEOUT, Coordinator, WorkQueue, Worker
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="prove a height range on several hosts through a queue on a shared filesystem")
+    parser.add_argument("--queue_dir", "-q", required=False, default="./data/queue/", type=str)
+    parser.add_argument("--conf_dir", "-c", required=False, default="./zk_relay/conf/", type=str)
+    parser.add_argument("--lease", "-l", required=False, default=LEASE_TIMEOUT, type=float, help="seconds, the same on every host")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="submit the batches of a range and collect their proofs")
+    coordinator_parser.add_argument("--rpc_config", "-r", required=False, default="./rpc_config.toml", type=str)
+    coordinator_parser.add_argument("--from_height", "-f", required=True, type=int)
+    coordinator_parser.add_argument("--end_height", "-e", required=True, type=int)
+    coordinator_parser.add_argument("--proof_store", "-p", required=False, default="./data/proofs.sqlite", type=str)
+    coordinator_parser.add_argument("--epoch_index", "-x", required=False, default="./data/epoch_index.dat", type=str)
+    coordinator_parser.add_argument("--cost_report", "-k", required=False, default=None, type=str, help="benchmark_batch.py report")
+    coordinator_parser.add_argument("--retry_failed", "-t", action="store_true", help="queue again the batches that failed on every attempt")
+
+    worker_parser = subparsers.add_parser("worker", help="claim and prove jobs")
+    worker_parser.add_argument("--worker_id", "-w", required=False, default=None, type=str)
+    worker_parser.add_argument("--exit_when_idle", "-i", action="store_true")
+
+    # parse configuration arguments
+    args = parser.parse_args()
+    queue = WorkQueue(args.queue_dir, args.lease)
+
+    if args.role == "worker":
+        Worker(queue, args.conf_dir, args.worker_id).run(args.exit_when_idle)
+        exit()
+
+    # check whether rpc configuration file exists
+    rpc_config = None
+    try:
+        rpc_config = toml.load(args.rpc_config)
+    except FileNotFoundError:
+        print("[Error] There is no rpc config file.")
+        exit()
+    except toml.decoder.TomlDecodeError:
+        print("[Error] Invalid rpc config file.")
+        exit()
+
+    btc_cli = BitcoinClient(rpc_config["url"], rpc_config["id"], rpc_config["pwd"], rpc_config["wallet_name"])
+    header_fetcher = HeaderFetcher(rpc_config["url"], rpc_config["id"], rpc_config["pwd"])
+    epoch_index = EpochIndex(args.epoch_index)
+    proof_store = ProofStore(args.proof_store)
+
+    # batches are read from a header tree rooted at the first epoch head, and submitted again when a reorg replaces them
+    reorg_watcher = ReorgWatcher(None, HeaderTree(), proof_store, header_fetcher)
+    reorg_watcher.root_at(args.from_height // 2016 * 2016)
+    reorg_watcher.sync()
+    coordinator = Coordinator(queue, proof_store, BatchPlanner(args.conf_dir, args.cost_report), btc_cli, header_fetcher, epoch_index,
+                              reorg_watcher)
+    next_height = coordinator.submit_range(args.from_height, args.end_height, args.retry_failed)
+    if next_height <= args.end_height:
+        print(">>> heights from {} wait for more headers".format(next_height))
+    collected = coordinator.run()
+    print("[Success] {} proofs collected into {}".format(len(collected), args.proof_store))
+    header_fetcher.close()
+    epoch_index.close()
+    proof_store.close()
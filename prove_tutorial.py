@@ -4,16 +4,22 @@ import os
 import toml
 from bitcoinpy.client import BitcoinClient
 from zk_relay.actor import Actor
+from zokrates_libs import tracing
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="batch num (integer)")
     parser.add_argument("--rpc_config", "-r", required=False, default="./rpc_config.toml", type=str)
     parser.add_argument("--batch_num", "-b", required=True, type=int, nargs=1)
+    parser.add_argument("--from_height", "-f", required=False, default=647134, type=int)
+    parser.add_argument("--end_height", "-e", required=False, default=None, type=int)
+    parser.add_argument("--trace", "-t", required=False, default=None, type=str, help="write a chrome trace (json) to this path")
 
     # parse configuration arguments
     args = parser.parse_args()
     rpc_config_path = args.rpc_config
     batch_num = args.batch_num[0]
+    from_height = args.from_height
+    end_height = from_height + batch_num - 1 if args.end_height is None else args.end_height
 
     # check whether rpc configuration file exists
     rpc_config = None
@@ -26,17 +32,24 @@ if __name__ == "__main__":
         print("[Error] Invalid rpc config file.")
         exit()
 
-    zok_config_path = "./zk_relay/conf/config_batch{}.toml".format(3)
+    zok_config_path = "./zk_relay/conf/config_batch{}.toml".format(batch_num)
     if not os.path.exists(zok_config_path):
         print("[Error] The setup for batch {} was not executed".format(batch_num))
         exit()
 
+    if args.trace is not None:
+        tracing.enable()
+
     btc_cli = BitcoinClient(rpc_config["url"], rpc_config["id"], rpc_config["pwd"], rpc_config["wallet_name"])
     actor = Actor(btc_cli, zok_config_path)
 
     # generate proof
-    actor.build_input_and_prove(647134, 647136)
+    actor.build_input_and_prove(from_height, end_height)
 
     # flattening proof
     flat_proof = actor.flatten_proof()
     print(flat_proof)
+
+    if args.trace is not None:
+        tracing.get_tracer().export_chrome(args.trace)
+        tracing.get_tracer().print_summary()
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import os
+import signal
+
+import toml
+from bitcoinpy.client import BitcoinClient
+from zk_relay.actor import Actor
+from zk_relay.epoch_index import EpochIndex
+from zk_relay.header_fetcher import HeaderFetcher
+from zk_relay.header_tree import HeaderTree
+from zk_relay.proof_store import ProofStore
+from zk_relay.relayer import Relayer
+from zk_relay.reorg import ReorgWatcher
+from zokrates_libs import tracing
+
+
+async def relay(relayer: Relayer):
+    loop = asyncio.get_running_loop()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(sig, relayer.stop)
+    await relayer.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="relay proofs of new bitcoin headers")
+    parser.add_argument("--rpc_config", "-r", required=False, default="./rpc_config.toml", type=str)
+    parser.add_argument("--batch_num", "-b", required=True, type=int)
+    parser.add_argument("--start_height", "-f", required=True, type=int)
+    parser.add_argument("--poll_interval", "-i", required=False, default=30, type=float)
+    parser.add_argument("--confirmations", "-c", required=False, default=0, type=int)
+    parser.add_argument("--epoch_index", "-x", required=False, default="./data/epoch_index.dat", type=str)
+    parser.add_argument("--proof_store", "-p", required=False, default="./data/proofs.sqlite", type=str)
+    parser.add_argument("--verify", "-v", action="store_true", help="verify each proof before emitting it")
+    parser.add_argument("--trace", "-t", required=False, default=None, type=str, help="write a chrome trace (json) to this path on exit")
+    parser.add_argument("--trace_events", "-e", required=False, default=tracing.MAX_EVENTS, type=int, help="latest spans kept for the trace")
+
+    # parse configuration arguments
+    args = parser.parse_args()
+
+    # check whether rpc configuration file exists
+    rpc_config = None
+    try:
+        rpc_config = toml.load(args.rpc_config)
+    except FileNotFoundError:
+        print("[Error] There is no rpc config file.")
+        exit()
+    except toml.decoder.TomlDecodeError:
+        print("[Error] Invalid rpc config file.")
+        exit()
+
+    zok_config_path = "./zk_relay/conf/config_batch{}.toml".format(args.batch_num)
+    if not os.path.exists(zok_config_path):
+        print("[Error] The setup for batch {} was not executed".format(args.batch_num))
+        exit()
+
+    if args.trace is not None:
+        tracing.enable(args.trace_events)
+
+    btc_cli = BitcoinClient(rpc_config["url"], rpc_config["id"], rpc_config["pwd"], rpc_config["wallet_name"])
+    header_fetcher = HeaderFetcher(rpc_config["url"], rpc_config["id"], rpc_config["pwd"])
+    epoch_index = EpochIndex(args.epoch_index)
+    # the epoch head is the checkpoint: batches from start_height are read from the tree and re-proved on a reorg
+    header_tree = HeaderTree()
+    actor = Actor(btc_cli, zok_config_path, header_fetcher, epoch_index, header_tree)
+
+    proof_store = ProofStore(args.proof_store)
+    reorg_watcher = ReorgWatcher(actor, header_tree, proof_store, header_fetcher)
+    reorg_watcher.root_at(args.start_height // 2016 * 2016)
+    relayer = Relayer(actor, header_fetcher, args.start_height, args.batch_num, poll_interval=args.poll_interval,
+                      confirmations=args.confirmations, proof_store=proof_store, verify_proofs=args.verify, reorg_watcher=reorg_watcher)
+    asyncio.run(relay(relayer))
+    header_fetcher.close()
+    epoch_index.close()
+    proof_store.close()
+
+    if args.trace is not None:
+        tracing.get_tracer().export_chrome(args.trace)
+        tracing.get_tracer().print_summary()
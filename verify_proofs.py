@@ -0,0 +1,45 @@
+import argparse
+import os
+
+from zk_relay.proof_store import ProofStore, vkey_hash
+from zokrates_libs.verifier import BulkVerifier
+from zokrates_libs.zokrates import Zokrates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="verify stored proofs against the verification keys of their batch sizes")
+    parser.add_argument("--batch_num", "-b", required=True, type=int, nargs="+")
+    parser.add_argument("--proof_store", "-p", required=False, default="./data/proofs.sqlite", type=str)
+    parser.add_argument("--from_height", "-f", required=False, default=0, type=int)
+    parser.add_argument("--end_height", "-e", required=False, default=2 ** 62, type=int)
+    parser.add_argument("--workers", "-w", required=False, default=None, type=int)
+
+    # parse configuration arguments
+    args = parser.parse_args()
+
+    if not os.path.exists(args.proof_store):
+        print("[Error] There is no proof store: {}".format(args.proof_store))
+        exit()
+    proof_store = ProofStore(args.proof_store)
+
+    failed = list()
+    for batch_num in args.batch_num:
+        zok_config_path = "./zk_relay/conf/config_batch{}.toml".format(batch_num)
+        if not os.path.exists(zok_config_path):
+            print("[Error] The setup for batch {} was not executed".format(batch_num))
+            continue
+        zok_cli = Zokrates(zok_config_path)
+
+        # only proofs made with the current verification key of this batch size
+        records = proof_store.query(args.from_height, args.end_height, zok_cli.proving_scheme, vkey_hash(zok_cli.vkey_path))
+        verifier = BulkVerifier(zok_cli, args.workers)
+        results = verifier.verify_all({(record.start_height, record.end_height): record.proof_json() for record in records})
+
+        num_passed = len([passed for passed in results.values() if passed])
+        print(">>> batch {}: {} proofs, {} passed, {} failed, {} errors".format(
+            batch_num, len(records), num_passed, len(results) - num_passed, len(verifier.failed)))
+        failed += [height_range for height_range, passed in results.items() if not passed] + list(verifier.failed.keys())
+
+    for from_height, end_height in sorted(failed):
+        print("[Error] proof of [{}, {}] is invalid".format(from_height, end_height))
+    proof_store.close()
+    exit(1 if len(failed) > 0 else 0)
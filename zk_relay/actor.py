@@ -1,8 +1,20 @@
 import json
+import os
+import shutil
 
 from bitcoinpy.base.header import Header
 from bitcoinpy.client import BitcoinClient
-from zk_relay.utils import padding, split_hex_to_int_array
+from config_batch import generate_test_config
+from zk_relay.bitcoin_mock.bitcoin_mock import BTCMock, SyntheticBTCMock
+from zk_relay.bitcoin_mock.synthetic_chain import SyntheticChain
+from zk_relay.calldata import flatten_proof_json
+from zk_relay.epoch_index import INDEX_DEPTH, EpochIndex
+from zk_relay.header_fetcher import HeaderFetcher
+from zk_relay.header_tree import HeaderTree
+from zk_relay.encoder import encode_input
+from zk_relay.proof_store import ProofRecord, ProofStore
+from zk_relay.reference import EPOCH_LENGTH, HEADER_BYTE_LEN, batch_retarget_hint, check_proof_inputs, predict_outputs, time_and_bits_word
+from zokrates_libs import tracing
 from zokrates_libs.zokrates import Zokrates
 
 from unittest import TestCase
@@ -10,23 +22,33 @@ import toml
 
 
 class Actor:
-    def __init__(self, btc_cli: BitcoinClient, zok_config_path: str):
+    def __init__(self, btc_cli: BitcoinClient, zok_config_path: str, header_fetcher: HeaderFetcher = None, epoch_index: EpochIndex = None,
+                 header_tree: HeaderTree = None, index_depth: int = INDEX_DEPTH):
         self.btc_cli = btc_cli
         self.zok_cli = Zokrates(zok_config_path)
-
-    def build_input(self, start_height: int, end_height) -> (Header, list):
-        epoch_head: Header = Header.from_raw_str(self.btc_cli.get_block_header_by_height(start_height // 2016 * 2016))
-        epoch_head_time_and_bits: str = epoch_head.get_word_of_single_word(4).hex()
-
-        headers: list = self._get_header_batch(start_height, end_height)
-
-        blocks: str = ""
-        for i in range(len(headers)):
-            blocks += padding(headers[i].raw_header_str())
-
-        encoded_input = list()
-        encoded_input.append(int(epoch_head_time_and_bits, 16))
-        encoded_input += split_hex_to_int_array(blocks, 4)
+        self.header_fetcher = header_fetcher
+        # epoch heads already seen are not fetched again; only validated headers index_depth blocks below the tip are recorded
+        self.epoch_index = epoch_index
+        self.index_depth = index_depth
+        # headers are read from the best chain of the tree when it has them (see reorg.py)
+        self.header_tree = header_tree
+        # "hint": the circuit takes the retarget quotient/remainder as private inputs (see config_batch.py)
+        self.target_division = self.zok_cli.config["context"]["code"].get("TARGET_DIVISION", "circuit")
+
+    @tracing.traced()
+    def build_input(self, start_height: int, end_height, tip_height: int = None) -> (Header, list):
+        """ tip_height: the tip as the caller last saw it, for the epoch index; the node is never asked for it """
+        raw_headers = self._get_raw_header_batch(start_height, end_height)
+        epoch_head_time_and_bits: str = self._get_epoch_head_time_and_bits(start_height)
+
+        # reject a bad range before zokrates spends time on it
+        self._predict_outputs(int(epoch_head_time_and_bits, 16), raw_headers, start_height, end_height)
+        if self.epoch_index is not None:
+            self._observe(start_height, raw_headers, int(epoch_head_time_and_bits, 16), tip_height)
+
+        encoded_input = encode_input(int(epoch_head_time_and_bits, 16), raw_headers)
+        if self.target_division == "hint":
+            encoded_input += list(batch_retarget_hint(int(epoch_head_time_and_bits, 16), raw_headers))
         return encoded_input
 
     def setup_and_export_verifier(self):
@@ -35,30 +57,109 @@ class Actor:
         print(">>> exporting verifier")
         self.zok_cli.export_verifier()
 
-    def build_input_and_prove(self, from_height: int, end_height: int):
+    def build_input_and_prove(self, from_height: int, end_height: int) -> list:
         print(">>> build input to be entered to zokrates program")
         encoded_input = self.build_input(from_height, end_height)
         print(">>> generate proof")
-        self.zok_cli.prove(encoded_input)
+        return self.zok_cli.prove(encoded_input)
 
-    def flatten_proof(self) -> str:
-        with open(self.zok_cli.proof_path, "r") as json_data:
+    def flatten_proof(self, proof_path: str = None) -> str:
+        proof_path = self.zok_cli.proof_path if proof_path is None else proof_path
+        with open(proof_path, "r") as json_data:
             proof_json = json.load(json_data)
-        proof = list()
-        proof.append(proof_json["proof"]["a"])
-        proof.append(proof_json["proof"]["b"])
-        proof.append(proof_json["proof"]["c"])
-        contract_input = [proof, proof_json["inputs"]]
-        return json.dumps(contract_input)[1:-1]
+        return flatten_proof_json(proof_json, self.zok_cli.proving_scheme)
 
+    def store_proof(self, proof_store: ProofStore, from_height: int, end_height: int, proof_path: str = None) -> ProofRecord:
+        """ records a proof with its calldata under the scheme and verification key of this actor """
+        proof_path = self.zok_cli.proof_path if proof_path is None else proof_path
+        return proof_store.put_file(from_height, end_height, self.zok_cli.proving_scheme, self.zok_cli.vkey_path, proof_path)
+
+    def check_proof(self, start_height: int, end_height: int, proof_path: str = None) -> bool:
+        """ cross-check public inputs of proof.json against the outputs predicted by the reference model """
+        proof_path = self.zok_cli.proof_path if proof_path is None else proof_path
+        with open(proof_path, "r") as json_data:
+            proof_json = json.load(json_data)
+        return self.check_proof_json(start_height, end_height, proof_json)
+
+    def check_proof_json(self, start_height: int, end_height: int, proof_json: dict) -> bool:
+        epoch_head_time_and_bits = int(self._get_epoch_head_time_and_bits(start_height), 16)
+        raw_headers = self._get_raw_header_batch(start_height, end_height)
+        outputs = self._predict_outputs(epoch_head_time_and_bits, raw_headers, start_height, end_height)
+        return check_proof_inputs(proof_json, epoch_head_time_and_bits, outputs)
+
+    @tracing.traced()
+    def _get_epoch_head_time_and_bits(self, start_height: int) -> str:
+        epoch_head_height = start_height // 2016 * 2016
+        if self.header_tree is not None and self.header_tree.best_hash(epoch_head_height) is not None:
+            raw_epoch_head = self.header_tree.best_raw_range(epoch_head_height, epoch_head_height)
+            return "{:032x}".format(time_and_bits_word(raw_epoch_head))
+        if self.epoch_index is not None:
+            epoch_head_time_and_bits = self.epoch_index.head_time_and_bits(start_height)
+            if epoch_head_time_and_bits is not None:
+                return "{:032x}".format(epoch_head_time_and_bits)
+        if self.header_fetcher is not None and not isinstance(self.btc_cli, BTCMock):
+            return "{:032x}".format(time_and_bits_word(self.header_fetcher.get_raw_headers(epoch_head_height, epoch_head_height)))
+        raw_epoch_head = self.btc_cli.get_block_header_by_height(epoch_head_height)
+        epoch_head: Header = Header.from_raw_str(raw_epoch_head)
+        return epoch_head.get_word_of_single_word(4).hex()
+
+    def _observe(self, start_height: int, raw_headers: memoryview, epoch_head_time_and_bits: int, tip_height: int = None) -> int:
+        """ records the epoch boundaries of a validated range, as far as index_depth blocks below the tip; nothing when the tip is unknown """
+        end_height = start_height + len(raw_headers) // HEADER_BYTE_LEN - 1
+        epoch_head_height = start_height // EPOCH_LENGTH * EPOCH_LENGTH
+        recorded_head = self.epoch_index.head_time_and_bits(start_height) is not None
+        # the tip is only asked for when there is something to record
+        if recorded_head and end_height < epoch_head_height + EPOCH_LENGTH - 1:
+            return 0
+        tip_height = self._known_tip_height(tip_height)
+        if tip_height is None:
+            return 0
+        deep_height = tip_height - self.index_depth
+        written = 0
+        if not recorded_head and epoch_head_height <= deep_height:
+            written += self.epoch_index.observe_head(epoch_head_height, epoch_head_time_and_bits)
+        if start_height <= deep_height:
+            num = min(end_height, deep_height) - start_height + 1
+            written += self.epoch_index.observe(start_height, raw_headers[:num * HEADER_BYTE_LEN])
+        return written
+
+    def _known_tip_height(self, tip_height: int = None) -> int:
+        """ the tip given by the caller, followed by the header tree or held by a synthetic chain; None instead of an rpc call """
+        if tip_height is not None:
+            return tip_height
+        if self.header_tree is not None and self.header_tree.tip is not None:
+            return self.header_tree.tip_height
+        if isinstance(self.btc_cli, SyntheticBTCMock):
+            return self.btc_cli.get_block_count()
+        return None
+
+    @staticmethod
+    def _predict_outputs(epoch_head_time_and_bits: int, raw_headers: memoryview, start_height: int, end_height: int) -> list:
+        try:
+            return predict_outputs(epoch_head_time_and_bits, raw_headers)
+        except Exception as e:
+            raise Exception("Invalid header range [{}, {}]: {}".format(start_height, end_height, e))
+
+    @tracing.traced()
     def _get_header_batch(self, from_height: int, to_height: int):
-        headers = list()
+        raw_headers = self._get_raw_header_batch(from_height, to_height)
+        return [Header.from_raw_str(raw_headers[i * 80:(i + 1) * 80].hex()) for i in range(len(raw_headers) // 80)]
+
+    @tracing.traced()
+    def _get_raw_header_batch(self, from_height: int, to_height: int) -> memoryview:
+        if self.header_tree is not None and self.header_tree.best_hash(from_height) is not None \
+                and self.header_tree.best_hash(to_height) is not None:
+            return memoryview(self.header_tree.best_raw_range(from_height, to_height))
+        if isinstance(self.btc_cli, BTCMock):
+            # one slice of the local header store instead of a lookup per height
+            return self.btc_cli.get_raw_headers_by_range(from_height, to_height)
+        if self.header_fetcher is not None:
+            return memoryview(self.header_fetcher.get_raw_headers(from_height, to_height))
+        raw_headers = list()
         while from_height <= to_height:
-            raw_header = self.btc_cli.get_block_header_by_height(from_height)  # TODO change btc_cli to btc_mock?
-            header = Header.from_raw_str(raw_header)
-            headers.append(header)
+            raw_headers.append(bytes.fromhex(self.btc_cli.get_block_header_by_height(from_height)))
             from_height += 1
-        return headers
+        return memoryview(b"".join(raw_headers))
 
 
 class ActorTest(TestCase):
@@ -85,3 +186,65 @@ class ActorTest(TestCase):
         # generate input of zokrates program
         encoded_input = self.actor.build_input(647130, 647136)
         self.actor.zok_cli.prove(encoded_input)
+
+
+class SyntheticActorTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = "./test_actor/"
+        generate_test_config(self.dir, 2)
+        self.chain = SyntheticChain(self.dir + "headers.dat")
+        self.epoch_index = EpochIndex(self.dir + "epoch_index.dat")
+        self.actor = Actor(SyntheticBTCMock(self.chain), self.dir + "config_batch2.toml", epoch_index=self.epoch_index, index_depth=6)
+
+    def tearDown(self) -> None:
+        self.epoch_index.close()
+        self.chain.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_build_input(self):
+        self.chain.mine(8)
+        raw_headers = self.chain.store.get_range(2, 3)
+        head_word = time_and_bits_word(self.chain.store.get(0))
+        self.assertEqual(encode_input(head_word, raw_headers), self.actor.build_input(2, 3))
+        with self.assertRaisesRegex(Exception, "outside of the synthetic chain"):
+            self.actor.build_input(8, 9)
+
+    def test_chain_above_genesis(self):
+        self.chain.close()
+        self.chain = SyntheticChain(self.dir + "headers_4032.dat", base_height=2 * EPOCH_LENGTH)
+        self.chain.mine(4)
+        actor = Actor(SyntheticBTCMock(self.chain), self.dir + "config_batch2.toml")
+        self.assertEqual(time_and_bits_word(self.chain.store.get(2 * EPOCH_LENGTH)), actor.build_input(4034, 4035)[0])
+        # heights below the chain are not served by a node either
+        with self.assertRaisesRegex(Exception, "outside of the synthetic chain"):
+            actor.build_input(4030, 4031)
+
+    def test_index_depth(self):
+        self.chain.mine(4)
+        encoded_input = self.actor.build_input(0, 1)
+        self.assertEqual(time_and_bits_word(self.chain.store.get(0)), encoded_input[0])
+        # the epoch head is not recorded while a reorg can still replace it
+        self.assertIsNone(self.epoch_index.head_time_and_bits(0))
+
+        self.chain.mine(4)
+        self.assertEqual(encoded_input, self.actor.build_input(0, 1))
+        self.assertEqual(time_and_bits_word(self.chain.store.get(0)), self.epoch_index.head_time_and_bits(1))
+
+    def test_index_without_tip(self):
+        class NoTipFetcher(HeaderFetcher):
+            def get_block_count(self) -> int:
+                raise Exception("build_input asked the node for its tip")
+
+        self.chain.mine(8)
+        rpc = self.chain.serve()
+        fetcher = NoTipFetcher(rpc.url, "id", "pwd")
+        actor = Actor(None, self.dir + "config_batch2.toml", fetcher, self.epoch_index, index_depth=6)
+        try:
+            encoded_input = actor.build_input(0, 1)
+            self.assertIsNone(self.epoch_index.head_time_and_bits(0))
+            # the caller knows the tip
+            self.assertEqual(encoded_input, actor.build_input(0, 1, tip_height=self.chain.tip_height))
+            self.assertEqual(time_and_bits_word(self.chain.store.get(0)), self.epoch_index.head_time_and_bits(0))
+        finally:
+            fetcher.close()
+            rpc.stop()
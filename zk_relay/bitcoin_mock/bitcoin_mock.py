@@ -1,37 +1,83 @@
 from bitcoinpy.base.header import Header
 from bitcoinpy.client import BitcoinClient
+from zk_relay.bitcoin_mock.header_store import HeaderStore
+from zk_relay.header_fetcher import HeaderFetcher
+from zokrates_libs import tracing
 import os
-import json
+
+MAX_STORE_GAP = 2016  # headers fetched to fill the gap between the store tip and a requested range; farther ranges are not stored
 
 
 class BTCMock(BitcoinClient):
     def __init__(self, url: str, id: str, pwd: str, wallet_name: str):
         super().__init__(url, id, pwd, wallet_name)
         self.DIRECTORY_DATABASE_PATH = "data"
+        self.header_fetcher = HeaderFetcher(url, id, pwd)
+        self.header_store = HeaderStore(self.DIRECTORY_DATABASE_PATH + "/mainnet_headers.dat")
+
+        # migrate headers stored by the former one-json-file-per-height layout
+        if self.header_store.count == 0 and os.path.isdir(self.DIRECTORY_DATABASE_PATH):
+            self.header_store.import_json_dir(self.DIRECTORY_DATABASE_PATH, "mainnet")
 
     def query_and_store_batch_headers(self, start_height: int, end_height: int):
         """ query and store block which have heights from """
         print("start_height: {}, end_height: {}, num_blocks: {}".format(start_height, end_height, end_height - start_height + 1))
-        os.makedirs(self.DIRECTORY_DATABASE_PATH, exist_ok=True)
-        for i in range(end_height - start_height + 1):
-            self.get_header_by_height(start_height + i)
+        self._store_up_to(start_height, end_height)
 
+    @tracing.traced("BTCMock.get_header_by_height", "btc")
     def get_header_by_height(self, height: int) -> Header:
-        os.makedirs(self.DIRECTORY_DATABASE_PATH, exist_ok=True)
-        block_path = self.DIRECTORY_DATABASE_PATH + "/mainnet_{}.json".format(height)
-        if not os.path.exists(block_path):
-            header_str = self.get_block_header_by_height(height)
-            with open(block_path, "w") as f:
-                contents = {"hex": header_str}
-                f.write(json.dumps(contents))
-
-        if os.path.exists(block_path):
-            with open(block_path, "r") as json_data:
-                header_str = json.load(json_data)["hex"]
-        header_obj = Header.from_raw_str(header_str)
+        header_obj = Header.from_raw_str(self.get_raw_headers_by_range(height, height).hex())
         header_obj.height = height
         return header_obj
 
+    def get_raw_headers_by_range(self, from_height: int, to_height: int) -> memoryview:
+        """ concatenated raw headers of heights [from_height, to_height], a slice of the mmap-ed store """
+        with tracing.span("BTCMock.get_raw_headers_by_range", "btc", num_headers=to_height - from_height + 1) as span:
+            if self.header_store.count > 0 and (from_height < self.header_store.base_height
+                                                or from_height > self.header_store.tip_height + 1 + MAX_STORE_GAP):
+                # the store only grows forward and contiguously; older heights and heights far above the tip are
+                # served directly from the node
+                span.set(hit=False)
+                return memoryview(self.header_fetcher.get_raw_headers(from_height, to_height))
+            span.set(hit=self.header_store.count > 0 and to_height <= self.header_store.tip_height)
+            self._store_up_to(from_height, to_height)
+            return self.header_store.get_range(from_height, to_height)
+
+    def _store_up_to(self, from_height: int, to_height: int):
+        # headers are appended contiguously from the tip of the store (or from from_height when empty)
+        height = from_height if self.header_store.count == 0 else self.header_store.tip_height + 1
+        while height <= to_height:
+            chunk_end = min(height + 2015, to_height)
+            self.header_store.extend(height, self.header_fetcher.get_raw_headers(height, chunk_end))
+            height = chunk_end + 1
+
+
+class SyntheticBTCMock(BTCMock):
+    """
+    BTCMock over the header store of a SyntheticChain, with no node behind it: the client and the store of BTCMock are
+    not initialized and every height is served from the chain (SyntheticChain.serve gives a node for HeaderFetcher)
+    """
+    def __init__(self, chain):
+        self.chain = chain
+        self.header_store = chain.store
+        self.header_fetcher = None
+
+    def get_block_count(self) -> int:
+        return self.chain.tip_height
+
+    def get_block_header_by_height(self, height: int) -> str:
+        return bytes(self.get_raw_headers_by_range(height, height)).hex()
+
+    def get_raw_headers_by_range(self, from_height: int, to_height: int) -> memoryview:
+        if from_height < self.chain.base_height or to_height > self.chain.tip_height:
+            raise Exception("Heights [{}, {}] are outside of the synthetic chain [{}, {}]".format(
+                from_height, to_height, self.chain.base_height, self.chain.tip_height))
+        return self.header_store.get_range(from_height, to_height)
+
+    def query_and_store_batch_headers(self, start_height: int, end_height: int):
+        """ the chain is only extended by SyntheticChain.mine """
+        self.get_raw_headers_by_range(start_height, end_height)
+
 
 # TODO testcase
 if __name__ == "__main__":
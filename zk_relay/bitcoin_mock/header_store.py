@@ -0,0 +1,159 @@
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+from unittest import TestCase
+
+HEADER_BYTE_LEN = 80
+MAGIC = b"ZKHS"
+VERSION = 1
+META_FORMAT = ">4sIQ"  # magic, version, base height
+META_BYTE_LEN = struct.calcsize(META_FORMAT)
+
+
+class HeaderStore:
+    """
+    append-only file of fixed 80-bytes raw headers indexed by height, read through mmap
+    layout: [magic | version | base height] followed by the header of base height, base height + 1, ...
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._mmap = None
+        self.base_height = None
+        self.count = 0
+        self._recover()
+
+    def _recover(self):
+        """ drop a torn trailing record left by a crash during append """
+        size = os.fstat(self._fd).st_size
+        if size < META_BYTE_LEN:
+            os.ftruncate(self._fd, 0)
+            return
+        magic, version, base_height = struct.unpack(META_FORMAT, os.pread(self._fd, META_BYTE_LEN, 0))
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Invalid header store file: {}".format(self.path))
+        self.base_height = base_height
+        self.count = (size - META_BYTE_LEN) // HEADER_BYTE_LEN
+        valid_size = META_BYTE_LEN + self.count * HEADER_BYTE_LEN
+        if valid_size != size:
+            os.ftruncate(self._fd, valid_size)
+            os.fsync(self._fd)
+
+    @property
+    def tip_height(self) -> int:
+        """ height of the last stored header (base height - 1 when empty) """
+        if self.base_height is None:
+            return -1
+        return self.base_height + self.count - 1
+
+    def contains(self, height: int) -> bool:
+        return self.base_height is not None and self.base_height <= height <= self.tip_height
+
+    def append(self, height: int, raw_header: bytes):
+        self.extend(height, raw_header)
+
+    def extend(self, start_height: int, raw_headers: bytes):
+        """ appends contiguous headers starting at start_height; durable when this returns """
+        if len(raw_headers) % HEADER_BYTE_LEN != 0:
+            raise Exception("Headers length should be multiple of {}: {}".format(HEADER_BYTE_LEN, len(raw_headers)))
+        if len(raw_headers) == 0:
+            return
+        if self.base_height is None:
+            os.write(self._fd, struct.pack(META_FORMAT, MAGIC, VERSION, start_height))
+            self.base_height = start_height
+        elif start_height != self.tip_height + 1:
+            raise Exception("Expected height {}, but {}".format(self.tip_height + 1, start_height))
+        os.write(self._fd, raw_headers)
+        os.fsync(self._fd)
+        self.count += len(raw_headers) // HEADER_BYTE_LEN
+
+    def get(self, height: int) -> memoryview:
+        return self.get_range(height, height)
+
+    def get_range(self, from_height: int, to_height: int) -> memoryview:
+        """ zero-copy slice of the raw headers of heights [from_height, to_height] """
+        if not (self.contains(from_height) and self.contains(to_height) and from_height <= to_height):
+            raise Exception("Heights [{}, {}] are not in the store [{}, {}]".format(from_height, to_height, self.base_height, self.tip_height))
+        view = self._view()
+        start = META_BYTE_LEN + (from_height - self.base_height) * HEADER_BYTE_LEN
+        return view[start:start + (to_height - from_height + 1) * HEADER_BYTE_LEN]
+
+    def _view(self) -> memoryview:
+        size = META_BYTE_LEN + self.count * HEADER_BYTE_LEN
+        if self._mmap is None or len(self._mmap) < size:
+            # views handed out earlier keep the previous mapping alive
+            self._mmap = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def import_json_dir(self, directory: str, network: str = "mainnet") -> int:
+        """ bulk import of BTCMock's {network}_{height}.json files; imports the contiguous run after the tip """
+        pattern = re.compile(r"^{}_(\d+)\.json$".format(network))
+        heights = sorted([int(m.group(1)) for m in [pattern.match(name) for name in os.listdir(directory)] if m])
+        if len(heights) == 0:
+            return 0
+        height = heights[0] if self.base_height is None else self.tip_height + 1
+        available = set(heights)
+        chunk = list()
+        imported = 0
+        while height in available:
+            with open(os.path.join(directory, "{}_{}.json".format(network, height)), "r") as json_data:
+                chunk.append(bytes.fromhex(json.load(json_data)["hex"]))
+            height += 1
+            if len(chunk) == 2016:
+                self.extend(height - len(chunk), b"".join(chunk))
+                imported += len(chunk)
+                chunk = list()
+        self.extend(height - len(chunk), b"".join(chunk))
+        return imported + len(chunk)
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # a caller still holds a slice; the mapping is released with it
+                pass
+            self._mmap = None
+        os.close(self._fd)
+
+
+class HeaderStoreTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = "./test_header_store/"
+        os.makedirs(self.dir, exist_ok=True)
+        self.store = HeaderStore(self.dir + "headers.dat")
+
+    def tearDown(self) -> None:
+        self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_append_and_range(self):
+        self.store.append(100, bytes([1]) * 80)
+        self.store.extend(101, bytes([2]) * 80 + bytes([3]) * 80)
+        self.assertEqual(102, self.store.tip_height)
+        self.assertEqual(bytes([2]) * 80, bytes(self.store.get(101)))
+        self.assertEqual(bytes([2]) * 80 + bytes([3]) * 80, bytes(self.store.get_range(101, 102)))
+        with self.assertRaises(Exception):
+            self.store.append(104, bytes(80))
+
+    def test_torn_append_is_dropped(self):
+        self.store.extend(7, bytes([1]) * 160)
+        self.store.close()
+        with open(self.dir + "headers.dat", "ab") as f:
+            f.write(bytes(30))
+        self.store = HeaderStore(self.dir + "headers.dat")
+        self.assertEqual(8, self.store.tip_height)
+        self.store.append(9, bytes([9]) * 80)
+        self.assertEqual(bytes([9]) * 80, bytes(self.store.get(9)))
+
+    def test_import_json_dir(self):
+        for height in [5, 6, 7, 9]:
+            with open(self.dir + "mainnet_{}.json".format(height), "w") as f:
+                f.write(json.dumps({"hex": (bytes([height]) * 80).hex()}))
+        self.assertEqual(3, self.store.import_json_dir(self.dir))
+        self.assertEqual(7, self.store.tip_height)
+        self.assertEqual(bytes([6]) * 80, bytes(self.store.get(6)))
@@ -0,0 +1,109 @@
+import json
+import threading
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LocalBitcoinRpc:
+    """
+    stand-in bitcoind JSON-RPC server (single and batch requests) serving a fixed list of raw headers
+    supports getblockcount, getbestblockhash, getblockhash and getblockheader
+    """
+    def __init__(self, raw_headers: list, base_height: int = 0, host: str = "127.0.0.1", port: int = 0):
+        self.raw_headers = raw_headers
+        self.base_height = base_height
+        self.hash_to_index = {sha256(sha256(raw).digest()).digest()[::-1].hex(): i for i, raw in enumerate(raw_headers)}
+        self.num_requests = 0
+        self.fail_next = 0  # number of upcoming http requests answered with 500
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def append(self, raw_header: bytes):
+        with self._lock:
+            self.hash_to_index[sha256(sha256(raw_header).digest()).digest()[::-1].hex()] = len(self.raw_headers)
+            self.raw_headers.append(raw_header)
+
+    def reorg(self, fork_height: int, raw_headers: list):
+        """ replaces the headers above fork_height with another branch """
+        with self._lock:
+            index = fork_height - self.base_height + 1
+            for raw in self.raw_headers[index:]:
+                del self.hash_to_index[sha256(sha256(raw).digest()).digest()[::-1].hex()]
+            self.raw_headers = self.raw_headers[:index]
+            for raw in raw_headers:
+                self.hash_to_index[sha256(sha256(raw).digest()).digest()[::-1].hex()] = len(self.raw_headers)
+                self.raw_headers.append(raw)
+
+    def start(self) -> "LocalBitcoinRpc":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def call(self, method: str, params: list):
+        with self._lock:
+            tip_height = self.base_height + len(self.raw_headers) - 1
+            if method == "getblockcount":
+                return tip_height
+            if method == "getbestblockhash":
+                return sha256(sha256(self.raw_headers[-1]).digest()).digest()[::-1].hex()
+            if method == "getblockhash":
+                if not self.base_height <= params[0] <= tip_height:
+                    raise Exception("Block height out of range")
+                raw = self.raw_headers[params[0] - self.base_height]
+                return sha256(sha256(raw).digest()).digest()[::-1].hex()
+            if method == "getblockheader":
+                if params[0] not in self.hash_to_index:
+                    raise Exception("Block not found")
+                index = self.hash_to_index[params[0]]
+                raw = self.raw_headers[index]
+                if len(params) > 1 and not params[1]:
+                    return raw.hex()
+                return {"hash": params[0], "height": self.base_height + index, "hex": raw.hex()}
+        raise Exception("Method not found")
+
+    def _respond(self, request: dict) -> dict:
+        try:
+            return {"result": self.call(request["method"], request.get("params", [])), "error": None, "id": request.get("id")}
+        except Exception as e:
+            return {"result": None, "error": {"code": -8, "message": str(e)}, "id": request.get("id")}
+
+    def _handler_class(self):
+        rpc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, as bitcoind
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with rpc._lock:
+                    rpc.num_requests += 1
+                    failing = rpc.fail_next > 0
+                    rpc.fail_next -= 1 if failing else 0
+                if failing:
+                    body = b"{}"
+                    self.send_response(500)
+                else:
+                    response = [rpc._respond(request) for request in payload] if isinstance(payload, list) else rpc._respond(payload)
+                    body = json.dumps(response).encode()
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
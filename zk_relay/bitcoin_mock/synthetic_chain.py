@@ -0,0 +1,182 @@
+""" Synthetic header chain mined at an easy target, for offline tests of the fetch, store, encode and prove pipeline. """
+import argparse
+import shutil
+import time
+from hashlib import sha256
+from unittest import TestCase
+
+from zk_relay.bitcoin_mock.header_store import HeaderStore
+from zk_relay.bitcoin_mock.rpc_stub import LocalBitcoinRpc
+from zk_relay.header_fetcher import HeaderFetcher
+from zk_relay.reference import EPOCH_LENGTH, HEADER_BYTE_LEN, hash_block, header_bits, header_time, pack_target, predict_outputs, \
+    time_and_bits_word, update_target, validate_headers
+
+EASY_BITS = 0x1f7fffff  # the easiest bits Bitcoin.sol encodes back (exponent 0x1f): about one hash in 512 meets it
+DEFAULT_SPACING = 600
+GENESIS_TIME = 1231006505
+
+
+def target_to_bits(target: int) -> int:
+    """ compact bits of a target, as targetToLittleBits of Bitcoin.sol computes them (before its byte swap) """
+    if not 0 < target < 2 ** 256:
+        raise Exception("Invalid target: {:x}".format(target))
+    size = (target.bit_length() + 7) // 8
+    # a leading byte above 0x7f would read as a sign bit
+    if target >> (8 * (size - 1)) > 0x7f and size < 32:
+        size += 1
+    shift = 8 * (size - 3)
+    coef = target >> shift if shift >= 0 else target << -shift
+    return size << 24 | coef & 0xffffff
+
+
+def mine_header(version: int, prev_hash: bytes, merkle_root: bytes, timestamp: int, bits: int) -> bytes:
+    """ first nonce whose header hash meets pack_target(bits); the first 64 bytes are hashed once (sha256 midstate) """
+    target = pack_target(bits)
+    target_top = target >> 248
+    prefix = version.to_bytes(4, "little") + prev_hash + merkle_root
+    midstate = sha256(prefix[:64])
+    tail = prefix[64:] + timestamp.to_bytes(4, "little") + bits.to_bytes(4, "little")
+    for nonce in range(1 << 32):
+        nonce_bytes = nonce.to_bytes(4, "little")
+        inner = midstate.copy()
+        inner.update(tail + nonce_bytes)
+        digest = sha256(inner.digest()).digest()
+        # most hashes are rejected by their top byte, before the integer conversion
+        if digest[31] <= target_top and int.from_bytes(digest, "little") < target:
+            return prefix + tail[4:] + nonce_bytes
+    raise Exception("No nonce meets bits {:08x} at time {}".format(bits, timestamp))
+
+
+class SyntheticChain:
+    """
+    header chain mined into a HeaderStore; headers link and meet pack_target of their bits
+    retarget: epoch heads take target_to_bits(update_target(...)) as the circuit and Bitcoin.sol check them; update_target
+    multiplies in the field, so the next target is at most p / 1209600 (about 2^22 hashes a header) and only short chains
+    are practical. Without it every header keeps the easy bits, as the batch circuit requires within an epoch
+    an existing store is extended from its tip, so a long chain is mined once and reused
+    """
+    def __init__(self, store_path: str, base_height: int = 0, bits: int = EASY_BITS, spacing: int = DEFAULT_SPACING,
+                 genesis_time: int = GENESIS_TIME, retarget: bool = False):
+        if base_height % EPOCH_LENGTH != 0:
+            raise Exception("The chain has to start at an epoch head, but {}".format(base_height))
+        self.store = HeaderStore(store_path)
+        self.base_height = base_height if self.store.base_height is None else self.store.base_height
+        self.bits = bits
+        self.spacing = spacing
+        self.genesis_time = genesis_time
+        self.retarget = retarget
+
+    @property
+    def tip_height(self) -> int:
+        return self.store.tip_height if self.store.count > 0 else self.base_height - 1
+
+    def next_bits(self, height: int) -> int:
+        """ bits of the header at height, given the headers below it """
+        if height == self.base_height:
+            return self.bits
+        prev = self.store.get(height - 1)
+        if height % EPOCH_LENGTH != 0 or not self.retarget:
+            return header_bits(prev)
+        head = self.store.get(height - EPOCH_LENGTH)
+        bits = target_to_bits(update_target(header_time(head), header_bits(head), header_time(prev)))
+        if not 0x17 <= bits >> 24 <= 0x1f:
+            # pack_target.zok would read other exponents as a shift of 224
+            raise Exception("The target retargeted at {} has bits {:08x}, which the circuit cannot read".format(height, bits))
+        return bits
+
+    def mine(self, num_headers: int) -> int:
+        """ appends num_headers headers, one epoch per write; returns the new tip height """
+        height = self.tip_height + 1
+        end_height = self.tip_height + num_headers
+        if height == self.base_height:
+            prev_hash, timestamp = bytes(32), self.genesis_time - self.spacing
+        else:
+            prev = self.store.get(height - 1)
+            prev_hash, timestamp = hash_block(prev), header_time(prev)
+
+        first_height, started = height, time.time()
+        while height <= end_height:
+            chunk_end = min(end_height, (height // EPOCH_LENGTH + 1) * EPOCH_LENGTH - 1)
+            bits = self.next_bits(height)
+            chunk = list()
+            for chunk_height in range(height, chunk_end + 1):
+                timestamp += self.spacing
+                merkle_root = sha256(chunk_height.to_bytes(8, "little")).digest()
+                chunk.append(mine_header(1, prev_hash, merkle_root, timestamp, bits))
+                prev_hash = hash_block(chunk[-1])
+            self.store.extend(height, b"".join(chunk))
+            print(">>> mined up to height {} ({:.0f} headers/s)".format(chunk_end, (chunk_end - first_height + 1) / (time.time() - started)))
+            height = chunk_end + 1
+        return self.tip_height
+
+    def raw_headers(self) -> list:
+        view = self.store.get_range(self.base_height, self.tip_height)
+        return [bytes(view[offset:offset + HEADER_BYTE_LEN]) for offset in range(0, len(view), HEADER_BYTE_LEN)]
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> LocalBitcoinRpc:
+        """ started JSON-RPC stand-in serving the chain, for HeaderFetcher and BitcoinClient """
+        return LocalBitcoinRpc(self.raw_headers(), self.base_height, host, port).start()
+
+    def close(self):
+        self.store.close()
+
+
+class SyntheticChainTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = "./test_synthetic_chain/"
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_target_to_bits(self):
+        for bits in [0x1d00ffff, 0x170d21b9, 0x1b0404cb, EASY_BITS]:
+            self.assertEqual(bits, target_to_bits(pack_target(bits)))
+
+    def test_chain(self):
+        chain = SyntheticChain(self.dir + "headers.dat")
+        chain.mine(EPOCH_LENGTH - 4)
+        chain.close()
+
+        # reopened chains resume from their tip
+        chain = SyntheticChain(self.dir + "headers.dat")
+        self.assertEqual(EPOCH_LENGTH + 1, chain.mine(6))
+        head_word = time_and_bits_word(chain.store.get(0))
+        predict_outputs(head_word, chain.store.get_range(EPOCH_LENGTH - 7, EPOCH_LENGTH - 1))
+        validate_headers(EASY_BITS, chain.store.get_range(EPOCH_LENGTH, EPOCH_LENGTH + 1), hash_block(chain.store.get(EPOCH_LENGTH - 1)))
+
+        # the epoch head Bitcoin.sol expects after the batch ending at 2016
+        chain.retarget = True
+        batch = chain.store.get_range(EPOCH_LENGTH - 6, EPOCH_LENGTH)
+        updated_target = update_target(header_time(chain.store.get(0)), EASY_BITS, header_time(batch[-2 * HEADER_BYTE_LEN:-HEADER_BYTE_LEN]))
+        self.assertEqual(target_to_bits(updated_target), chain.next_bits(EPOCH_LENGTH))
+
+        rpc = chain.serve()
+        fetcher = HeaderFetcher(rpc.url, "id", "pwd")
+        self.assertEqual(EPOCH_LENGTH + 1, fetcher.get_block_count())
+        self.assertEqual(bytes(batch), fetcher.get_raw_headers(EPOCH_LENGTH - 6, EPOCH_LENGTH))
+        fetcher.close()
+        rpc.stop()
+        chain.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mine a synthetic header chain and serve it over bitcoind JSON-RPC")
+    parser.add_argument("--store", "-o", required=False, default="./data/synthetic_headers.dat", type=str)
+    parser.add_argument("--num_headers", "-n", required=False, default=0, type=int)
+    parser.add_argument("--base_height", "-f", required=False, default=0, type=int)
+    parser.add_argument("--spacing", "-s", required=False, default=DEFAULT_SPACING, type=int)
+    parser.add_argument("--retarget", "-t", action="store_true", help="retarget epoch heads as update_target does")
+    parser.add_argument("--port", "-p", required=False, default=None, type=int, help="serve the chain on this port")
+
+    args = parser.parse_args()
+    synthetic_chain = SyntheticChain(args.store, args.base_height, spacing=args.spacing, retarget=args.retarget)
+    synthetic_chain.mine(args.num_headers)
+    if args.port is not None:
+        rpc = synthetic_chain.serve(port=args.port)
+        print(">>> serving heights [{}, {}] at {}".format(synthetic_chain.base_height, synthetic_chain.tip_height, rpc.url))
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            rpc.stop()
+    synthetic_chain.close()
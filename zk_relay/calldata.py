@@ -0,0 +1,113 @@
+""" Calldata of Bitcoin.sol relay functions built from a zokrates proof.json, without an ethereum library. """
+import json
+from unittest import TestCase
+
+# Proof of verifierN.sol: (G1Point a, G2Point b, G1Point c)
+PROOF_ABI_TYPE = "((uint256,uint256),(uint256[2],uint256[2]),(uint256,uint256))"
+# schemes whose proof.json has the (a, b, c) members of that struct; pghr13 has eight points, marlin a different layout
+RELAY_SCHEMES = ["g16", "gm17"]
+KECCAK_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000, 0x000000000000808B, 0x0000000080000001,
+    0x8000000080008081, 0x8000000000008009, 0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003, 0x8000000000008002, 0x8000000000000080,
+    0x000000000000800A, 0x800000008000000A, 0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008
+]
+KECCAK_ROTATIONS = [
+    [0, 36, 3, 41, 18], [1, 44, 10, 45, 2], [62, 6, 43, 15, 61], [28, 55, 25, 21, 56], [27, 20, 39, 8, 14]
+]
+KECCAK_RATE = 136  # bytes, keccak256
+MASK_64 = (1 << 64) - 1
+
+
+def _keccak_f(state: list):
+    """ keccak-f[1600] permutation over state[x][y] lanes """
+    for round_constant in KECCAK_ROUND_CONSTANTS:
+        c = [state[x][0] ^ state[x][1] ^ state[x][2] ^ state[x][3] ^ state[x][4] for x in range(5)]
+        d = [c[(x - 1) % 5] ^ (((c[(x + 1) % 5] << 1) | (c[(x + 1) % 5] >> 63)) & MASK_64) for x in range(5)]
+        b = [[0] * 5 for _ in range(5)]
+        for x in range(5):
+            for y in range(5):
+                lane = state[x][y] ^ d[x]
+                r = KECCAK_ROTATIONS[x][y]
+                b[y][(2 * x + 3 * y) % 5] = ((lane << r) | (lane >> (64 - r))) & MASK_64 if r else lane
+        for x in range(5):
+            for y in range(5):
+                state[x][y] = b[x][y] ^ (~b[(x + 1) % 5][y] & b[(x + 2) % 5][y])
+        state[0][0] ^= round_constant
+
+
+def keccak256(data: bytes) -> bytes:
+    """ ethereum keccak256 (original keccak padding, not hashlib.sha3_256) """
+    padded = bytearray(data) + b"\x01" + bytes(-(len(data) + 1) % KECCAK_RATE)
+    padded[-1] |= 0x80
+    state = [[0] * 5 for _ in range(5)]
+    for offset in range(0, len(padded), KECCAK_RATE):
+        block = padded[offset:offset + KECCAK_RATE]
+        for i in range(KECCAK_RATE // 8):
+            state[i % 5][i // 5] ^= int.from_bytes(block[i * 8:(i + 1) * 8], "little")
+        _keccak_f(state)
+    return b"".join([state[i % 5][i // 5].to_bytes(8, "little") for i in range(4)])
+
+
+def function_selector(signature: str) -> bytes:
+    return keccak256(signature.encode())[:4]
+
+
+def relay_signature(num_inputs: int) -> str:
+    """ relay3(uint256 branchIndex, Proof memory proof, uint[5] memory input) """
+    return "relay3(uint256,{},uint256[{}])".format(PROOF_ABI_TYPE, num_inputs)
+
+
+def relay_proof(proof_json: dict, scheme: str) -> dict:
+    """ "proof" member of proof.json, once it is known to fit the Proof struct of relay3 """
+    if scheme not in RELAY_SCHEMES:
+        raise Exception("relay3 takes a (a, b, c) proof of {}, a {} proof can not be relayed".format(" or ".join(RELAY_SCHEMES), scheme))
+    proof = proof_json["proof"]
+    if sorted(proof) != ["a", "b", "c"]:
+        raise Exception("Invalid {} proof, members: {}".format(scheme, sorted(proof)))
+    return proof
+
+
+def flatten_proof_json(proof_json: dict, scheme: str) -> str:
+    """ [a, b, c], inputs as a json argument list, same as Actor.flatten_proof """
+    proof = relay_proof(proof_json, scheme)
+    contract_input = [[proof["a"], proof["b"], proof["c"]], proof_json["inputs"]]
+    return json.dumps(contract_input)[1:-1]
+
+
+def encode_proof_arguments(proof_json: dict, scheme: str) -> bytes:
+    """ abi encoding of (proof, inputs); every member is static, so the encoding is the words in order """
+    proof = relay_proof(proof_json, scheme)
+    words = proof["a"] + proof["b"][0] + proof["b"][1] + proof["c"] + proof_json["inputs"]
+    return b"".join([int(word, 16).to_bytes(32, "big") for word in words])
+
+
+def encode_relay_calldata(encoded_proof_arguments: bytes, num_inputs: int, branch_index: int = 0) -> bytes:
+    """ selector, branch index and the precomputed (proof, inputs) encoding """
+    return function_selector(relay_signature(num_inputs)) + branch_index.to_bytes(32, "big") + encoded_proof_arguments
+
+
+class CalldataTest(TestCase):
+    def test_keccak256(self):
+        self.assertEqual("c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470", keccak256(b"").hex())
+        self.assertEqual("a9059cbb", function_selector("transfer(address,uint256)").hex())
+        self.assertEqual("4e03657aea45a94fc7d47ba826c8d667c0d1e6e33a64a036ec44f58fa12d6c45", keccak256(b"abc").hex())
+
+    def test_encode_relay_calldata(self):
+        proof_json = {
+            "proof": {"a": ["0x1", "0x2"], "b": [["0x3", "0x4"], ["0x5", "0x6"]], "c": ["0x7", "0x8"]},
+            "inputs": ["0x9", "0xa", "0xb", "0xc", "0xd"]
+        }
+        calldata = encode_relay_calldata(encode_proof_arguments(proof_json, "g16"), 5, branch_index=1)
+        self.assertEqual(4 + 32 * 14, len(calldata))
+        self.assertEqual(list(range(1, 14)), [int.from_bytes(calldata[4 + 32 * i:4 + 32 * (i + 1)], "big") for i in range(1, 14)])
+        self.assertEqual(1, int.from_bytes(calldata[4:36], "big"))
+
+    def test_other_schemes(self):
+        pghr13_json = {"proof": {name: ["0x1", "0x2"] for name in ["a", "a_p", "b", "b_p", "c", "c_p", "h", "k"]}, "inputs": ["0x9"]}
+        with self.assertRaises(Exception):
+            flatten_proof_json(pghr13_json, "pghr13")
+        with self.assertRaises(Exception):
+            encode_proof_arguments(pghr13_json, "g16")
+        with self.assertRaises(Exception):
+            encode_proof_arguments({"proof": {"a": ["0x1", "0x2"]}, "inputs": ["0x9"]}, "marlin")
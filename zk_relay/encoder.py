@@ -0,0 +1,58 @@
+import struct
+from unittest import TestCase
+
+from zk_relay.utils import padding, split_hex_to_int_array
+
+HEADER_BYTE_LEN = 80
+PADDED_BYTE_LEN = 128
+WORDS_PER_HEADER = PADDED_BYTE_LEN // 4
+# sha256 padding of an 80-bytes message: 0x80, zeros, bit length (640) -- identical to utils.padding
+PADDING_SUFFIX = b"\x80" + bytes(PADDED_BYTE_LEN - HEADER_BYTE_LEN - 3) + (HEADER_BYTE_LEN * 8).to_bytes(2, "big")
+
+
+def pad_headers(raw_headers) -> bytearray:
+    """ concatenated raw headers -> concatenated sha256-padded 128-bytes blocks """
+    num = len(raw_headers) // HEADER_BYTE_LEN
+    if num * HEADER_BYTE_LEN != len(raw_headers):
+        raise Exception("Headers length should be multiple of {}: {}".format(HEADER_BYTE_LEN, len(raw_headers)))
+    view = memoryview(raw_headers)
+    padded = bytearray((bytes(HEADER_BYTE_LEN) + PADDING_SUFFIX) * num)
+    for i in range(num):
+        padded[i * PADDED_BYTE_LEN:i * PADDED_BYTE_LEN + HEADER_BYTE_LEN] = view[i * HEADER_BYTE_LEN:(i + 1) * HEADER_BYTE_LEN]
+    return padded
+
+
+def encode_headers(raw_headers) -> list:
+    """ u32[N][32] words of the padded headers, flattened, in a single unpack """
+    padded = pad_headers(raw_headers)
+    return list(struct.unpack(">{}I".format(len(padded) // 4), padded))
+
+
+def encode_input(epoch_head_time_and_bits: int, raw_headers) -> list:
+    """ arguments of validate_batchN.zok: epoch head time-and-bits word followed by the block words """
+    return [epoch_head_time_and_bits] + encode_headers(raw_headers)
+
+
+def encode_batches(batches: list) -> list:
+    """ batches: list of (epoch_head_time_and_bits, raw_headers); all headers are padded and unpacked at once """
+    words = encode_headers(b"".join([bytes(raw_headers) for _, raw_headers in batches]))
+    encoded = list()
+    offset = 0
+    for epoch_head_time_and_bits, raw_headers in batches:
+        num_words = len(raw_headers) // HEADER_BYTE_LEN * WORDS_PER_HEADER
+        encoded.append([epoch_head_time_and_bits] + words[offset:offset + num_words])
+        offset += num_words
+    return encoded
+
+
+class EncoderTest(TestCase):
+    def setUp(self) -> None:
+        self.raw_headers = bytes(range(256)) * 5  # 16 headers of 80 bytes
+
+    def test_same_as_hex_padding(self):
+        hex_blocks = "".join([padding(self.raw_headers[i:i + 80].hex()) for i in range(0, len(self.raw_headers), 80)])
+        self.assertEqual(split_hex_to_int_array(hex_blocks, 4), encode_headers(self.raw_headers))
+
+    def test_encode_batches(self):
+        batches = [(7, self.raw_headers[:160]), (9, memoryview(self.raw_headers)[160:400])]
+        self.assertEqual([encode_input(7, self.raw_headers[:160]), encode_input(9, self.raw_headers[160:400])], encode_batches(batches))
@@ -0,0 +1,180 @@
+import os
+import shutil
+import struct
+from unittest import TestCase
+
+from zk_relay.reference import EPOCH_LENGTH, HEADER_BYTE_LEN, header_time, time_and_bits_word, update_target
+
+MAGIC = b"ZKEI"
+VERSION = 1
+META_FORMAT = ">4sI"  # magic, version
+META_BYTE_LEN = struct.calcsize(META_FORMAT)
+RECORD_FORMAT = ">B16sI32s11x"  # flags, epoch head time-and-bits word, epoch tail time, next target
+RECORD_BYTE_LEN = struct.calcsize(RECORD_FORMAT)
+HAS_HEAD = 0x01
+HAS_TAIL = 0x02
+INDEX_DEPTH = 6  # blocks on top of a header before Actor records it: records are only dropped by invalidate()
+
+
+class EpochIndex:
+    """
+    persistent per-epoch record of the epoch head time-and-bits word, the epoch tail time and the next target
+    layout: [magic | version] followed by one fixed-size record per epoch at META + epoch * RECORD; unknown records are zeros
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < META_BYTE_LEN:
+            os.pwrite(self._fd, struct.pack(META_FORMAT, MAGIC, VERSION), 0)
+        magic, version = struct.unpack(META_FORMAT, os.pread(self._fd, META_BYTE_LEN, 0))
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Invalid epoch index file: {}".format(self.path))
+
+    def get(self, height: int) -> (int, int, int, int):
+        """ (flags, head time-and-bits word, tail time, next target) of the epoch of height """
+        data = os.pread(self._fd, RECORD_BYTE_LEN, META_BYTE_LEN + height // EPOCH_LENGTH * RECORD_BYTE_LEN)
+        if len(data) < RECORD_BYTE_LEN:
+            return 0, 0, 0, 0
+        flags, head_word, tail_time, next_target = struct.unpack(RECORD_FORMAT, data)
+        return flags, int.from_bytes(head_word, "big"), tail_time, int.from_bytes(next_target, "big")
+
+    def head_time_and_bits(self, height: int) -> int:
+        """ time-and-bits word of the epoch head of height, None when not known yet """
+        flags, head_word, _, _ = self.get(height)
+        return head_word if flags & HAS_HEAD else None
+
+    def tail_time(self, height: int) -> int:
+        flags, _, tail_time, _ = self.get(height)
+        return tail_time if flags & HAS_TAIL else None
+
+    def next_target(self, height: int) -> int:
+        """ target of the epoch after the epoch of height (update_target.zok), None until head and tail are known """
+        flags, _, _, next_target = self.get(height)
+        return next_target if flags & HAS_HEAD and flags & HAS_TAIL else None
+
+    def observe(self, start_height: int, raw_headers) -> int:
+        """ records the epoch heads and tails among contiguous raw headers starting at start_height; returns records written """
+        num = len(raw_headers) // HEADER_BYTE_LEN
+        view = memoryview(raw_headers)
+        written = 0
+        # only the boundary heights are visited
+        height = start_height + (-start_height % EPOCH_LENGTH)
+        while height < start_height + num:
+            offset = (height - start_height) * HEADER_BYTE_LEN
+            written += self._update(height, head_word=time_and_bits_word(view[offset:offset + HEADER_BYTE_LEN]))
+            height += EPOCH_LENGTH
+        height = start_height + (-(start_height + 1) % EPOCH_LENGTH)
+        while height < start_height + num:
+            offset = (height - start_height) * HEADER_BYTE_LEN
+            written += self._update(height, tail=bytes(view[offset:offset + HEADER_BYTE_LEN]))
+            height += EPOCH_LENGTH
+        if written > 0:
+            os.fsync(self._fd)
+        return written
+
+    def observe_head(self, height: int, head_word: int) -> int:
+        """ records the time-and-bits word of the epoch head at height; returns records written """
+        if height % EPOCH_LENGTH != 0:
+            raise Exception("{} is not an epoch head".format(height))
+        written = self._update(height, head_word=head_word)
+        if written > 0:
+            os.fsync(self._fd)
+        return written
+
+    def invalidate(self, fork_height: int) -> int:
+        """ forgets the heads and tails above fork_height, replaced by a reorg; returns records changed """
+        num_epochs = (os.fstat(self._fd).st_size - META_BYTE_LEN) // RECORD_BYTE_LEN
+        changed = 0
+        for epoch in range((fork_height + 1) // EPOCH_LENGTH, num_epochs):
+            flags, head_word, tail_time, _ = self.get(epoch * EPOCH_LENGTH)
+            kept = flags
+            if epoch * EPOCH_LENGTH > fork_height:
+                kept &= ~HAS_HEAD
+            if (epoch + 1) * EPOCH_LENGTH - 1 > fork_height:
+                kept &= ~HAS_TAIL
+            if kept == flags:
+                continue
+            self._write(epoch * EPOCH_LENGTH, kept, head_word if kept & HAS_HEAD else 0, tail_time if kept & HAS_TAIL else 0, 0)
+            changed += 1
+        if changed > 0:
+            os.fsync(self._fd)
+        return changed
+
+    def _update(self, height: int, head_word: int = None, tail: bytes = None) -> int:
+        flags, stored_head_word, tail_time, next_target = self.get(height)
+        if head_word is not None:
+            if flags & HAS_HEAD:
+                return 0
+            flags = flags | HAS_HEAD
+        else:
+            head_word = stored_head_word
+        if tail is not None:
+            if flags & HAS_TAIL:
+                return 0
+            flags, tail_time = flags | HAS_TAIL, header_time(tail)
+        if flags & HAS_HEAD and flags & HAS_TAIL:
+            head_bytes = head_word.to_bytes(16, "big")
+            next_target = update_target(int.from_bytes(head_bytes[4:8], "little"), int.from_bytes(head_bytes[8:12], "little"), tail_time)
+        self._write(height, flags, head_word, tail_time, next_target)
+        return 1
+
+    def _write(self, height: int, flags: int, head_word: int, tail_time: int, next_target: int):
+        record = struct.pack(RECORD_FORMAT, flags, head_word.to_bytes(16, "big"), tail_time, next_target.to_bytes(32, "big"))
+        os.pwrite(self._fd, record, META_BYTE_LEN + height // EPOCH_LENGTH * RECORD_BYTE_LEN)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class EpochIndexTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = "./test_epoch_index/"
+        os.makedirs(self.dir, exist_ok=True)
+        self.path = self.dir + "epoch_index.dat"
+        self.index = EpochIndex(self.path)
+
+    def tearDown(self) -> None:
+        self.index.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    @staticmethod
+    def header(timestamp: int, bits: int = 0x1d00ffff) -> bytes:
+        return bytes(68) + timestamp.to_bytes(4, "little") + bits.to_bytes(4, "little") + bytes(4)
+
+    def test_observe_boundaries(self):
+        # heights 2014..4032: tail of epoch 0, all of epoch 1, head of epoch 2
+        raw_headers = b"".join([self.header(1000 + height) for height in range(2014, 4033)])
+        self.assertEqual(4, self.index.observe(2014, raw_headers))
+        self.assertIsNone(self.index.head_time_and_bits(0))
+        self.assertEqual(1000 + 2015, self.index.tail_time(100))
+        self.assertEqual(time_and_bits_word(self.header(1000 + 2016)), self.index.head_time_and_bits(3000))
+        self.assertEqual(update_target(1000 + 2016, 0x1d00ffff, 1000 + 4031), self.index.next_target(2016))
+        self.assertEqual(time_and_bits_word(self.header(1000 + 4032)), self.index.head_time_and_bits(4032))
+        self.assertIsNone(self.index.next_target(4032))
+
+    def test_persistent(self):
+        self.index.observe(0, self.header(7))
+        self.index.close()
+        self.index = EpochIndex(self.path)
+        self.assertEqual(time_and_bits_word(self.header(7)), self.index.head_time_and_bits(2015))
+        self.assertEqual(0, self.index.observe(0, self.header(8)))
+
+    def test_invalidate(self):
+        raw_headers = b"".join([self.header(1000 + height) for height in range(2014, 4033)])
+        self.index.observe(2014, raw_headers)
+        # a reorg forking at 3000 replaces the tail of epoch 1 and the head of epoch 2
+        self.assertEqual(2, self.index.invalidate(3000))
+        self.assertEqual(1000 + 2015, self.index.tail_time(0))
+        self.assertEqual(time_and_bits_word(self.header(1000 + 2016)), self.index.head_time_and_bits(2016))
+        self.assertIsNone(self.index.tail_time(2016))
+        self.assertIsNone(self.index.next_target(2016))
+        self.assertIsNone(self.index.head_time_and_bits(4032))
+        self.assertEqual(0, self.index.invalidate(3000))
+
+        # the replacing headers are recorded again
+        self.assertEqual(1, self.index.observe(4031, self.header(2000)))
+        self.assertEqual(1, self.index.observe_head(4032, time_and_bits_word(self.header(2001))))
+        self.assertEqual(update_target(1000 + 2016, 0x1d00ffff, 2000), self.index.next_target(2016))
@@ -0,0 +1,117 @@
+import base64
+import http.client
+import json
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from urllib.parse import urlsplit
+
+from zk_relay.bitcoin_mock.rpc_stub import LocalBitcoinRpc
+
+
+class HeaderFetcher:
+    """
+    fetches header ranges with JSON-RPC batch calls over pooled keep-alive connections
+    a range is split into chunks of batch_size heights; up to max_concurrency chunks are in flight
+    """
+    def __init__(self, url: str, id: str, pwd: str, batch_size: int = 500, max_concurrency: int = 4, max_retries: int = 3, timeout: float = 30):
+        parsed = urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path if parsed.path else "/"
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.auth = "Basic " + base64.b64encode("{}:{}".format(id, pwd).encode()).decode()
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._pool = queue.LifoQueue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def get_block_count(self) -> int:
+        return self.call("getblockcount", [])
+
+    def get_raw_headers(self, from_height: int, to_height: int) -> bytes:
+        """ concatenated raw headers of heights [from_height, to_height], in height order """
+        chunks = [(height, min(height + self.batch_size - 1, to_height)) for height in range(from_height, to_height + 1, self.batch_size)]
+        return b"".join(self._executor.map(lambda chunk: self._fetch_chunk(*chunk), chunks))
+
+    def get_headers_hex(self, from_height: int, to_height: int) -> list:
+        raw_headers = self.get_raw_headers(from_height, to_height)
+        return [raw_headers[i:i + 80].hex() for i in range(0, len(raw_headers), 80)]
+
+    def call(self, method: str, params: list):
+        return self._batch_call([(method, params)])[0]
+
+    def close(self):
+        self._executor.shutdown()
+        while not self._pool.empty():
+            self._pool.get().close()
+
+    def _fetch_chunk(self, from_height: int, to_height: int) -> bytes:
+        heights = range(from_height, to_height + 1)
+        block_hashes = self._batch_call([("getblockhash", [height]) for height in heights])
+        headers = self._batch_call([("getblockheader", [block_hash, False]) for block_hash in block_hashes])
+        return b"".join([bytes.fromhex(header) for header in headers])
+
+    def _batch_call(self, calls: list) -> list:
+        payload = json.dumps([{"jsonrpc": "1.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]).encode()
+        for attempt in range(self.max_retries + 1):
+            try:
+                responses = self._post(payload)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.max_retries:
+                    raise Exception("RPC batch fails after {} retries: {}".format(self.max_retries, e))
+                time.sleep(0.1 * 2 ** attempt)
+
+        # batch responses may come in any order
+        results = [None] * len(calls)
+        for response in responses:
+            if response.get("error") is not None:
+                raise Exception("RPC error: {}".format(response["error"]))
+            results[response["id"]] = response["result"]
+        return results
+
+    def _post(self, payload: bytes) -> list:
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request("POST", self.path, payload, {"Authorization": self.auth, "Content-Type": "application/json"})
+            response = connection.getresponse()
+            body = response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.status != 200:
+            connection.close()
+            raise http.client.HTTPException("HTTP status {}: {}".format(response.status, body[:200]))
+        self._pool.put(connection)
+        return json.loads(body)
+
+
+class HeaderFetcherTest(TestCase):
+    def setUp(self) -> None:
+        self.raw_headers = [bytes([i % 256]) * 4 + i.to_bytes(76, "big") for i in range(1000)]
+        self.rpc = LocalBitcoinRpc(self.raw_headers, base_height=100).start()
+        self.fetcher = HeaderFetcher(self.rpc.url, "id", "pwd", batch_size=64, max_concurrency=4)
+
+    def tearDown(self) -> None:
+        self.fetcher.close()
+        self.rpc.stop()
+
+    def test_ordered_range(self):
+        self.assertEqual(1099, self.fetcher.get_block_count())
+        self.assertEqual(b"".join(self.raw_headers[10:910]), self.fetcher.get_raw_headers(110, 1009))
+        self.assertEqual([self.raw_headers[0].hex()], self.fetcher.get_headers_hex(100, 100))
+
+    def test_retry(self):
+        self.rpc.fail_next = 2
+        self.assertEqual(b"".join(self.raw_headers[:5]), self.fetcher.get_raw_headers(100, 104))
+
+    def test_rpc_error(self):
+        with self.assertRaises(Exception):
+            self.fetcher.get_raw_headers(1090, 1200)
@@ -0,0 +1,160 @@
+from unittest import TestCase
+
+from zk_relay.reference import HEADER_BYTE_LEN, hash_block, header_bits, pack_target
+
+
+def header_work(raw_header: bytes) -> int:
+    """ expected number of hashes for a header, from its target as the circuit reads it (pack_target.zok) """
+    return 2 ** 256 // (pack_target(header_bits(raw_header)) + 1)
+
+
+class HeaderNode:
+    def __init__(self, raw_header: bytes, height: int, chain_work: int):
+        self.raw_header = raw_header
+        self.hash = hash_block(raw_header)  # raw digest, as compared by validate_block_header.zok
+        self.prev_hash = raw_header[4:36]
+        self.height = height
+        self.chain_work = chain_work
+
+
+class Reorg:
+    """ switch of the best chain: blocks above fork_height are replaced """
+    def __init__(self, fork_height: int, disconnected: list, connected: list):
+        self.fork_height = fork_height
+        self.disconnected = disconnected  # hashes of the old best chain above the fork, ascending height
+        self.connected = connected  # hashes of the new best chain above the fork, ascending height
+
+    def __repr__(self):
+        return "Reorg(fork_height={}, disconnected={}, connected={})".format(self.fork_height, len(self.disconnected), len(self.connected))
+
+
+class HeaderTree:
+    """
+    headers of every branch keyed by hash, each with its cumulative work; the tip of most work is the best chain
+    the first header added is the root (a checkpoint), every later header has to extend a known one
+    """
+    def __init__(self):
+        self.nodes = dict()
+        self.best_chain = list()  # hashes of the best chain, index = height - root height
+        self.root_height = None
+
+    @property
+    def tip(self) -> HeaderNode:
+        return self.nodes[self.best_chain[-1]] if len(self.best_chain) > 0 else None
+
+    @property
+    def tip_height(self) -> int:
+        return self.tip.height if self.tip is not None else -1
+
+    def contains(self, block_hash: bytes) -> bool:
+        return block_hash in self.nodes
+
+    def add(self, raw_header: bytes, height: int = None) -> Reorg:
+        """ adds one header; returns a Reorg when the best chain switched to another branch, None otherwise """
+        raw_header = bytes(raw_header)
+        block_hash = hash_block(raw_header)
+        if block_hash in self.nodes:
+            return None
+        if len(self.nodes) == 0:
+            if height is None:
+                raise Exception("The height of the root header is required")
+            node = HeaderNode(raw_header, height, header_work(raw_header))
+            self.nodes[node.hash] = node
+            self.root_height = height
+            self.best_chain = [node.hash]
+            return None
+
+        parent = self.nodes.get(raw_header[4:36])
+        if parent is None:
+            raise Exception("The previous header of {} is unknown".format(block_hash[::-1].hex()))
+        node = HeaderNode(raw_header, parent.height + 1, parent.chain_work + header_work(raw_header))
+        self.nodes[node.hash] = node
+
+        tip = self.tip
+        if node.chain_work <= tip.chain_work:
+            # first seen wins between branches of equal work
+            return None
+        if node.prev_hash == tip.hash:
+            self.best_chain.append(node.hash)
+            return None
+        return self._switch_to(node)
+
+    def extend(self, start_height: int, raw_headers) -> list:
+        """ adds contiguous raw headers; returns the reorgs they caused """
+        view = memoryview(raw_headers)
+        reorgs = list()
+        for offset in range(0, len(view), HEADER_BYTE_LEN):
+            reorg = self.add(view[offset:offset + HEADER_BYTE_LEN], start_height + offset // HEADER_BYTE_LEN)
+            if reorg is not None:
+                reorgs.append(reorg)
+        return reorgs
+
+    def best_hash(self, height: int) -> bytes:
+        """ hash of the best chain at height, None outside of it """
+        index = height - self.root_height if self.root_height is not None else -1
+        return self.best_chain[index] if 0 <= index < len(self.best_chain) else None
+
+    def best_raw_range(self, from_height: int, to_height: int) -> bytes:
+        """ raw headers of the best chain at heights [from_height, to_height] """
+        hashes = [self.best_hash(height) for height in range(from_height, to_height + 1)]
+        if None in hashes:
+            raise Exception("Heights [{}, {}] are not in the best chain [{}, {}]".format(from_height, to_height, self.root_height, self.tip_height))
+        return b"".join([self.nodes[block_hash].raw_header for block_hash in hashes])
+
+    def _switch_to(self, new_tip: HeaderNode) -> Reorg:
+        connected = list()
+        node = new_tip
+        # walk the new branch down until it meets the current best chain
+        while self.best_hash(node.height) != node.hash:
+            connected.append(node.hash)
+            node = self.nodes[node.prev_hash]
+        fork_height = node.height
+        index = fork_height - self.root_height + 1
+        disconnected = self.best_chain[index:]
+        self.best_chain = self.best_chain[:index] + connected[::-1]
+        return Reorg(fork_height, disconnected, connected[::-1])
+
+
+class HeaderTreeTest(TestCase):
+    BITS = 0x1f7fffff  # the circuit reads exponent 0x1f as a shift of 224: about one hash in 512 meets it
+
+    @staticmethod
+    def mine(prev_hash: bytes, timestamp: int) -> bytes:
+        target = pack_target(HeaderTreeTest.BITS)
+        for nonce in range(1 << 20):
+            raw_header = (1).to_bytes(4, "little") + prev_hash + bytes(32) + timestamp.to_bytes(4, "little") \
+                + HeaderTreeTest.BITS.to_bytes(4, "little") + nonce.to_bytes(4, "little")
+            if int.from_bytes(hash_block(raw_header), "little") < target:
+                return raw_header
+        raise Exception("no nonce found")
+
+    @staticmethod
+    def branch(prev_hash: bytes, num: int, timestamp: int) -> list:
+        headers = list()
+        for i in range(num):
+            headers.append(HeaderTreeTest.mine(prev_hash, timestamp + i))
+            prev_hash = hash_block(headers[-1])
+        return headers
+
+    def test_reorg(self):
+        tree = HeaderTree()
+        chain_a = self.branch(bytes(32), 5, 1000)
+        self.assertEqual([], tree.extend(100, b"".join(chain_a)))
+        self.assertEqual(104, tree.tip_height)
+
+        # a competing block at 104 has equal work: the first seen stays best
+        chain_b = self.branch(hash_block(chain_a[3]), 2, 2000)
+        self.assertIsNone(tree.add(chain_b[0]))
+        self.assertEqual(hash_block(chain_a[4]), tree.best_hash(104))
+
+        reorg = tree.add(chain_b[1])
+        self.assertEqual(103, reorg.fork_height)
+        self.assertEqual([hash_block(chain_a[4])], reorg.disconnected)
+        self.assertEqual([hash_block(header) for header in chain_b], reorg.connected)
+        self.assertEqual(b"".join(chain_a[:4] + chain_b), tree.best_raw_range(100, 105))
+
+    def test_unknown_parent(self):
+        tree = HeaderTree()
+        tree.add(self.mine(bytes(32), 1000), 0)
+        with self.assertRaises(Exception):
+            tree.add(self.mine(bytes([1]) * 32, 1001))
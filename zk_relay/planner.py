@@ -0,0 +1,234 @@
+import glob
+import json
+import os
+import re
+import shutil
+from unittest import TestCase
+
+from config_batch import generate_test_config
+from zk_relay.actor import Actor
+from zk_relay.bitcoin_mock.bitcoin_mock import SyntheticBTCMock
+from zk_relay.bitcoin_mock.synthetic_chain import SyntheticChain
+from zk_relay.prover_pool import ProverPool
+from zokrates_libs.scheduler import MemoryModel, MemoryScheduler
+from zokrates_libs.zokrates import Zokrates
+
+EPOCH_LENGTH = 2016
+DEFAULT_FIXED_COST = 4  # per-proof overhead in units of one header, used when nothing was measured
+
+
+def discover_menu(conf_dir: str) -> dict:
+    """ {batch_num: config_path} of the batch configs whose program and proving key already exist """
+    menu = dict()
+    for config_path in glob.glob(os.path.join(conf_dir, "config_batch*.toml")):
+        matched = re.match(r"^config_batch(\d+)\.toml$", os.path.basename(config_path))
+        if not matched:
+            continue
+        zok = Zokrates(config_path)
+        if os.path.exists(zok.prog_path) and os.path.exists(zok.pkey_path):
+            menu[int(matched.group(1))] = config_path
+    return menu
+
+
+def menu_setting(config_path: str) -> (str, str):
+    """ (proving scheme, target division) of a batch config, the columns benchmark_batch.py reports costs by """
+    zok = Zokrates(config_path)
+    return zok.proving_scheme, zok.config["context"]["code"].get("TARGET_DIVISION", "circuit")
+
+
+def load_costs(report_path: str, proving_scheme: str = None, target_division: str = None) -> dict:
+    """ {batch_num: seconds of compute-witness + generate-proof} measured by benchmark_batch.py, of one scheme and division if given """
+    with open(report_path, "r") as f:
+        report = json.load(f)
+    costs = dict()
+    for result in report["results"]:
+        if proving_scheme is not None and result.get("proving_scheme", "g16") != proving_scheme:
+            continue
+        if target_division is not None and result.get("target_division", "circuit") != target_division:
+            continue
+        stages = result["stages"]
+        cost = stages["compute_witness"]["wall_time"] + stages["generate_proof"]["wall_time"]
+        costs[result["batch_num"]] = min(cost, costs.get(result["batch_num"], cost))
+    return costs
+
+
+def estimate_costs(batch_nums: list, measured: dict) -> dict:
+    """ measured costs where available, a linear fit of them (or a default model) otherwise """
+    points = sorted(measured.items())
+    if len(points) >= 2:
+        (x0, y0), (x1, y1) = points[0], points[-1]
+        per_header = (y1 - y0) / (x1 - x0)
+        fixed = y0 - per_header * x0
+    elif len(points) == 1:
+        per_header, fixed = points[0][1] / (points[0][0] + DEFAULT_FIXED_COST), points[0][1] * DEFAULT_FIXED_COST / (points[0][0] + DEFAULT_FIXED_COST)
+    else:
+        per_header, fixed = 1, DEFAULT_FIXED_COST
+    return {batch_num: measured.get(batch_num, max(fixed + per_header * batch_num, 0)) for batch_num in batch_nums}
+
+
+class BatchPlanner:
+    """
+    splits a height range into batches of precompiled sizes, none crossing a 2016-block retarget boundary,
+    minimizing the total expected proving time
+    """
+    def __init__(self, conf_dir: str = "./zk_relay/conf/", cost_report_path: str = None, menu: dict = None, costs: dict = None):
+        self.menu = discover_menu(conf_dir) if menu is None else menu
+        if len(self.menu) == 0:
+            raise Exception("There is no batch size with setup artifacts in {}".format(conf_dir))
+        measured = dict()
+        if cost_report_path is not None:
+            # each size is costed by the rows of its own scheme and division
+            settings = {batch_num: menu_setting(config_path) for batch_num, config_path in self.menu.items()}
+            for setting in set(settings.values()):
+                setting_costs = load_costs(cost_report_path, *setting)
+                measured.update({batch_num: setting_costs[batch_num] for batch_num in settings
+                                 if settings[batch_num] == setting and batch_num in setting_costs})
+        if costs is not None:
+            measured.update(costs)
+        self.costs = estimate_costs(list(self.menu.keys()), measured)
+        self.failed = dict()
+
+    def plan(self, from_height: int, end_height: int) -> (list, int):
+        """
+        returns ([(from_height, end_height, batch_num), ...], next_height)
+        every epoch closed inside the range is covered exactly; the open last epoch is covered as far as the menu allows,
+        proving resumes from next_height once more headers arrive
+        """
+        batches = list()
+        height = from_height
+        while height <= end_height:
+            segment_end = min((height // EPOCH_LENGTH + 1) * EPOCH_LENGTH - 1, end_height)
+            length = segment_end - height + 1
+            sizes = self._cover(length, exact=segment_end < end_height or (segment_end + 1) % EPOCH_LENGTH == 0)
+            if sizes is None:
+                raise Exception("Heights [{}, {}] can not be covered by batch sizes {}".format(height, segment_end, sorted(self.menu)))
+            for batch_num in sizes:
+                batches.append((height, height + batch_num - 1, batch_num))
+                height += batch_num
+            if height <= segment_end:
+                # the menu can not cover the open tail yet
+                break
+        return batches, height
+
+    def cost(self, batches: list) -> float:
+        return sum([self.costs[batch_num] for _, _, batch_num in batches])
+
+    def execute(self, batches: list, btc_cli, header_fetcher=None, num_workers: int = None, epoch_index=None,
+                scheduler: MemoryScheduler = None) -> dict:
+        """
+        proves a plan, one ProverPool per batch size; returns {(from_height, end_height): proof_path}, failures in self.failed
+        with a scheduler, the jobs of all sizes are scheduled together so that small batches fill the room left by large ones
+        """
+        proofs = dict()
+        self.failed = dict()
+        if scheduler is not None:
+            jobs = list()
+            for batch_num in sorted(set([batch_num for _, _, batch_num in batches])):
+                pool = ProverPool(Actor(btc_cli, self.menu[batch_num], header_fetcher, epoch_index))
+                jobs += pool.build_jobs([(start, end) for start, end, size in batches if size == batch_num])
+            proofs = scheduler.run(jobs)
+            self.failed = scheduler.failed
+            return proofs
+        for batch_num in sorted(set([batch_num for _, _, batch_num in batches])):
+            actor = Actor(btc_cli, self.menu[batch_num], header_fetcher, epoch_index)
+            pool = ProverPool(actor, num_workers)
+            proofs.update(pool.prove_ranges([(start, end) for start, end, size in batches if size == batch_num]))
+            self.failed.update(pool.failed)
+        return proofs
+
+    def _cover(self, length: int, exact: bool) -> list:
+        """ cheapest multiset of menu sizes summing to length (or to the longest coverable prefix when not exact) """
+        inf = float("inf")
+        best = [0] + [inf] * length
+        choice = [0] * (length + 1)
+        for n in range(1, length + 1):
+            for batch_num, cost in self.costs.items():
+                if batch_num <= n and best[n - batch_num] + cost < best[n]:
+                    best[n] = best[n - batch_num] + cost
+                    choice[n] = batch_num
+        target = length
+        if not exact:
+            target = max([n for n in range(length + 1) if best[n] < inf])
+        if best[target] == inf:
+            return None
+        sizes = list()
+        while target > 0:
+            sizes.append(choice[target])
+            target -= choice[target]
+        return sorted(sizes, reverse=True)
+
+
+class BatchPlannerTest(TestCase):
+    def setUp(self) -> None:
+        self.planner = BatchPlanner(menu={2: "", 7: "", 32: ""}, costs={2: 3.0, 7: 6.0, 32: 20.0})
+
+    def test_batches_stay_in_epoch(self):
+        batches, next_height = self.planner.plan(2000, 2100)
+        self.assertEqual(2101, next_height)
+        self.assertEqual(2000, batches[0][0])
+        for start, end, batch_num in batches:
+            self.assertEqual(start // EPOCH_LENGTH, end // EPOCH_LENGTH)
+            self.assertEqual(batch_num, end - start + 1)
+        self.assertEqual(list(range(2000, 2101)), [h for start, end, _ in batches for h in range(start, end + 1)])
+
+    def test_cheapest_cover(self):
+        # 14 headers: two batches of 7 (12.0) beat seven batches of 2 (21.0)
+        batches, _ = self.planner.plan(0, 13)
+        self.assertEqual([7, 7], [batch_num for _, _, batch_num in batches])
+
+    def test_open_tail_is_left(self):
+        # 3 headers of an open epoch can not be covered by {2, 7, 32} exactly
+        batches, next_height = self.planner.plan(100, 102)
+        self.assertEqual([(100, 101, 2)], batches)
+        self.assertEqual(102, next_height)
+
+    def test_load_costs_by_setting(self):
+        report_dir = "./test_planner_costs/"
+        os.makedirs(report_dir, exist_ok=True)
+        rows = [(2, "g16", "circuit", 4.0), (2, "g16", "hint", 3.0), (2, "marlin", "hint", 1.0), (4, "g16", "circuit", 6.0)]
+        results = [{"batch_num": batch_num, "proving_scheme": scheme, "target_division": division,
+                    "stages": {"compute_witness": {"wall_time": cost / 2}, "generate_proof": {"wall_time": cost / 2}}}
+                   for batch_num, scheme, division, cost in rows]
+        with open(report_dir + "report.json", "w") as f:
+            json.dump({"results": results}, f)
+        try:
+            self.assertEqual({2: 1.0, 4: 6.0}, load_costs(report_dir + "report.json"))
+            self.assertEqual({2: 4.0, 4: 6.0}, load_costs(report_dir + "report.json", "g16", "circuit"))
+            self.assertEqual({2: 3.0}, load_costs(report_dir + "report.json", "g16", "hint"))
+        finally:
+            shutil.rmtree(report_dir, ignore_errors=True)
+
+    def test_closed_epoch_must_be_exact(self):
+        planner = BatchPlanner(menu={4: ""}, costs={4: 1.0})
+        with self.assertRaises(Exception):
+            planner.plan(2010, 2030)
+
+
+class BatchPlannerExecuteTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = os.path.abspath("./test_planner") + "/"
+        menu = dict()
+        for batch_num in [2, 4]:
+            menu[batch_num] = generate_test_config(self.dir, batch_num, data_dir="data{}/".format(batch_num))
+            zok = Zokrates(menu[batch_num])
+            zok.compile()
+            zok.setup()
+        self.planner = BatchPlanner(menu=menu, costs={2: 1.0, 4: 1.5})
+        self.chain = SyntheticChain(self.dir + "headers.dat")
+        self.chain.mine(10)
+
+    def tearDown(self) -> None:
+        self.chain.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_execute_with_scheduler(self):
+        batches, next_height = self.planner.plan(0, 9)
+        self.assertEqual([(0, 3, 4), (4, 7, 4), (8, 9, 2)], batches)
+        # a range above the tip fails alone, when its input is built
+        batches.append((10, 13, 4))
+        scheduler = MemoryScheduler(MemoryModel(self.dir + "memory.json"), budget=8 * 1024 ** 3, max_workers=2, available=lambda: 8 * 1024 ** 3)
+        proofs = self.planner.execute(batches, SyntheticBTCMock(self.chain), scheduler=scheduler)
+        self.assertEqual([(0, 3), (4, 7), (8, 9)], sorted(proofs))
+        self.assertEqual([(10, 13)], list(self.planner.failed))
+        for proof_path in proofs.values():
+            self.assertTrue(os.path.exists(proof_path))
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from unittest import TestCase
+
+from zk_relay.calldata import encode_proof_arguments, encode_relay_calldata, flatten_proof_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS proofs (
+    start_height INTEGER NOT NULL,
+    end_height INTEGER NOT NULL,
+    scheme TEXT NOT NULL,
+    vk_hash TEXT NOT NULL,
+    proof TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    flat_calldata TEXT NOT NULL,
+    abi_arguments BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (start_height, end_height, scheme, vk_hash)
+);
+CREATE INDEX IF NOT EXISTS proofs_by_end ON proofs (end_height);
+"""
+COLUMNS = "start_height, end_height, scheme, vk_hash, proof, inputs, flat_calldata, abi_arguments, created_at"
+
+
+def vkey_hash(vkey_path: str) -> str:
+    """ sha256 of the verification key file; proofs of different setups never share a key """
+    with open(vkey_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ProofRecord:
+    """ one stored proof with its ready-to-submit calldata """
+    def __init__(self, start_height: int, end_height: int, scheme: str, vk_hash: str, proof: str, inputs: str,
+                 flat_calldata: str, abi_arguments: bytes, created_at: float):
+        self.start_height = start_height
+        self.end_height = end_height
+        self.scheme = scheme
+        self.vk_hash = vk_hash
+        self.proof = json.loads(proof)  # "proof" member of proof.json
+        self.inputs = json.loads(inputs)  # public input followed by the outputs, hex strings
+        self.flat_calldata = flat_calldata  # same as Actor.flatten_proof
+        self.abi_arguments = bytes(abi_arguments)  # abi encoding of (proof, inputs)
+        self.created_at = created_at
+
+    def proof_json(self) -> dict:
+        """ same contents as the proof.json it was stored from """
+        return {"proof": self.proof, "inputs": self.inputs}
+
+    def relay_calldata(self, branch_index: int = 0) -> bytes:
+        """ complete relay3 calldata: selector, branch index and the stored argument encoding """
+        return encode_relay_calldata(self.abi_arguments, len(self.inputs), branch_index)
+
+    def to_dict(self) -> dict:
+        return {
+            "start_height": self.start_height,
+            "end_height": self.end_height,
+            "scheme": self.scheme,
+            "vk_hash": self.vk_hash,
+            "proof": self.proof,
+            "inputs": self.inputs,
+            "flat_calldata": self.flat_calldata,
+            "abi_arguments": "0x" + self.abi_arguments.hex(),
+            "created_at": self.created_at
+        }
+
+
+class ProofStore:
+    """ sqlite index of proofs keyed by (start height, end height, proving scheme, verification key hash) """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(SCHEMA)
+
+    def put(self, start_height: int, end_height: int, scheme: str, vk_hash: str, proof_json: dict) -> ProofRecord:
+        """ stores a parsed proof.json with its calldata; a proof of the same key is replaced, one relay3 can not take is refused """
+        row = (start_height, end_height, scheme, vk_hash,
+               json.dumps(proof_json["proof"]), json.dumps(proof_json["inputs"]),
+               flatten_proof_json(proof_json, scheme), encode_proof_arguments(proof_json, scheme), time.time())
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO proofs ({}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)".format(COLUMNS), row)
+        return ProofRecord(*row)
+
+    def put_file(self, start_height: int, end_height: int, scheme: str, vkey_path: str, proof_path: str) -> ProofRecord:
+        with open(proof_path, "r") as json_data:
+            proof_json = json.load(json_data)
+        return self.put(start_height, end_height, scheme, vkey_hash(vkey_path), proof_json)
+
+    def get(self, start_height: int, end_height: int, scheme: str, vk_hash: str) -> ProofRecord:
+        """ the stored proof of the key, None when it was never proved """
+        row = self._conn.execute(
+            "SELECT {} FROM proofs WHERE start_height = ? AND end_height = ? AND scheme = ? AND vk_hash = ?".format(COLUMNS),
+            (start_height, end_height, scheme, vk_hash)).fetchone()
+        return None if row is None else ProofRecord(*row)
+
+    def query(self, from_height: int, to_height: int, scheme: str = None, vk_hash: str = None) -> list:
+        """ proofs whose heights lie within [from_height, to_height], ordered by start height """
+        sql = "SELECT {} FROM proofs WHERE start_height >= ? AND end_height <= ?".format(COLUMNS)
+        params = [from_height, to_height]
+        if scheme is not None:
+            sql += " AND scheme = ?"
+            params.append(scheme)
+        if vk_hash is not None:
+            sql += " AND vk_hash = ?"
+            params.append(vk_hash)
+        sql += " ORDER BY start_height, end_height"
+        return [ProofRecord(*row) for row in self._conn.execute(sql, params)]
+
+    def delete(self, start_height: int, end_height: int, scheme: str = None, vk_hash: str = None) -> int:
+        """ removes the proofs of exactly [start_height, end_height]; returns the number removed """
+        sql = "DELETE FROM proofs WHERE start_height = ? AND end_height = ?"
+        params = [start_height, end_height]
+        if scheme is not None:
+            sql += " AND scheme = ?"
+            params.append(scheme)
+        if vk_hash is not None:
+            sql += " AND vk_hash = ?"
+            params.append(vk_hash)
+        with self._conn:
+            return self._conn.execute(sql, params).rowcount
+
+    def export(self, export_path: str, from_height: int = 0, to_height: int = 2 ** 62, scheme: str = None, vk_hash: str = None) -> int:
+        """ writes the matching proofs as json lines; returns the number written """
+        records = self.query(from_height, to_height, scheme, vk_hash)
+        os.makedirs(os.path.dirname(export_path) or ".", exist_ok=True)
+        with open(export_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record.to_dict()) + "\n")
+        return len(records)
+
+    def close(self):
+        self._conn.close()
+
+
+class ProofStoreTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = "./test_proof_store/"
+        self.store = ProofStore(self.dir + "proofs.sqlite")
+        self.proof_json = {
+            "proof": {"a": ["0x1", "0x2"], "b": [["0x3", "0x4"], ["0x5", "0x6"]], "c": ["0x7", "0x8"]},
+            "inputs": ["0x9", "0xa", "0xb", "0xc", "0xd"]
+        }
+
+    def tearDown(self) -> None:
+        self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_put_and_get(self):
+        self.store.put(100, 101, "g16", "aa", self.proof_json)
+        record = self.store.get(100, 101, "g16", "aa")
+        self.assertEqual(self.proof_json["inputs"], record.inputs)
+        self.assertEqual(flatten_proof_json(self.proof_json, "g16"), record.flat_calldata)
+        self.assertEqual(encode_relay_calldata(encode_proof_arguments(self.proof_json, "g16"), 5, 1), record.relay_calldata(1))
+        self.assertIsNone(self.store.get(100, 101, "g16", "bb"))
+
+    def test_query_and_export(self):
+        for start in [100, 102, 104]:
+            self.store.put(start, start + 1, "g16", "aa", self.proof_json)
+        self.store.put(102, 103, "gm17", "cc", self.proof_json)
+        self.assertEqual([102, 104], [record.start_height for record in self.store.query(102, 105, scheme="g16")])
+        self.assertEqual(2, len(self.store.query(102, 103)))
+        self.assertEqual(4, self.store.export(self.dir + "export.jsonl"))
+        with open(self.dir + "export.jsonl", "r") as f:
+            self.assertEqual(100, json.loads(f.readline())["start_height"])
+        self.assertEqual(1, self.store.delete(102, 103, scheme="gm17"))
@@ -0,0 +1,106 @@
+import functools
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase
+
+from config_batch import generate_test_config
+from zk_relay.actor import Actor
+from zk_relay.bitcoin_mock.bitcoin_mock import SyntheticBTCMock
+from zk_relay.bitcoin_mock.synthetic_chain import SyntheticChain
+from zokrates_libs.scheduler import MemoryModel, MemoryScheduler
+from zokrates_libs.zokrates import Zokrates
+
+
+def _prove_job(zok_cli: Zokrates, encoded_input: list) -> str:
+    """ runs in a worker process: compute witness and generate proof inside the job directory """
+    zok_cli.prove(encoded_input)
+    return zok_cli.proof_path
+
+
+class ProverPool:
+    """
+    proves many (from_height, end_height) ranges in parallel, one scratch directory per job
+    with a scheduler, jobs are admitted by their estimated memory instead of a fixed number of workers
+    """
+    def __init__(self, actor: Actor, num_workers: int = None, scratch_dir: str = None, scheduler: MemoryScheduler = None):
+        self.actor = actor
+        self.scheduler = scheduler
+        self.num_workers = os.cpu_count() if num_workers is None else num_workers
+        self.scratch_dir = self.actor.zok_cli.data_dir + "jobs/" if scratch_dir is None else scratch_dir
+        if not self.scratch_dir.endswith("/"):
+            self.scratch_dir += "/"
+        self.failed = dict()
+
+    def job_dir(self, from_height: int, end_height: int) -> str:
+        return self.scratch_dir + "{}_{}/".format(from_height, end_height)
+
+    def build_jobs(self, ranges: list) -> list:
+        """ [(range, job client, input builder)] as taken by MemoryScheduler.run, which builds each input when it admits the job """
+        jobs = list()
+        for from_height, end_height in ranges:
+            job_cli = self.actor.zok_cli.for_job(self.job_dir(from_height, end_height))
+            jobs.append(((from_height, end_height), job_cli, functools.partial(self.actor.build_input, from_height, end_height)))
+        return jobs
+
+    def prove_ranges(self, ranges: list) -> dict:
+        """ returns {(from_height, end_height): proof_path} of the succeeded jobs; failures are kept in self.failed """
+        self.failed = dict()
+        if self.scheduler is not None:
+            proofs = self.scheduler.run(self.build_jobs(ranges))
+            self.failed = self.scheduler.failed
+            return proofs
+
+        futures = dict()
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            # inputs are built here (network bound) while earlier jobs are already proving
+            for from_height, end_height in ranges:
+                job_cli = self.actor.zok_cli.for_job(self.job_dir(from_height, end_height))
+                try:
+                    encoded_input = self.actor.build_input(from_height, end_height)
+                except Exception as e:
+                    print("[Error] building input of {} fails: {}".format((from_height, end_height), e))
+                    self.failed[(from_height, end_height)] = e
+                    continue
+                futures[(from_height, end_height)] = executor.submit(_prove_job, job_cli, encoded_input)
+
+            proofs = dict()
+            for height_range, future in futures.items():
+                try:
+                    proofs[height_range] = future.result()
+                except Exception as e:
+                    print("[Error] proving {} fails: {}".format(height_range, e))
+                    self.failed[height_range] = e
+        return proofs
+
+
+class ProverPoolTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = os.path.abspath("./test_prover_pool") + "/"
+        config_path = generate_test_config(self.dir, 2, data_dir="data2/")
+        self.chain = SyntheticChain(self.dir + "headers.dat")
+        self.chain.mine(8)
+        self.actor = Actor(SyntheticBTCMock(self.chain), config_path)
+        self.actor.zok_cli.compile()
+        self.actor.zok_cli.setup()
+        # heights 30 and 31 are not mined: only that job fails
+        self.ranges = [(0, 1), (2, 3), (30, 31), (4, 5)]
+
+    def tearDown(self) -> None:
+        self.chain.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def check(self, pool: ProverPool, proofs: dict):
+        self.assertEqual([(0, 1), (2, 3), (4, 5)], sorted(proofs))
+        self.assertEqual([(30, 31)], list(pool.failed))
+        for (from_height, end_height), proof_path in proofs.items():
+            self.assertTrue(self.actor.check_proof(from_height, end_height, proof_path))
+
+    def test_process_pool(self):
+        pool = ProverPool(self.actor, num_workers=2)
+        self.check(pool, pool.prove_ranges(self.ranges))
+
+    def test_scheduler(self):
+        scheduler = MemoryScheduler(MemoryModel(self.dir + "memory.json"), budget=8 * 1024 ** 3, max_workers=2, available=lambda: 8 * 1024 ** 3)
+        pool = ProverPool(self.actor, scheduler=scheduler)
+        self.check(pool, pool.prove_ranges(self.ranges))
@@ -0,0 +1,157 @@
+""" Native reference of the zokrates circuit (code/libs/*.zok) working directly on raw 80-bytes headers. """
+from hashlib import sha256
+from unittest import TestCase
+
+HEADER_BYTE_LEN = 80
+EPOCH_LENGTH = 2016
+TARGET_TIMESPAN = 1209600  # divisor hardcoded in div_int.zok
+FIELD_MODULUS = 21888242871839275222246405745257275088548364400416034343698204186575808495617  # bn128 scalar field
+
+
+def hash_block(raw_header: bytes) -> bytes:
+    """ hash_block.zok: double sha256, returned as raw (little endian) digest """
+    return sha256(sha256(raw_header).digest()).digest()
+
+
+def header_time(raw_header: bytes) -> int:
+    return int.from_bytes(raw_header[68:72], "little")
+
+
+def header_bits(raw_header: bytes) -> int:
+    return int.from_bytes(raw_header[72:76], "little")
+
+
+def pack_target(bits: int) -> int:
+    """ pack_target.zok: exponents out of 0x17..0x1e fall to the last branch (shift of 224) """
+    exp = bits >> 24
+    coef = bits & 0xffffff
+    if 0x17 <= exp <= 0x1e:
+        return coef << (8 * (exp - 3))
+    return coef << 224
+
+
+def div_int(target: int) -> (int, int):
+    """ div_int.zok: 233 rounds of shift-and-subtract, returns (remainder, quotient) """
+    quotient = 0
+    for j in range(232, -1, -1):
+        expanded_divisor = TARGET_TIMESPAN << j
+        if expanded_divisor <= target:
+            quotient += 1 << j
+            target -= expanded_divisor
+    return target, quotient
+
+
+def update_target(epoch_head_time: int, epoch_head_bits: int, epoch_tail_time: int) -> int:
+    """ update_target.zok: arithmetic is done in the field, as the circuit does """
+    return retarget_hint(epoch_head_time, epoch_head_bits, epoch_tail_time)[0]
+
+
+def retarget_hint(epoch_head_time: int, epoch_head_bits: int, epoch_tail_time: int) -> (int, int):
+    """ (quotient, remainder) private inputs checked by update_target_hint.zok """
+    time_delta = (epoch_tail_time - epoch_head_time) % FIELD_MODULUS
+    expanded_current_target = pack_target(epoch_head_bits) * time_delta % FIELD_MODULUS
+    remainder, quotient = div_int(expanded_current_target)
+    return quotient, remainder
+
+
+def time_and_bits_word(raw_header: bytes) -> int:
+    """ 5th 16-bytes word of a header (merkle root tail, time, bits, nonce) packed as a field """
+    return int.from_bytes(raw_header[64:80], "big")
+
+
+def validate_headers(expected_bits: int, raw_headers: bytes, prev_hash: bytes = None) -> bytes:
+    """
+    validate_block_header.zok over every header of raw_headers (concatenated 80-bytes headers)
+    returns the hash of the last header, raises an Exception naming the first invalid header
+    """
+    if len(raw_headers) % HEADER_BYTE_LEN != 0:
+        raise Exception("Headers length should be multiple of {}: {}".format(HEADER_BYTE_LEN, len(raw_headers)))
+    view = memoryview(raw_headers)
+    prev_hash = bytes(view[4:36]) if prev_hash is None else prev_hash
+    target = pack_target(expected_bits)
+    for offset in range(0, len(view), HEADER_BYTE_LEN):
+        raw_header = view[offset:offset + HEADER_BYTE_LEN]
+        index = offset // HEADER_BYTE_LEN
+        if raw_header[4:36] != prev_hash:
+            raise Exception("[header {}] previous hash does not link to the previous header".format(index))
+        if header_bits(raw_header) != expected_bits:
+            raise Exception("[header {}] bits {:08x} differ from epoch head bits {:08x}".format(index, header_bits(raw_header), expected_bits))
+        prev_hash = hash_block(raw_header)
+        if not target > int.from_bytes(prev_hash, "little"):
+            raise Exception("[header {}] block hash does not meet the target".format(index))
+    return prev_hash
+
+
+def _parse_batch(epoch_head_time_and_bits: int, raw_headers: bytes) -> (int, int, int):
+    """ (epoch head time, epoch head bits, epoch tail time) as read by validate_batchN.zok """
+    num = len(raw_headers) // HEADER_BYTE_LEN
+    if num < 2:
+        raise Exception("The circuit needs at least 2 headers, but {}".format(num))
+    head_word = epoch_head_time_and_bits.to_bytes(16, "big")
+    tail = raw_headers[(num - 2) * HEADER_BYTE_LEN:(num - 1) * HEADER_BYTE_LEN]
+    return int.from_bytes(head_word[4:8], "little"), int.from_bytes(head_word[8:12], "little"), header_time(tail)
+
+
+def predict_outputs(epoch_head_time_and_bits: int, raw_headers: bytes) -> list:
+    """ public outputs of validate_batchN.zok: [prev_hash, final_hash, new_time_and_bits, updated_target] """
+    head_time, head_bits, tail_time = _parse_batch(epoch_head_time_and_bits, raw_headers)
+
+    final_hash = validate_headers(head_bits, raw_headers)
+
+    last = raw_headers[len(raw_headers) - HEADER_BYTE_LEN:]
+    return [
+        int.from_bytes(raw_headers[4:36], "little"),
+        int.from_bytes(final_hash, "little"),
+        time_and_bits_word(last),
+        update_target(head_time, head_bits, tail_time)
+    ]
+
+
+def batch_retarget_hint(epoch_head_time_and_bits: int, raw_headers: bytes) -> (int, int):
+    """ private (quotient, remainder) inputs of a batch circuit generated with TARGET_DIVISION = "hint" """
+    return retarget_hint(*_parse_batch(epoch_head_time_and_bits, raw_headers))
+
+
+def check_proof_inputs(proof_json: dict, epoch_head_time_and_bits: int, outputs: list) -> bool:
+    """ compares "inputs" of proof.json (public input followed by outputs) with the predicted values """
+    expected = [epoch_head_time_and_bits] + outputs
+    actual = [int(value, 16) for value in proof_json["inputs"]]
+    return actual == expected
+
+
+class ReferenceTest(TestCase):
+    def setUp(self) -> None:
+        # mainnet heights 0, 1, 2
+        self.headers = [bytes.fromhex(header) for header in [
+            "0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c",
+            "010000006fe28c0ab6f1b372c1a6a246ae63f74f931e8365e15a089c68d6190000000000982051fd1e4ba744bbbe680e1fee14677ba1a3c3540bf7b1cdb606e857233e0e61bc6649ffff001d01e36299",
+            "010000004860eb18bf1b1620e37e9490fc8a427514416fd75159ab86688e9a8300000000d5fdcc541e25de1c7a5addedf24858b8bb665c9f36ef744ee42c316022c90f9bb0bc6649ffff001d08d2bd61"
+        ]]
+        self.head_word = time_and_bits_word(self.headers[0])
+
+    def test_pack_target(self):
+        self.assertEqual(0xffff << 208, pack_target(0x1d00ffff))
+
+    def test_div_int(self):
+        self.assertEqual(divmod(123456789 << 200, TARGET_TIMESPAN)[::-1], div_int(123456789 << 200))
+
+    def test_predict_outputs(self):
+        outputs = predict_outputs(self.head_word, b"".join(self.headers))
+        self.assertEqual(0, outputs[0])
+        self.assertEqual(0x000000006a625f06636b8bb6ac7b960a8d03705d1ace08b1a19da3fdcc99ddbd, outputs[1])
+        self.assertEqual(time_and_bits_word(self.headers[2]), outputs[2])
+        time_delta = header_time(self.headers[1]) - header_time(self.headers[0])
+        self.assertEqual((0xffff << 208) * time_delta // TARGET_TIMESPAN, outputs[3])
+
+        proof_json = {"inputs": ["0x{:064x}".format(value) for value in [self.head_word] + outputs]}
+        self.assertTrue(check_proof_inputs(proof_json, self.head_word, outputs))
+
+    def test_batch_retarget_hint(self):
+        quotient, remainder = batch_retarget_hint(self.head_word, b"".join(self.headers))
+        time_delta = header_time(self.headers[1]) - header_time(self.headers[0])
+        self.assertEqual((0xffff << 208) * time_delta, quotient * TARGET_TIMESPAN + remainder)
+        self.assertLess(remainder, TARGET_TIMESPAN)
+
+    def test_broken_link(self):
+        with self.assertRaises(Exception):
+            predict_outputs(self.head_word, self.headers[0] + self.headers[2])
@@ -0,0 +1,328 @@
+import asyncio
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from config_batch import generate_test_config
+from zk_relay import header_tree
+from zk_relay.actor import Actor
+from zk_relay.bitcoin_mock.rpc_stub import LocalBitcoinRpc
+from zk_relay.calldata import RELAY_SCHEMES
+from zk_relay.header_fetcher import HeaderFetcher
+from zk_relay.header_tree import HeaderTree, Reorg
+from zk_relay.proof_store import ProofRecord, ProofStore, vkey_hash
+from zk_relay.reference import hash_block
+from zk_relay.reorg import ReorgWatcher, is_stale
+
+EPOCH_LENGTH = 2016
+
+
+class Relayer:
+    """
+    long-running relayer following the chain tip, four pipelined stages connected by bounded queues:
+    tip polling -> batch assembly (fetch + encode) -> proving -> proof emission
+    assembly of batch N+1 runs while batch N is being proved; a full queue blocks the stage in front of it
+    """
+    def __init__(self, actor: Actor, header_fetcher: HeaderFetcher, start_height: int, batch_num: int,
+                 emit=print, poll_interval: float = 30, queue_size: int = 1, confirmations: int = 0, proof_store: ProofStore = None,
+                 verify_proofs: bool = False, reorg_watcher: ReorgWatcher = None):
+        # a batch never crosses a retarget boundary when batch_num divides the epoch from an aligned start
+        if EPOCH_LENGTH % batch_num != 0 or start_height % EPOCH_LENGTH % batch_num != 0:
+            raise Exception("Batches of {} from height {} would cross a retarget boundary".format(batch_num, start_height))
+        if actor.zok_cli.proving_scheme not in RELAY_SCHEMES:
+            raise Exception("relay3 can not verify {} proofs; use a setup of {}".format(actor.zok_cli.proving_scheme, " or ".join(RELAY_SCHEMES)))
+        self.actor = actor
+        self.header_fetcher = header_fetcher
+        self.start_height = start_height
+        self.next_height = start_height
+        self.batch_num = batch_num
+        self.emit = emit
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.confirmations = confirmations
+        # proofs are recorded before they are emitted, so a failed submission is resent from the store
+        self.proof_store = proof_store
+        self._vk_hash = None
+        # proofs are verified off-chain before they are emitted, so a bad proof never reaches verifyTx
+        self.verify_proofs = verify_proofs
+        # the tip is followed through the watcher's header tree (the actor has to read from the same tree): stored proofs
+        # replaced by a reorg are re-proved, batches in flight above the fork are dropped and assembled again
+        self.reorg_watcher = reorg_watcher
+
+        self.tip_height = -1
+        self._tip_updated = None
+        self._stopping = None
+        self._io_executor = ThreadPoolExecutor(max_workers=1)
+        self._prove_executor = ThreadPoolExecutor(max_workers=1)
+
+    def stop(self):
+        """ graceful shutdown: batches already assembled are proved and emitted before run() returns """
+        print(">>> relayer stopping")
+        self._stopping.set()
+        self._tip_updated.set()
+
+    async def run(self):
+        self._tip_updated = asyncio.Event()
+        self._stopping = asyncio.Event()
+        prove_queue = asyncio.Queue(maxsize=self.queue_size)
+        emit_queue = asyncio.Queue(maxsize=self.queue_size)
+        try:
+            await asyncio.gather(
+                self._poll_tip(),
+                self._assemble_batches(prove_queue),
+                self._prove_batches(prove_queue, emit_queue),
+                self._emit_proofs(emit_queue)
+            )
+        finally:
+            self._io_executor.shutdown()
+            self._prove_executor.shutdown()
+
+    async def _poll_tip(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                if self.reorg_watcher is None:
+                    tip_height = await loop.run_in_executor(self._io_executor, self.header_fetcher.get_block_count)
+                else:
+                    for reorg in await loop.run_in_executor(self._io_executor, self.reorg_watcher.sync):
+                        try:
+                            await self._reprove(reorg)
+                        finally:
+                            self._rewind(reorg.fork_height)
+                    tip_height = self.reorg_watcher.tree.tip_height
+                if tip_height != self.tip_height:
+                    self.tip_height = tip_height
+                    self._tip_updated.set()
+            except Exception as e:
+                print("[Error] tip polling fails: {}".format(e))
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _assemble_batches(self, prove_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            end_height = self.next_height + self.batch_num - 1
+            if end_height > self.tip_height - self.confirmations:
+                self._tip_updated.clear()
+                await self._tip_updated.wait()
+                continue
+            from_height = self.next_height
+            try:
+                encoded_input, end_hash = await loop.run_in_executor(self._io_executor, self._build_input, from_height, end_height)
+            except Exception as e:
+                print("[Error] building input of [{}, {}] fails: {}".format(from_height, end_height, e))
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if not self._is_current(end_height, end_hash):
+                continue
+            await prove_queue.put((from_height, end_height, encoded_input, end_hash))
+            if self.next_height == from_height:
+                self.next_height = end_height + 1
+        await prove_queue.put(None)
+
+    def _build_input(self, from_height: int, end_height: int) -> (list, bytes):
+        """ on the io thread, as the watcher's sync: the input and the hash it was built from are read from the same tree """
+        end_hash = self.reorg_watcher.tree.best_hash(end_height) if self.reorg_watcher is not None else None
+        return self.actor.build_input(from_height, end_height, self.tip_height), end_hash
+
+    def _is_current(self, end_height: int, end_hash: bytes) -> bool:
+        """ False when a reorg replaced the header a batch ends with """
+        return self.reorg_watcher is None or self.reorg_watcher.tree.best_hash(end_height) == end_hash
+
+    async def _reprove(self, reorg: Reorg):
+        """
+        ReorgWatcher.handle split over the threads: the proof store is read and written here, on the loop thread that
+        opened its connection, inputs are built on the io thread and proved on the proving thread, after the batch being proved
+        """
+        loop = asyncio.get_running_loop()
+        watcher = self.reorg_watcher
+        watcher.forget(reorg)
+        for record in watcher.stale_records(reorg.fork_height):
+            job_cli = watcher.reprove_job(record)
+            if job_cli is None:
+                continue
+            encoded_input = await loop.run_in_executor(self._io_executor, watcher.actor.build_input, record.start_height, record.end_height)
+            await loop.run_in_executor(self._prove_executor, job_cli.prove, encoded_input)
+            watcher.actor.store_proof(watcher.proof_store, record.start_height, record.end_height, job_cli.proof_path)
+
+    def _rewind(self, fork_height: int):
+        """ assembly resumes from the batch holding the first replaced height; its proofs were re-proved into the store """
+        if fork_height + 1 >= self.next_height:
+            return
+        aligned = self.start_height + max(0, fork_height + 1 - self.start_height) // self.batch_num * self.batch_num
+        print(">>> reorg at height {}: relaying again from {}".format(fork_height, aligned))
+        self.next_height = aligned
+
+    async def _prove_batches(self, prove_queue: asyncio.Queue, emit_queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        failed = False
+        while True:
+            job = await prove_queue.get()
+            if job is None:
+                break
+            if failed:
+                continue
+            from_height, end_height, encoded_input, end_hash = job
+            if not self._is_current(end_height, end_hash):
+                print(">>> [{}, {}] was replaced by a reorg, dropped".format(from_height, end_height))
+                continue
+            if self._stored_proof(from_height, end_height) is not None:
+                print(">>> proof of [{}, {}] is already stored".format(from_height, end_height))
+                await emit_queue.put((from_height, end_height, None, end_hash))
+                continue
+            job_cli = self.actor.zok_cli.for_job(self.actor.zok_cli.data_dir + "relay/{}_{}/".format(from_height, end_height))
+            try:
+                await loop.run_in_executor(self._prove_executor, job_cli.prove, encoded_input)
+                if self.verify_proofs and not await loop.run_in_executor(self._prove_executor, job_cli.verify):
+                    raise Exception("the proof does not pass verification")
+            except Exception as e:
+                # later batches are dropped: the relayed chain would have a gap before them
+                print("[Error] proving [{}, {}] fails: {}".format(from_height, end_height, e))
+                failed = True
+                self.stop()
+                continue
+            await emit_queue.put((from_height, end_height, job_cli.proof_path, end_hash))
+        await emit_queue.put(None)
+
+    async def _emit_proofs(self, emit_queue: asyncio.Queue):
+        while True:
+            job = await emit_queue.get()
+            if job is None:
+                break
+            from_height, end_height, proof_path, end_hash = job
+            if not self._is_current(end_height, end_hash):
+                print(">>> proof of [{}, {}] was replaced by a reorg, dropped".format(from_height, end_height))
+                continue
+            print(">>> proof of [{}, {}] is ready".format(from_height, end_height))
+            if proof_path is None:
+                self.emit(self._stored_proof(from_height, end_height).flat_calldata)
+            elif self.proof_store is not None:
+                self.emit(self.actor.store_proof(self.proof_store, from_height, end_height, proof_path).flat_calldata)
+            else:
+                self.emit(self.actor.flatten_proof(proof_path))
+
+    def _stored_proof(self, from_height: int, end_height: int) -> ProofRecord:
+        if self.proof_store is None:
+            return None
+        if self._vk_hash is None:
+            self._vk_hash = vkey_hash(self.actor.zok_cli.vkey_path)
+        record = self.proof_store.get(from_height, end_height, self.actor.zok_cli.proving_scheme, self._vk_hash)
+        if record is not None and self.reorg_watcher is not None and is_stale(record, self.reorg_watcher.tree):
+            return None
+        return record
+
+
+class RelayerTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = "./test_relayer/"
+        self.chain = header_tree.HeaderTreeTest.branch(bytes(32), 6, 1000)
+        self.rpc = LocalBitcoinRpc(list(self.chain)).start()
+        self.fetcher = HeaderFetcher(self.rpc.url, "id", "pwd")
+        self.store = ProofStore(self.dir + "proofs.sqlite")
+        self.tree = HeaderTree()
+        self.tree.add(self.chain[0], 0)
+        self.actor = Actor(None, generate_test_config(self.dir, 2), self.fetcher, header_tree=self.tree)
+        self.actor.zok_cli.compile()
+        self.actor.zok_cli.setup()
+        self.emitted = list()
+
+    def tearDown(self) -> None:
+        self.fetcher.close()
+        self.rpc.stop()
+        self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def relayer(self, **kwargs) -> Relayer:
+        watcher = ReorgWatcher(self.actor, self.tree, self.store, self.fetcher)
+        return Relayer(self.actor, self.fetcher, 0, 2, emit=self.emitted.append, poll_interval=0.05, proof_store=self.store,
+                       reorg_watcher=watcher, **kwargs)
+
+    @staticmethod
+    async def wait_until(condition, timeout: float = 30):
+        for _ in range(int(timeout / 0.05)):
+            if condition():
+                return
+            await asyncio.sleep(0.05)
+        raise Exception("Timed out")
+
+    def calldata(self, from_height: int, end_height: int) -> str:
+        return self.store.get(from_height, end_height, "g16", vkey_hash(self.actor.zok_cli.vkey_path)).flat_calldata
+
+    def extend_chain(self, num: int) -> list:
+        """ heights 0 to 5 + num; returns the proved ranges relayed over them """
+        for raw_header in header_tree.HeaderTreeTest.branch(hash_block(self.chain[-1]), num, 3000):
+            self.rpc.append(raw_header)
+        return [(height, height + 1) for height in range(0, len(self.chain) + num - 1, 2)]
+
+    def track_assembly(self, relayer: Relayer) -> list:
+        """ list of the batches assembled but not emitted yet, taken each time a batch is assembled """
+        build_input, assembled, leads = relayer._build_input, list(), list()
+
+        def tracked(from_height: int, end_height: int):
+            leads.append(len(assembled) - len(self.emitted))
+            assembled.append((from_height, end_height))
+            return build_input(from_height, end_height)
+        relayer._build_input = tracked
+        return leads
+
+    def run_until(self, relayer: Relayer, num_emitted: int):
+        async def scenario():
+            task = asyncio.ensure_future(relayer.run())
+            await self.wait_until(lambda: len(self.emitted) >= num_emitted)
+            relayer.stop()
+            await asyncio.wait_for(task, 30)
+        asyncio.run(scenario())
+
+    def test_emission_order(self):
+        ranges = self.extend_chain(14)
+        relayer = self.relayer()
+        self.run_until(relayer, len(ranges))
+        self.assertEqual([self.calldata(*height_range) for height_range in ranges], self.emitted)
+        self.assertEqual(20, relayer.next_height)
+
+    def test_backpressure(self):
+        self.extend_chain(14)
+        relayer = self.relayer(queue_size=1)
+        leads = self.track_assembly(relayer)
+        self.run_until(relayer, 10)
+        # one batch queued for proving, one being proved and one queued for emission
+        self.assertLessEqual(max(leads), 3)
+        # assembly still runs ahead of proving
+        self.assertGreater(max(leads), 0)
+
+    def test_stop(self):
+        ranges = self.extend_chain(14)
+        relayer = self.relayer(queue_size=1)
+        leads = self.track_assembly(relayer)
+        self.run_until(relayer, 1)
+        # batches assembled before stop() are still proved and emitted, in order
+        self.assertEqual(len(leads), len(self.emitted))
+        self.assertLess(len(self.emitted), len(ranges))
+        self.assertEqual([self.calldata(*height_range) for height_range in ranges[:len(self.emitted)]], self.emitted)
+        with self.assertRaises(RuntimeError):
+            relayer._prove_executor.submit(print)
+
+    def test_reorg(self):
+        relayer = self.relayer()
+        fork = header_tree.HeaderTreeTest.branch(hash_block(self.chain[3]), 3, 2000)
+
+        async def scenario():
+            task = asyncio.ensure_future(relayer.run())
+            await self.wait_until(lambda: len(self.emitted) == 3)
+            stale = self.calldata(4, 5)
+            # blocks 4 and 5 are replaced by a longer branch forking at 3
+            self.rpc.reorg(3, fork)
+            await self.wait_until(lambda: len(self.emitted) == 4)
+            relayer.stop()
+            await asyncio.wait_for(task, 30)
+            return stale
+
+        stale = asyncio.run(scenario())
+        # [4, 5] was re-proved from the new branch and relayed again
+        self.assertEqual(6, relayer.next_height)
+        self.assertEqual(hash_block(fork[1]), self.tree.best_hash(5))
+        self.assertNotEqual(stale, self.calldata(4, 5))
+        self.assertEqual([self.calldata(0, 1), self.calldata(2, 3), stale, self.calldata(4, 5)], self.emitted)
+        self.assertEqual([], relayer.reorg_watcher.stale_records(3))
@@ -0,0 +1,180 @@
+import os
+import shutil
+from unittest import TestCase
+
+from config_batch import generate_test_config
+from zk_relay import header_tree
+from zk_relay.actor import Actor
+from zk_relay.bitcoin_mock.rpc_stub import LocalBitcoinRpc
+from zk_relay.header_fetcher import HeaderFetcher
+from zk_relay.header_tree import HeaderTree, Reorg
+from zk_relay.proof_store import ProofRecord, ProofStore, vkey_hash
+from zk_relay.reference import EPOCH_LENGTH, hash_block
+
+
+def is_stale(record: ProofRecord, tree: HeaderTree) -> bool:
+    """ True when the proved headers are no longer the best chain (public inputs 1, 2: previous and final hash) """
+    final_hash = tree.best_hash(record.end_height)
+    if final_hash is None or int(record.inputs[2], 16) != int.from_bytes(final_hash, "little"):
+        return True
+    prev_hash = tree.best_hash(record.start_height - 1)
+    return prev_hash is not None and int(record.inputs[1], 16) != int.from_bytes(prev_hash, "little")
+
+
+class ReorgWatcher:
+    """
+    follows the node into a HeaderTree and, when the best chain switches branch, re-proves only the stored batches
+    whose headers were replaced; proofs below the fork are kept
+    actor: an Actor built with the same header tree, so that inputs are read from the new best chain; None when the
+    caller re-proves the stale batches itself (see work_queue.Coordinator)
+    """
+    def __init__(self, actor, tree: HeaderTree, proof_store: ProofStore, header_fetcher: HeaderFetcher):
+        self.actor = actor
+        self.tree = tree
+        self.proof_store = proof_store
+        self.header_fetcher = header_fetcher
+
+    def root_at(self, height: int):
+        """ roots an empty tree at the header of height (a checkpoint: reorgs below it are not followed) """
+        if self.tree.root_height is None:
+            self.tree.add(self.header_fetcher.get_raw_headers(height, height), height)
+
+    def sync(self) -> list:
+        """ adds the headers up to the node tip, stepping back until they link to a known header; returns the reorgs """
+        tip_height = self.header_fetcher.get_block_count()
+        from_height = self.tree.tip_height + 1
+        step = 1
+        while True:
+            if from_height > tip_height:
+                return list()
+            raw_headers = self.header_fetcher.get_raw_headers(from_height, tip_height)
+            if self.tree.contains(raw_headers[4:36]):
+                break
+            if from_height <= self.tree.root_height + 1:
+                raise Exception("The node does not share the root header of the tree")
+            from_height = max(self.tree.root_height + 1, from_height - step)
+            step *= 2
+        return self.tree.extend(from_height, raw_headers)
+
+    def stale_records(self, fork_height: int, actor=None) -> list:
+        """ stored batches of the actor's setup (this watcher's by default) that end above fork_height and no longer match the best chain """
+        actor = self.actor if actor is None else actor
+        scheme = actor.zok_cli.proving_scheme
+        vk_hash = vkey_hash(actor.zok_cli.vkey_path)
+        # a batch never spans more than one epoch
+        records = self.proof_store.query(max(0, fork_height - EPOCH_LENGTH), 2 ** 62, scheme, vk_hash)
+        return [record for record in records if record.end_height > fork_height and is_stale(record, self.tree)]
+
+    def reprove_job(self, record: ProofRecord):
+        """ job client re-proving the range of record; None when the range is above the new tip, its record is dropped """
+        from_height, end_height = record.start_height, record.end_height
+        if self.tree.best_hash(end_height) is None:
+            # the new branch is shorter than the batch; the relayer proves it once the headers arrive
+            print(">>> [{}, {}] is above the new tip, dropped".format(from_height, end_height))
+            self.proof_store.delete(from_height, end_height, record.scheme, record.vk_hash)
+            return None
+        print(">>> re-prove [{}, {}] after reorg".format(from_height, end_height))
+        return self.actor.zok_cli.for_job(self.actor.zok_cli.data_dir + "reorg/{}_{}/".format(from_height, end_height))
+
+    def reprove(self, records: list) -> list:
+        """ proves the ranges of records again from the best chain; the new proofs replace the stored ones """
+        reproved = list()
+        for record in records:
+            job_cli = self.reprove_job(record)
+            if job_cli is None:
+                continue
+            job_cli.prove(self.actor.build_input(record.start_height, record.end_height))
+            self.actor.store_proof(self.proof_store, record.start_height, record.end_height, job_cli.proof_path)
+            reproved.append((record.start_height, record.end_height))
+        return reproved
+
+    def forget(self, reorg: Reorg):
+        """ drops what was learned from the replaced blocks """
+        print(">>> reorg at height {}: {} blocks replaced by {}".format(reorg.fork_height, len(reorg.disconnected), len(reorg.connected)))
+        if self.actor is not None and self.actor.epoch_index is not None:
+            self.actor.epoch_index.invalidate(reorg.fork_height)
+
+    def handle(self, reorg: Reorg) -> list:
+        """ re-proves the stored batches a reorg replaced; returns the re-proved ranges """
+        self.forget(reorg)
+        return self.reprove(self.stale_records(reorg.fork_height))
+
+    def poll(self) -> list:
+        """ one sync; returns the re-proved ranges """
+        reproved = list()
+        for reorg in self.sync():
+            reproved += self.handle(reorg)
+        return reproved
+
+
+class ReorgWatcherTest(TestCase):
+    class FakeZokrates:
+        proving_scheme = "g16"
+        vkey_path = "./test_reorg/verification.key"
+
+    class FakeActor:
+        zok_cli = None
+        epoch_index = None
+
+    def setUp(self) -> None:
+        self.dir = "./test_reorg/"
+        os.makedirs(self.dir, exist_ok=True)
+        with open(ReorgWatcherTest.FakeZokrates.vkey_path, "w") as f:
+            f.write("vk")
+        self.actor = ReorgWatcherTest.FakeActor()
+        self.actor.zok_cli = ReorgWatcherTest.FakeZokrates()
+
+        self.chain = header_tree.HeaderTreeTest.branch(bytes(32), 6, 1000)
+        self.fork = header_tree.HeaderTreeTest.branch(hash_block(self.chain[3]), 3, 2000)
+        self.rpc = LocalBitcoinRpc(list(self.chain)).start()
+        self.fetcher = HeaderFetcher(self.rpc.url, "id", "pwd")
+        self.store = ProofStore(self.dir + "proofs.sqlite")
+
+        self.tree = HeaderTree()
+        self.tree.add(self.chain[0], 0)
+        self.watcher = ReorgWatcher(self.actor, self.tree, self.store, self.fetcher)
+
+    def tearDown(self) -> None:
+        self.fetcher.close()
+        self.rpc.stop()
+        self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def put_batch(self, start_height: int, end_height: int, raw_headers: list):
+        point = "0x" + "11" * 32
+        inputs = ["0x0", hex(int.from_bytes(raw_headers[start_height][4:36], "little")),
+                  hex(int.from_bytes(hash_block(raw_headers[end_height]), "little")), "0x0", "0x0"]
+        proof_json = {"proof": {"a": [point, point], "b": [[point, point], [point, point]], "c": [point, point]}, "inputs": inputs}
+        self.store.put(start_height, end_height, "g16", vkey_hash(self.actor.zok_cli.vkey_path), proof_json)
+
+    def test_one_batch_is_stale(self):
+        self.assertEqual([], self.watcher.sync())
+        self.assertEqual(5, self.tree.tip_height)
+        for start_height in [0, 2, 4]:
+            self.put_batch(start_height, start_height + 1, self.chain)
+
+        # blocks 4 and 5 are replaced by a longer branch forking at 3
+        self.rpc.reorg(3, self.fork)
+        reorgs = self.watcher.sync()
+        self.assertEqual(1, len(reorgs))
+        self.assertEqual(3, reorgs[0].fork_height)
+        self.assertEqual(6, self.tree.tip_height)
+        self.assertEqual([(4, 5)], [(record.start_height, record.end_height) for record in self.watcher.stale_records(3)])
+
+    def test_reprove_with_actor(self):
+        actor = Actor(None, generate_test_config(self.dir, 2), self.fetcher, header_tree=self.tree)
+        actor.zok_cli.compile()
+        actor.zok_cli.setup()
+        self.watcher.actor = actor
+
+        self.watcher.sync()
+        for start_height in [0, 2, 4]:
+            actor.zok_cli.prove(actor.build_input(start_height, start_height + 1))
+            actor.store_proof(self.store, start_height, start_height + 1)
+
+        self.rpc.reorg(3, self.fork)
+        self.assertEqual([(4, 5)], self.watcher.poll())
+        record = self.store.get(4, 5, "g16", vkey_hash(actor.zok_cli.vkey_path))
+        self.assertEqual(hash_block(self.fork[1]), self.tree.best_hash(5))
+        self.assertFalse(is_stale(record, self.tree))
+        self.assertEqual([], self.watcher.stale_records(3))
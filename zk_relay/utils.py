@@ -1,6 +1,8 @@
 from hashlib import sha256
 from typing import Union
 
+from zokrates_libs import tracing
+
 
 # useful
 def double_hash_as_little(pre: Union[str, bytes]) -> str:
@@ -18,6 +20,7 @@ def double_hash_as_big(pre: str) -> str:
 
 
 # necessary
+@tracing.traced("utils.split_hex_to_int_array", "encoding")
 def split_hex_to_int_array(target: str, unit_byte_len: int) -> list:
     unit_hex_len = unit_byte_len * 2
     if target.startswith("0x"):
@@ -30,6 +33,7 @@ def split_hex_to_int_array(target: str, unit_byte_len: int) -> list:
 
 
 # necessary
+@tracing.traced("utils.padding", "encoding")
 def padding(value: str):
     bit_len = len(value) * 4
     # determine number of blocks
@@ -0,0 +1,506 @@
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import time
+from unittest import TestCase
+
+from config_batch import generate_test_config
+from zk_relay.actor import Actor
+from zk_relay.bitcoin_mock.bitcoin_mock import SyntheticBTCMock
+from zk_relay.bitcoin_mock.synthetic_chain import SyntheticChain
+from zk_relay.calldata import RELAY_SCHEMES
+from zk_relay.planner import BatchPlanner
+from zk_relay.proof_store import ProofStore, vkey_hash
+from zk_relay.reference import time_and_bits_word
+from zk_relay.reorg import ReorgWatcher
+from zokrates_libs.zokrates import Zokrates
+
+LEASE_TIMEOUT = 120  # seconds without a heartbeat before a claimed job is given to another worker
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 1
+
+
+def job_name(from_height: int, end_height: int) -> str:
+    """ zero-padded, so that workers claim in height order """
+    return "{:010d}_{:010d}".format(from_height, end_height)
+
+
+class WorkQueue:
+    """
+    queue of batch proving jobs in a directory shared by every host; rename has to be atomic on that filesystem
+      pending/  jobs waiting for a worker
+      claimed/  jobs renamed from pending/ by a worker (the rename is the claim), their mtime is the worker's heartbeat
+      done/     proofs uploaded by workers, until the coordinator collects them
+      failed/   jobs that failed max_attempts times
+    files are written into tmp/ first and renamed into place, so readers never see a partial job or proof
+    heartbeats and the lease clock are both the mtime of a file touched without explicit times, which the file server
+    sets (NFS SET_TO_SERVER_TIME), so host clocks do not have to agree
+    """
+    def __init__(self, root: str, lease_timeout: float = LEASE_TIMEOUT, max_attempts: int = MAX_ATTEMPTS):
+        self.root = root if root.endswith("/") else root + "/"
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        for name in ["pending", "claimed", "done", "failed", "tmp"]:
+            os.makedirs(self.root + name, exist_ok=True)
+
+    def _publish(self, directory: str, file_name: str, contents: dict):
+        tmp_path = self.root + "tmp/{}.{}.{}".format(file_name, os.getpid(), threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump(contents, f)
+        os.replace(tmp_path, self.root + directory + "/" + file_name)
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _now(self) -> float:
+        """ current time of the clock heartbeats are stamped with """
+        clock_path = self.root + "tmp/clock.{}.{}".format(socket.gethostname(), os.getpid())
+        with open(clock_path, "a"):
+            os.utime(clock_path)
+        return os.path.getmtime(clock_path)
+
+    def _list(self, directory: str) -> list:
+        return sorted([name for name in os.listdir(self.root + directory) if name.endswith(".json")])
+
+    def state(self, from_height: int, end_height: int) -> str:
+        """ "pending", "claimed", "done", "failed" or None """
+        name = job_name(from_height, end_height)
+        for directory in ["done", "pending", "failed"]:
+            if os.path.exists(self.root + "{}/{}.json".format(directory, name)):
+                return directory
+        if any([claimed.startswith(name + "@") for claimed in self._list("claimed")]):
+            return "claimed"
+        return None
+
+    def submit(self, from_height: int, end_height: int, batch_num: int, encoded_input: list) -> bool:
+        """ False when the range is already queued, being proved or done """
+        if self.state(from_height, end_height) is not None:
+            return False
+        job = {"from_height": from_height, "end_height": end_height, "batch_num": batch_num, "encoded_input": encoded_input, "attempts": 0}
+        self._publish("pending", job_name(from_height, end_height) + ".json", job)
+        return True
+
+    def claim(self, worker_id: str) -> (dict, str):
+        """ (job, claimed path) of the lowest pending job this worker won, (None, None) when nothing is pending """
+        for file_name in self._list("pending"):
+            claimed_path = self.root + "claimed/{}@{}.json".format(file_name[:-len(".json")], worker_id)
+            try:
+                os.rename(self.root + "pending/" + file_name, claimed_path)
+            except FileNotFoundError:
+                # another worker was faster
+                continue
+            os.utime(claimed_path)
+            job = WorkQueue._read(claimed_path)
+            if os.path.exists(self.root + "done/" + file_name):
+                # proved by a worker whose lease had expired
+                os.remove(claimed_path)
+                continue
+            return job, claimed_path
+        return None, None
+
+    @staticmethod
+    def heartbeat(claimed_path: str) -> bool:
+        """ renews the lease; False when the job was taken back """
+        try:
+            os.utime(claimed_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job: dict, claimed_path: str, result: dict):
+        """ uploads the result of a job; a duplicate upload of the same range replaces the previous one """
+        self._publish("done", job_name(job["from_height"], job["end_height"]) + ".json", result)
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:
+            pass
+
+    def release(self, claimed_path: str, error: str = None) -> bool:
+        """ puts a claimed job back in pending/, or in failed/ after max_attempts; False when it was already taken back """
+        tmp_path = self.root + "tmp/" + os.path.basename(claimed_path)
+        try:
+            # taking the job out of claimed/ first: only one of the worker and the coordinator can release it
+            os.rename(claimed_path, tmp_path)
+        except FileNotFoundError:
+            return False
+        job = WorkQueue._read(tmp_path)
+        os.remove(tmp_path)
+        job["attempts"] += 1
+        job["error"] = error
+        name = job_name(job["from_height"], job["end_height"])
+        if os.path.exists(self.root + "done/{}.json".format(name)):
+            return True
+        self._publish("failed" if job["attempts"] >= self.max_attempts else "pending", name + ".json", job)
+        return True
+
+    def requeue_expired(self) -> list:
+        """ releases the claims whose heartbeat is older than the lease; returns their job names """
+        requeued = list()
+        now = self._now()
+        for file_name in self._list("claimed"):
+            claimed_path = self.root + "claimed/" + file_name
+            try:
+                expired = now - os.path.getmtime(claimed_path) > self.lease_timeout
+            except FileNotFoundError:
+                continue
+            if expired and self.release(claimed_path, "lease expired"):
+                requeued.append(file_name.split("@")[0])
+        return requeued
+
+    def reject(self, done_path: str, job: dict, error: str) -> str:
+        """ replaces an uploaded proof the coordinator refused by job, back in pending/ or in failed/ after max_attempts """
+        job["attempts"] += 1
+        job["error"] = error
+        directory = "failed" if job["attempts"] >= self.max_attempts else "pending"
+        self._publish(directory, job_name(job["from_height"], job["end_height"]) + ".json", job)
+        os.remove(done_path)
+        return directory
+
+    def failed(self) -> list:
+        """ [(failed path, job)] of the jobs that failed max_attempts times """
+        return [(self.root + "failed/" + file_name, WorkQueue._read(self.root + "failed/" + file_name)) for file_name in self._list("failed")]
+
+    def retry(self, from_height: int, end_height: int, encoded_input: list = None) -> bool:
+        """ moves a failed job back to pending/ with its attempts reset, and a fresh input if given; False when it did not fail """
+        name = job_name(from_height, end_height)
+        failed_path = self.root + "failed/{}.json".format(name)
+        try:
+            job = WorkQueue._read(failed_path)
+        except FileNotFoundError:
+            return False
+        job["attempts"] = 0
+        if encoded_input is not None:
+            job["encoded_input"] = encoded_input
+        self._publish("pending", name + ".json", job)
+        os.remove(failed_path)
+        return True
+
+    def withdraw(self, above_height: int) -> list:
+        """ removes the pending jobs ending above above_height (their inputs were replaced by a reorg); returns their names """
+        withdrawn = list()
+        for file_name in self._list("pending"):
+            if int(file_name.split("_")[1][:10]) <= above_height:
+                continue
+            try:
+                os.remove(self.root + "pending/" + file_name)
+            except FileNotFoundError:
+                # claimed meanwhile; the coordinator rejects its proof when collecting it
+                continue
+            withdrawn.append(file_name[:-len(".json")])
+        return withdrawn
+
+    def done(self) -> list:
+        """ [(done path, result)] of the uploaded proofs """
+        return [(self.root + "done/" + file_name, WorkQueue._read(self.root + "done/" + file_name)) for file_name in self._list("done")]
+
+    def is_idle(self) -> bool:
+        return len(self._list("pending")) == 0 and len(self._list("claimed")) == 0
+
+
+class Worker:
+    """ claims jobs of a WorkQueue, proves them with the batch configs of conf_dir and uploads the proofs """
+    def __init__(self, queue: WorkQueue, conf_dir: str = "./zk_relay/conf/", worker_id: str = None, scratch_dir: str = None):
+        self.queue = queue
+        self.conf_dir = conf_dir
+        self.worker_id = "{}-{}".format(socket.gethostname(), os.getpid()) if worker_id is None else worker_id
+        # job directories stay on the worker, next to the batch data as with ProverPool, unless scratch_dir is given
+        self.scratch_dir = scratch_dir if scratch_dir is None or scratch_dir.endswith("/") else scratch_dir + "/"
+        self.zok_clients = dict()
+        self.num_proved = 0
+
+    def zok_cli(self, batch_num: int) -> Zokrates:
+        if batch_num not in self.zok_clients:
+            config_path = os.path.join(self.conf_dir, "config_batch{}.toml".format(batch_num))
+            if not os.path.exists(config_path):
+                raise Exception("The setup for batch {} was not executed".format(batch_num))
+            self.zok_clients[batch_num] = Zokrates(config_path)
+        return self.zok_clients[batch_num]
+
+    def prove(self, job: dict, claimed_path: str) -> bool:
+        name = job_name(job["from_height"], job["end_height"])
+        try:
+            batch_cli = self.zok_cli(job["batch_num"])
+        except Exception as e:
+            # back to pending/ for a worker that has the setup, in failed/ once every attempt found none
+            print("[Error] proving {} fails: {}".format(name, e))
+            self.queue.release(claimed_path, str(e))
+            return False
+        job_dir = (batch_cli.data_dir + "jobs/" if self.scratch_dir is None else self.scratch_dir) + name
+        zok_cli = batch_cli.for_job(job_dir)
+        lost = threading.Event()
+        finished = threading.Event()
+
+        def beat():
+            while not finished.wait(self.queue.lease_timeout / 3):
+                if not WorkQueue.heartbeat(claimed_path):
+                    # the coordinator gave the job to another worker
+                    lost.set()
+                    zok_cli.cancel()
+                    return
+
+        heartbeat = threading.Thread(target=beat, daemon=True)
+        heartbeat.start()
+        try:
+            zok_cli.prove(job["encoded_input"])
+            with open(zok_cli.proof_path, "r") as f:
+                proof_json = json.load(f)
+        except Exception as e:
+            if not lost.is_set():
+                print("[Error] proving {} fails: {}".format(name, e))
+                self.queue.release(claimed_path, str(e))
+            return False
+        finally:
+            finished.set()
+            heartbeat.join()
+            shutil.rmtree(job_dir, ignore_errors=True)
+        self.queue.complete(job, claimed_path, {
+            "from_height": job["from_height"],
+            "end_height": job["end_height"],
+            "batch_num": job["batch_num"],
+            "scheme": zok_cli.proving_scheme,
+            "vk_hash": vkey_hash(zok_cli.vkey_path),
+            "worker": self.worker_id,
+            "attempts": job["attempts"],
+            "proof": proof_json
+        })
+        return True
+
+    def run(self, exit_when_idle: bool = False, max_jobs: int = None):
+        while max_jobs is None or self.num_proved < max_jobs:
+            job, claimed_path = self.queue.claim(self.worker_id)
+            if job is None:
+                if exit_when_idle:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            print(">>> {} proves [{}, {}]".format(self.worker_id, job["from_height"], job["end_height"]))
+            if self.prove(job, claimed_path):
+                self.num_proved += 1
+
+
+class Coordinator:
+    """
+    splits height ranges into batch jobs with a BatchPlanner, builds their inputs, requeues abandoned jobs and
+    collects the uploaded proofs into a ProofStore; ranges already stored or queued are not submitted again
+    reorg_watcher: inputs are read from its header tree, and batches replaced by a reorg are withdrawn or dropped and submitted again
+    """
+    def __init__(self, queue: WorkQueue, proof_store: ProofStore, planner: BatchPlanner, btc_cli=None, header_fetcher=None, epoch_index=None,
+                 reorg_watcher: ReorgWatcher = None):
+        self.queue = queue
+        self.proof_store = proof_store
+        self.planner = planner
+        self.btc_cli = btc_cli
+        self.header_fetcher = header_fetcher
+        self.epoch_index = epoch_index
+        self.reorg_watcher = reorg_watcher
+        self.actors = dict()
+        self.vk_hashes = dict()
+        self.ranges = list()
+
+    def actor(self, batch_num: int) -> Actor:
+        if batch_num not in self.actors:
+            header_tree = self.reorg_watcher.tree if self.reorg_watcher is not None else None
+            actor = Actor(self.btc_cli, self.planner.menu[batch_num], self.header_fetcher, self.epoch_index, header_tree)
+            # the proof store keeps relay3 calldata
+            if actor.zok_cli.proving_scheme not in RELAY_SCHEMES:
+                raise Exception("relay3 can not verify {} proofs of batch {}".format(actor.zok_cli.proving_scheme, batch_num))
+            self.actors[batch_num] = actor
+        return self.actors[batch_num]
+
+    def vk_hash(self, batch_num: int) -> str:
+        if batch_num not in self.vk_hashes:
+            self.vk_hashes[batch_num] = vkey_hash(self.actor(batch_num).zok_cli.vkey_path)
+        return self.vk_hashes[batch_num]
+
+    def is_stored(self, from_height: int, end_height: int, batch_num: int) -> bool:
+        zok_cli = self.actor(batch_num).zok_cli
+        return self.proof_store.get(from_height, end_height, zok_cli.proving_scheme, self.vk_hash(batch_num)) is not None
+
+    def submit_range(self, from_height: int, end_height: int, retry_failed: bool = False) -> int:
+        """
+        queues the batches planned over [from_height, end_height]; returns the height proving resumes from
+        batches that failed max_attempts times stay in failed/ unless retry_failed
+        """
+        if (from_height, end_height) not in self.ranges:
+            self.ranges.append((from_height, end_height))
+        batches, next_height = self.planner.plan(from_height, end_height)
+        num_submitted = 0
+        for start, end, batch_num in batches:
+            if self.is_stored(start, end, batch_num):
+                continue
+            state = self.queue.state(start, end)
+            if state == "failed" and retry_failed:
+                self.queue.retry(start, end, self.actor(batch_num).build_input(start, end))
+            elif state is None:
+                self.queue.submit(start, end, batch_num, self.actor(batch_num).build_input(start, end))
+            else:
+                continue
+            num_submitted += 1
+        print(">>> {} of {} batches submitted".format(num_submitted, len(batches)))
+        return next_height
+
+    def check(self, result: dict) -> str:
+        """ why an uploaded proof can not be stored, None when it can: same key as the coordinator's, outputs as predicted """
+        batch_num = result["batch_num"]
+        if result["scheme"] != self.actor(batch_num).zok_cli.proving_scheme or result["vk_hash"] != self.vk_hash(batch_num):
+            return "proved under another setup ({}, {})".format(result["scheme"], result["vk_hash"])
+        try:
+            if not self.actor(batch_num).check_proof_json(result["from_height"], result["end_height"], result["proof"]):
+                return "the public inputs differ from the outputs predicted by the reference model"
+        except Exception as e:
+            return str(e)
+        return None
+
+    def collect(self) -> list:
+        """ moves the uploaded proofs that pass check() into the proof store, sends the others back; returns the collected ranges """
+        collected = list()
+        for done_path, result in self.queue.done():
+            from_height, end_height, batch_num = result["from_height"], result["end_height"], result["batch_num"]
+            error = self.check(result)
+            if error is None:
+                self.proof_store.put(from_height, end_height, result["scheme"], result["vk_hash"], result["proof"])
+                os.remove(done_path)
+                collected.append((from_height, end_height))
+                continue
+            print("[Error] proof of [{}, {}] from {} is rejected: {}".format(from_height, end_height, result.get("worker"), error))
+            try:
+                # rebuilt: the input may predate a reorg
+                encoded_input = self.actor(batch_num).build_input(from_height, end_height)
+            except Exception as e:
+                print("[Error] building input of [{}, {}] fails: {}".format(from_height, end_height, e))
+                os.remove(done_path)
+                continue
+            job = {"from_height": from_height, "end_height": end_height, "batch_num": batch_num, "encoded_input": encoded_input,
+                   "attempts": result.get("attempts", 0)}
+            self.queue.reject(done_path, job, error)
+        return collected
+
+    def report_failed(self) -> list:
+        """ prints the jobs in failed/; returns their ranges, submit_range(..., retry_failed=True) queues them again """
+        failed = list()
+        for _, job in self.queue.failed():
+            print("[Error] [{}, {}] failed {} times: {}".format(job["from_height"], job["end_height"], job["attempts"], job.get("error")))
+            failed.append((job["from_height"], job["end_height"]))
+        return failed
+
+    def follow_reorgs(self) -> list:
+        """ syncs the watcher's tree; batches above a fork are dropped from the store and the queue and submitted again """
+        reorgs = self.reorg_watcher.sync() if self.reorg_watcher is not None else list()
+        for reorg in reorgs:
+            self.reorg_watcher.forget(reorg)
+            if self.epoch_index is not None:
+                self.epoch_index.invalidate(reorg.fork_height)
+            for actor in self.actors.values():
+                for record in self.reorg_watcher.stale_records(reorg.fork_height, actor):
+                    self.proof_store.delete(record.start_height, record.end_height, record.scheme, record.vk_hash)
+            for name in self.queue.withdraw(reorg.fork_height):
+                print(">>> {} withdrawn after reorg".format(name))
+        if len(reorgs) > 0:
+            for from_height, end_height in self.ranges:
+                self.submit_range(from_height, end_height)
+        return reorgs
+
+    def run(self) -> list:
+        """ requeues expired claims and collects proofs until no job is pending or claimed """
+        collected = list()
+        while True:
+            self.follow_reorgs()
+            for name in self.queue.requeue_expired():
+                print(">>> lease of {} expired, requeued".format(name))
+            collected += self.collect()
+            if self.queue.is_idle():
+                collected += self.collect()
+                if self.queue.is_idle():
+                    self.report_failed()
+                    return collected
+            time.sleep(POLL_INTERVAL)
+
+
+def _run_worker(queue_root: str, conf_dir: str, worker_id: str, lease_timeout: float):
+    Worker(WorkQueue(queue_root, lease_timeout), conf_dir, worker_id).run(exit_when_idle=True)
+
+
+class WorkQueueTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = os.path.abspath("./test_work_queue") + "/"
+        zok = Zokrates(generate_test_config(self.dir, 2, config_path=self.dir + "conf/config_batch2.toml"))
+        zok.compile()
+        zok.setup()
+
+        self.chain = SyntheticChain(self.dir + "headers.dat")
+        self.chain.mine(20)
+        self.queue = WorkQueue(self.dir + "queue", lease_timeout=3)
+        self.store = ProofStore(self.dir + "proofs.sqlite")
+        planner = BatchPlanner(menu={2: self.dir + "conf/config_batch2.toml"}, costs={2: 1})
+        self.coordinator = Coordinator(self.queue, self.store, planner, SyntheticBTCMock(self.chain))
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.chain.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_workers(self):
+        self.assertEqual(20, self.coordinator.submit_range(0, 19))
+        self.assertFalse(self.queue.submit(0, 1, 2, [1, 0]))
+
+        # a worker that claimed a job and died: its lease expires and the job is proved by another worker
+        _, abandoned_path = self.queue.claim("dead")
+        os.utime(abandoned_path, (time.time() - 10, time.time() - 10))
+        self.assertEqual(["0000000000_0000000001"], self.queue.requeue_expired())
+
+        workers = [multiprocessing.Process(target=_run_worker, args=(self.queue.root, self.dir + "conf", "worker{}".format(i), 3))
+                   for i in range(3)]
+        for worker in workers:
+            worker.start()
+        collected = self.coordinator.run()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual([(from_height, from_height + 1) for from_height in range(0, 20, 2)], sorted(collected))
+        records = self.store.query(0, 19)
+        self.assertEqual(10, len(records))
+        head_word = time_and_bits_word(self.chain.store.get(0))
+        self.assertEqual(["0x{:064x}".format(head_word)] * 10, [record.inputs[0] for record in records])
+        self.assertTrue(self.coordinator.is_stored(0, 1, 2))
+        self.assertTrue(self.queue.is_idle())
+
+    def test_rejected_proofs(self):
+        self.queue.max_attempts = 2
+        self.coordinator.submit_range(0, 1)
+        worker = Worker(self.queue, self.dir + "conf", "forger")
+        for attempt in range(2):
+            job, claimed_path = self.queue.claim(worker.worker_id)
+            self.assertEqual(attempt, job["attempts"])
+            self.assertTrue(worker.prove(job, claimed_path))
+            # a proof of other headers, under the right key
+            done_path, result = self.queue.done()[0]
+            result["proof"]["inputs"][2] = "0x" + "00" * 32
+            self.queue._publish("done", os.path.basename(done_path), result)
+            self.assertEqual([], self.coordinator.collect())
+        self.assertEqual("failed", self.queue.state(0, 1))
+        self.assertEqual([(0, 1)], self.coordinator.report_failed())
+
+        # failed ranges are only queued again on request
+        self.coordinator.submit_range(0, 1)
+        self.assertEqual("failed", self.queue.state(0, 1))
+        self.coordinator.submit_range(0, 1, retry_failed=True)
+        job, claimed_path = self.queue.claim(worker.worker_id)
+        self.assertEqual(0, job["attempts"])
+        self.assertTrue(worker.prove(job, claimed_path))
+        self.assertEqual([(0, 1)], self.coordinator.collect())
+        self.assertTrue(self.coordinator.is_stored(0, 1, 2))
+
+    def test_unknown_batch_size(self):
+        self.queue.submit(0, 2, 3, [0])
+        worker = Worker(self.queue, self.dir + "conf", "worker")
+        worker.run(exit_when_idle=True)
+        self.assertEqual(0, worker.num_proved)
+        [(_, job)] = self.queue.failed()
+        self.assertEqual(self.queue.max_attempts, job["attempts"])
+        self.assertEqual("The setup for batch 3 was not executed", job["error"])
+        self.assertTrue(self.queue.is_idle())
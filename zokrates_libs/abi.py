@@ -0,0 +1,51 @@
+import json
+from unittest import TestCase
+
+UINT_HEX_LEN = {"u8": 2, "u16": 4, "u32": 8, "u64": 16}
+
+
+def encode_arguments(abi: dict, values: list) -> list:
+    """ flat argument values (as passed to compute-witness -a) -> ABI JSON arguments described by abi.json """
+    flat = iter(values)
+    arguments = [_encode(component, flat) for component in abi["inputs"]]
+    if next(flat, None) is not None:
+        raise Exception("Too many arguments for the program ABI")
+    return arguments
+
+
+def _encode(component: dict, flat):
+    component_type = component["type"]
+    if component_type == "array":
+        inner = component["components"]
+        return [_encode(inner, flat) for _ in range(inner["size"])]
+    if component_type == "struct":
+        return {member["name"]: _encode(member, flat) for member in component["components"]["members"]}
+
+    value = next(flat, None)
+    if value is None:
+        raise Exception("Too few arguments for the program ABI")
+    if component_type == "field":
+        return str(value)
+    if component_type == "bool":
+        return bool(value)
+    if component_type in UINT_HEX_LEN:
+        return "0x{:0{}x}".format(value, UINT_HEX_LEN[component_type])
+    raise Exception("Unknown ABI type: {}".format(component_type))
+
+
+def load_abi(abi_path: str) -> dict:
+    with open(abi_path, "r") as f:
+        return json.load(f)
+
+
+class AbiTest(TestCase):
+    def test_encode_arguments(self):
+        abi = {"inputs": [
+            {"name": "head", "public": True, "type": "field"},
+            {"name": "blocks", "public": False, "type": "array",
+             "components": {"size": 2, "type": "array", "components": {"size": 2, "type": "u32"}}}
+        ]}
+        self.assertEqual(["7", [["0x00000001", "0x00000002"], ["0x00000003", "0xffffffff"]]],
+                         encode_arguments(abi, [7, 1, 2, 3, 0xffffffff]))
+        with self.assertRaises(Exception):
+            encode_arguments(abi, [7, 1, 2, 3])
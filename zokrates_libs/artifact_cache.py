@@ -0,0 +1,131 @@
+import hashlib
+import os
+import re
+import shutil
+from unittest import TestCase
+
+IMPORT_PATTERN = re.compile(r'^\s*(?:import|from)\s+"([^"]+)"', re.MULTILINE)
+
+
+def resolve_import(importer_path: str, import_path: str, stdlib_path: str) -> str:
+    """ returns the file path of an import statement ("./libs/x.zok" is relative, "hashes/..." is stdlib) """
+    if not import_path.endswith(".zok"):
+        import_path += ".zok"
+    if import_path.startswith("./") or import_path.startswith("../"):
+        return os.path.normpath(os.path.join(os.path.dirname(importer_path), import_path))
+    return os.path.normpath(os.path.join(stdlib_path, import_path))
+
+
+def collect_sources(code_path: str, stdlib_path: str) -> list:
+    """ returns the circuit file and every file it imports transitively, in deterministic order """
+    visited = list()
+    stack = [os.path.normpath(code_path)]
+    while len(stack) > 0:
+        path = stack.pop()
+        if path in visited:
+            continue
+        visited.append(path)
+        if not os.path.exists(path):
+            # stdlib may be absent on this machine; its path and version are still part of the key
+            continue
+        with open(path, "r") as f:
+            imports = IMPORT_PATTERN.findall(f.read())
+        stack += [resolve_import(path, imported, stdlib_path) for imported in reversed(imports)]
+    return visited
+
+
+def circuit_digest(code_path: str, stdlib_path: str) -> str:
+    """ hash of the circuit source and all of its imports; a changed lib changes only the circuits importing it """
+    digest = hashlib.sha256()
+    for path in collect_sources(code_path, stdlib_path):
+        digest.update(os.path.basename(path).encode())
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """ content-addressed store of compile/setup artifacts: <cache_dir>/<key>/<artifact name> """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir if cache_dir.endswith("/") else cache_dir + "/"
+
+    @staticmethod
+    def make_key(digest: str, stdlib_path: str, version: str, proving_scheme: str, curve_name: str) -> str:
+        pre = "|".join([digest, os.path.normpath(stdlib_path), version, proving_scheme, curve_name])
+        return hashlib.sha256(pre.encode()).hexdigest()
+
+    def entry_dir(self, key: str) -> str:
+        return self.cache_dir + key + "/"
+
+    def contains(self, key: str, names: list) -> bool:
+        return all(os.path.exists(self.entry_dir(key) + name) for name in names)
+
+    def restore(self, key: str, targets: dict) -> bool:
+        """ targets: {artifact name: destination path}; returns False (and touches nothing) on a miss """
+        if not self.contains(key, list(targets.keys())):
+            return False
+        for name, path in targets.items():
+            ArtifactCache._place(self.entry_dir(key) + name, path)
+        return True
+
+    def store(self, key: str, sources: dict):
+        """ sources: {artifact name: produced file path} """
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        for name, path in sources.items():
+            ArtifactCache._place(path, self.entry_dir(key) + name)
+
+    @staticmethod
+    def discard(paths: list):
+        """ unlink outputs before zokrates rewrites them, so a cached hard link is never truncated in place """
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _place(src: str, dst: str):
+        # proving keys are GBs large: hard link when possible, copy across file systems
+        if os.path.exists(dst):
+            if os.path.samefile(src, dst):
+                return
+            os.remove(dst)
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+
+class ArtifactCacheTest(TestCase):
+    def setUp(self) -> None:
+        self.root = "./test_cache_data/"
+        os.makedirs(self.root + "code/libs", exist_ok=True)
+        self._write("code/libs/a.zok", "def main(field x) -> field:\n    return x\n")
+        self._write("code/libs/b.zok", "def main(field x) -> field:\n    return x + 1\n")
+        self._write("code/one.zok", 'import "./libs/a.zok" as a\nimport "hashes/sha256/512bit" as sha\n')
+        self._write("code/two.zok", 'import "./libs/b.zok" as b\n')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _write(self, name: str, contents: str):
+        with open(self.root + name, "w") as f:
+            f.write(contents)
+
+    def test_lib_change_invalidates_only_importers(self):
+        one = circuit_digest(self.root + "code/one.zok", "/nonexistent")
+        two = circuit_digest(self.root + "code/two.zok", "/nonexistent")
+        self._write("code/libs/a.zok", "def main(field x) -> field:\n    return x * 2\n")
+        self.assertNotEqual(one, circuit_digest(self.root + "code/one.zok", "/nonexistent"))
+        self.assertEqual(two, circuit_digest(self.root + "code/two.zok", "/nonexistent"))
+
+    def test_store_and_restore(self):
+        cache = ArtifactCache(self.root + "cache")
+        key = ArtifactCache.make_key("digest", "/std", "0.7", "g16", "bn128")
+        self.assertFalse(cache.restore(key, {"zok": self.root + "out/zok"}))
+
+        self._write("zok", "program")
+        cache.store(key, {"zok": self.root + "zok"})
+        self.assertTrue(cache.restore(key, {"zok": self.root + "out/zok"}))
+        with open(self.root + "out/zok") as f:
+            self.assertEqual("program", f.read())
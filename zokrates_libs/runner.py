@@ -0,0 +1,126 @@
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from unittest import TestCase
+
+CONSTRAINTS_PATTERN = re.compile(r"Number of constraints:\s*(\d+)")
+POLL_INTERVAL = 0.05
+TAIL_LINES = 50
+
+
+class StageResult:
+    """ outcome of one zokrates subcommand """
+    def __init__(self, cmd_name: str, returncode: int, wall_time: float, cpu_time: float, peak_rss: int, output: list,
+                 status: str = "ok", constraints: int = None):
+        self.cmd_name = cmd_name
+        self.returncode = returncode
+        self.wall_time = wall_time  # seconds
+        self.cpu_time = cpu_time  # seconds, user + system
+        self.peak_rss = peak_rss  # bytes
+        self.output = output  # last lines of stdout and stderr
+        self.status = status  # "ok", "failed", "timeout" or "cancelled"
+        self.constraints = constraints  # reported by compile only
+
+    def to_dict(self) -> dict:
+        return {
+            "cmd_name": self.cmd_name,
+            "status": self.status,
+            "returncode": self.returncode,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_rss": self.peak_rss,
+            "constraints": self.constraints
+        }
+
+    def __repr__(self):
+        return "StageResult({})".format(self.to_dict())
+
+
+def _pump(stream, stream_name: str, on_line, tail: deque, found: dict):
+    for raw_line in iter(stream.readline, b""):
+        line = raw_line.decode(errors="replace").rstrip("\n")
+        tail.append(line)
+        matched = CONSTRAINTS_PATTERN.search(line)
+        if matched:
+            found["constraints"] = int(matched.group(1))
+        if on_line is not None:
+            on_line(stream_name, line)
+    stream.close()
+
+
+def run_stage(cmd_name: str, cmd: list, on_line=None, timeout: float = None, cancelled=None, stdin=None) -> StageResult:
+    """
+    runs cmd streaming its stdout/stderr line by line to on_line(stream_name, line)
+    the process is killed when timeout (seconds) expires or cancelled() returns True
+    stdin: None, bytes piped to the process or a readable file object
+    """
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            stdin=subprocess.PIPE if isinstance(stdin, bytes) else (subprocess.DEVNULL if stdin is None else stdin))
+    tail = deque(maxlen=TAIL_LINES)
+    found = dict()
+    pumps = [threading.Thread(target=_pump, args=(proc.stdout, "stdout", on_line, tail, found), daemon=True),
+             threading.Thread(target=_pump, args=(proc.stderr, "stderr", on_line, tail, found), daemon=True)]
+    for pump in pumps:
+        pump.start()
+    if isinstance(stdin, bytes):
+        threading.Thread(target=_feed, args=(proc.stdin, stdin), daemon=True).start()
+
+    # wait4 gives the rusage of this very child, not of every child of the process
+    status = "ok"
+    while True:
+        pid, wait_status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid != 0:
+            break
+        if timeout is not None and time.monotonic() - started > timeout:
+            status = "timeout"
+        elif cancelled is not None and cancelled():
+            status = "cancelled"
+        if status != "ok":
+            proc.kill()
+            pid, wait_status, rusage = os.wait4(proc.pid, 0)
+            break
+        time.sleep(POLL_INTERVAL)
+    proc.returncode = os.waitstatus_to_exitcode(wait_status)
+    for pump in pumps:
+        pump.join()
+
+    if status == "ok" and proc.returncode != 0:
+        status = "failed"
+    # ru_maxrss is in kilobytes on linux, in bytes on macOS
+    peak_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return StageResult(cmd_name, proc.returncode, time.monotonic() - started,
+                       rusage.ru_utime + rusage.ru_stime, peak_rss, list(tail), status, found.get("constraints"))
+
+
+def _feed(pipe, data: bytes):
+    try:
+        pipe.write(data)
+        pipe.close()
+    except BrokenPipeError:
+        # the process exited without reading everything; its status tells why
+        pass
+
+
+class RunnerTest(TestCase):
+    def test_streaming_and_constraints(self):
+        lines = list()
+        result = run_stage("compile", [sys.executable, "-c", "import sys; print('Number of constraints: 42'); print('oops', file=sys.stderr)"],
+                           on_line=lambda stream_name, line: lines.append((stream_name, line)))
+        self.assertEqual("ok", result.status)
+        self.assertEqual(42, result.constraints)
+        self.assertIn(("stderr", "oops"), lines)
+        self.assertGreater(result.peak_rss, 0)
+
+    def test_timeout(self):
+        result = run_stage("setup", [sys.executable, "-c", "import time; time.sleep(10)"], timeout=0.2)
+        self.assertEqual("timeout", result.status)
+        self.assertLess(result.wall_time, 5)
+
+    def test_stdin(self):
+        result = run_stage("compute_witness", [sys.executable, "-c", "import sys; print(len(sys.stdin.read()))"], stdin=b"x" * 1000000)
+        self.assertEqual(["1000000"], result.output)
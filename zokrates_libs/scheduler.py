@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from unittest import TestCase
+
+from zokrates_libs.runner import StageResult
+
+DEFAULT_KEY_RATIO = 1.5  # peak rss / proving.key size before anything was measured
+BASE_MEMORY = 256 * 1024 * 1024  # zokrates itself, witness and program
+SAFETY_MARGIN = 1.1
+RESERVED_MEMORY = 512 * 1024 * 1024  # left free for the rest of the system
+POLL_INTERVAL = 0.5
+
+
+def mem_available() -> int:
+    """ MemAvailable of /proc/meminfo in bytes; free physical pages where there is no /proc """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+class MemoryModel:
+    """ peak memory of proving jobs per proving key, learned from the peak_rss of past StageResults and kept in a json file """
+    def __init__(self, path: str):
+        self.path = path
+        self.history = {"keys": dict(), "key_ratio": None}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.history = json.load(f)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(pkey_path: str) -> str:
+        return os.path.realpath(pkey_path)
+
+    def estimate(self, pkey_path: str) -> int:
+        """ expected peak rss in bytes of compute-witness + generate-proof with this proving key """
+        measured = self.history["keys"].get(MemoryModel._key(pkey_path))
+        if measured is not None:
+            return int(measured["peak_rss"] * SAFETY_MARGIN)
+        key_size = os.path.getsize(pkey_path) if os.path.exists(pkey_path) else 0
+        key_ratio = self.history["key_ratio"] if self.history["key_ratio"] is not None else DEFAULT_KEY_RATIO
+        return int((key_size * key_ratio + BASE_MEMORY) * SAFETY_MARGIN)
+
+    def record(self, pkey_path: str, results: list):
+        """ results: StageResults of one proving job """
+        peak_rss = max([result.peak_rss for result in results])
+        key_size = os.path.getsize(pkey_path) if os.path.exists(pkey_path) else 0
+        with self._lock:
+            key = MemoryModel._key(pkey_path)
+            previous = self.history["keys"].get(key, {"peak_rss": 0})
+            self.history["keys"][key] = {"peak_rss": max(previous["peak_rss"], peak_rss), "key_size": key_size}
+            if key_size > 0:
+                key_ratio = max(0, peak_rss - BASE_MEMORY) / key_size
+                self.history["key_ratio"] = max(self.history["key_ratio"] or 0, key_ratio)
+
+    def flush(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.history, f)
+            os.replace(tmp_path, self.path)
+
+
+class MemoryScheduler:
+    """
+    runs proving jobs concurrently while their estimated peak memory fits both the budget and the free memory
+    the largest job that fits is admitted first, smaller ones fill the remaining room
+    """
+    def __init__(self, model: MemoryModel, budget: int = None, max_workers: int = None, available=mem_available):
+        self.model = model
+        self.available = available
+        # by default the memory free at start, minus what the system keeps
+        self.budget = available() - RESERVED_MEMORY if budget is None else budget
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.failed = dict()
+        self.peak_reserved = 0
+
+    def run(self, jobs: list) -> dict:
+        """
+        jobs: [(name, zok_cli, encoded_input)]; returns {name: proof_path} of the succeeded jobs, failures in self.failed
+        encoded_input may be a function building it, called in this loop when the job is admitted, so that only the inputs
+        of running jobs are held and inputs are built while earlier jobs prove
+        """
+        self.failed = dict()
+        pending = [(self.model.estimate(zok_cli.pkey_path), name, zok_cli, encoded_input) for name, zok_cli, encoded_input in jobs]
+        pending.sort(key=lambda job: job[0], reverse=True)
+        running = dict()
+        reserved = 0
+        proofs = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < self.max_workers:
+                    job = self._next_job(pending, reserved, len(running) == 0)
+                    if job is None:
+                        break
+                    pending.remove(job)
+                    estimate, name, zok_cli, encoded_input = job
+                    if callable(encoded_input):
+                        try:
+                            encoded_input = encoded_input()
+                        except Exception as e:
+                            print("[Error] building input of {} fails: {}".format(name, e))
+                            self.failed[name] = e
+                            continue
+                    running[executor.submit(zok_cli.prove, encoded_input)] = job
+                    reserved += estimate
+                    self.peak_reserved = max(self.peak_reserved, reserved)
+
+                done, _ = wait(list(running.keys()), timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    estimate, name, zok_cli, encoded_input = running.pop(future)
+                    reserved -= estimate
+                    try:
+                        self.model.record(zok_cli.pkey_path, future.result())
+                        proofs[name] = zok_cli.proof_path
+                    except Exception as e:
+                        print("[Error] proving {} fails: {}".format(name, e))
+                        self.failed[name] = e
+        self.model.flush()
+        return proofs
+
+    def _next_job(self, pending: list, reserved: int, idle: bool):
+        """ largest pending job fitting the budget and the free memory; an idle scheduler runs the smallest job regardless """
+        free = min(self.budget - reserved, self.available() - RESERVED_MEMORY)
+        for job in pending:
+            if job[0] <= free:
+                return job
+        if idle:
+            print(">>> a job of {} MB exceeds the memory budget, running it alone".format(pending[-1][0] // (1024 * 1024)))
+            return pending[-1]
+        return None
+
+
+class MemorySchedulerTest(TestCase):
+    class FakeJob:
+        """ stands in for a Zokrates job client, tracking how much memory the running jobs would hold """
+        lock = threading.Lock()
+        holding = 0
+        peak = 0
+
+        def __init__(self, pkey_path: str, size: int):
+            self.pkey_path = pkey_path
+            self.proof_path = pkey_path + ".proof"
+            self.size = size
+
+        def prove(self, encoded_input):
+            cls = MemorySchedulerTest.FakeJob
+            with cls.lock:
+                cls.holding += self.size
+                cls.peak = max(cls.peak, cls.holding)
+            time.sleep(0.05)
+            with cls.lock:
+                cls.holding -= self.size
+            return [StageResult("generate_proof", 0, 0.05, 0.05, self.size, list())]
+
+    def setUp(self) -> None:
+        self.dir = "./test_scheduler/"
+        self.path = self.dir + "memory.json"
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_budget_is_respected(self):
+        gb = 1024 ** 3
+        model = MemoryModel(self.path)
+        jobs = [("large{}".format(i), MemorySchedulerTest.FakeJob("large{}".format(i), 6 * gb), None) for i in range(2)]
+        jobs += [("small{}".format(i), MemorySchedulerTest.FakeJob("small{}".format(i), gb), None) for i in range(4)]
+        for _, job, _ in jobs:
+            model.history["keys"][MemoryModel._key(job.pkey_path)] = {"peak_rss": job.size, "key_size": 0}
+        scheduler = MemoryScheduler(model, budget=9 * gb, max_workers=4, available=lambda: 64 * gb)
+        proofs = scheduler.run(jobs)
+        self.assertEqual(6, len(proofs))
+        self.assertLessEqual(MemorySchedulerTest.FakeJob.peak, 9 * gb)
+        self.assertLessEqual(scheduler.peak_reserved, 9 * gb)
+        # a small job runs beside a large one
+        self.assertGreater(MemorySchedulerTest.FakeJob.peak, 6 * gb)
+
+    def test_lazy_inputs(self):
+        built = list()
+
+        def build(name):
+            if name == "broken":
+                raise Exception("no headers")
+            built.append(name)
+            return [1]
+
+        model = MemoryModel(self.path)
+        jobs = [(name, MemorySchedulerTest.FakeJob(name, 1024), lambda name=name: build(name)) for name in ["a", "broken", "b"]]
+        scheduler = MemoryScheduler(model, budget=1024 ** 3, max_workers=2, available=lambda: 1024 ** 3)
+        self.assertEqual(["a", "b"], sorted(scheduler.run(jobs)))
+        self.assertEqual(["broken"], list(scheduler.failed))
+        self.assertEqual(["a", "b"], sorted(built))
+
+    def test_estimate_from_key_size(self):
+        model = MemoryModel(self.path)
+        self.assertEqual(int(BASE_MEMORY * SAFETY_MARGIN), model.estimate("./missing.key"))
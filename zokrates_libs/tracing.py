@@ -0,0 +1,193 @@
+""" Opt-in spans exported as Chrome trace (chrome://tracing, Perfetto) JSON; a single global check when tracing is off. """
+import collections
+import functools
+import json
+import os
+import threading
+import time
+from unittest import TestCase
+
+_tracer = None
+MAX_EVENTS = 100000  # events kept for export; older ones are dropped but stay counted in the summary
+
+
+class Tracer:
+    """ the last max_events spans, and per span name totals over every span, so a long-running daemon stays bounded """
+    def __init__(self, max_events: int = MAX_EVENTS):
+        self.events = collections.deque(maxlen=max_events)
+        self.dropped = 0
+        self._totals = dict()  # name: [count, total ms, max ms, histogram]
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._thread_ids = dict()
+
+    def now(self) -> float:
+        """ microseconds since the tracer was enabled """
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def add(self, name: str, cat: str, ts: float, dur: float, args: dict):
+        with self._lock:
+            tid = self._thread_ids.setdefault(threading.get_ident(), len(self._thread_ids))
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append({"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": os.getpid(), "tid": tid, "args": args})
+            totals = self._totals.setdefault(name, [0, 0.0, 0.0, dict()])
+            value = dur / 1000
+            totals[0] += 1
+            totals[1] += value
+            totals[2] = max(totals[2], value)
+            bucket = "<{}ms".format(2 ** int(value).bit_length())
+            totals[3][bucket] = totals[3].get(bucket, 0) + 1
+
+    def export_chrome(self, path: str):
+        """ the retained events; the number dropped before them is kept in otherData """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            events = list(self.events)
+            dropped = self.dropped
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_events": dropped}}, f)
+
+    def summary(self) -> dict:
+        """
+        {span name: count, total/mean/p50/p90/max in ms and a histogram over power-of-two ms buckets}
+        count, total, mean, max and the histogram cover every span; p50 and p90 only the retained events
+        """
+        durations = dict()
+        with self._lock:
+            for event in self.events:
+                durations.setdefault(event["name"], list()).append(event["dur"] / 1000)
+            totals = {name: (count, total, maximum, dict(histogram)) for name, (count, total, maximum, histogram) in self._totals.items()}
+        summary = dict()
+        for name, (count, total, maximum, histogram) in totals.items():
+            values = sorted(durations.get(name, [total / count]))
+            summary[name] = {
+                "count": count,
+                "total": total,
+                "mean": total / count,
+                "p50": values[len(values) // 2],
+                "p90": values[min(len(values) - 1, len(values) * 9 // 10)],
+                "max": maximum,
+                "histogram": histogram
+            }
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        print("{:<40} {:>8} {:>12} {:>10} {:>10} {:>10}".format("span", "count", "total(ms)", "p50(ms)", "p90(ms)", "max(ms)"))
+        for name, row in sorted(summary.items(), key=lambda item: item[1]["total"], reverse=True):
+            print("{:<40} {:>8} {:>12.1f} {:>10.2f} {:>10.2f} {:>10.2f}".format(name, row["count"], row["total"], row["p50"], row["p90"], row["max"]))
+
+
+class _Span:
+    def __init__(self, tracer: Tracer, name: str, cat: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.started = None
+
+    def set(self, **args):
+        """ attaches arguments known only inside the span (cache hit, exit status, ...) """
+        self.args.update(args)
+
+    def __enter__(self):
+        self.started = self.tracer.now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args["error"] = repr(exc_value)
+        self.tracer.add(self.name, self.cat, self.started, self.tracer.now() - self.started, self.args)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enable(max_events: int = MAX_EVENTS) -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(max_events)
+    return _tracer
+
+
+def disable() -> Tracer:
+    """ stops recording; returns the tracer holding what was recorded """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, cat: str = "relay", **args):
+    if _tracer is None:
+        return NOOP_SPAN
+    return _Span(_tracer, name, cat, args)
+
+
+def traced(name: str = None, cat: str = "relay"):
+    """ decorator: one span per call, named after the function unless name is given """
+    def decorator(func):
+        span_name = func.__qualname__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _Span(_tracer, span_name, cat, dict()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracingTest(TestCase):
+    def tearDown(self) -> None:
+        disable()
+
+    def test_disabled_is_noop(self):
+        with span("nothing") as recorded:
+            recorded.set(hit=True)
+        self.assertIs(NOOP_SPAN, recorded)
+        self.assertIsNone(get_tracer())
+
+    def test_spans_and_summary(self):
+        tracer = enable()
+
+        @traced(cat="test")
+        def work(x):
+            return x * 2
+
+        with span("outer", hit=False) as outer:
+            self.assertEqual(4, work(2))
+            outer.set(hit=True)
+        events = {event["name"]: event for event in tracer.events}
+        self.assertEqual({"hit": True}, events["outer"]["args"])
+        self.assertEqual("X", events["TracingTest.test_spans_and_summary.<locals>.work"]["ph"])
+        self.assertLessEqual(events["outer"]["ts"], events["TracingTest.test_spans_and_summary.<locals>.work"]["ts"])
+        self.assertEqual(1, tracer.summary()["outer"]["count"])
+
+    def test_bounded_buffer(self):
+        tracer = enable(max_events=10)
+        for i in range(25):
+            with span("tick", i=i):
+                pass
+        self.assertEqual(10, len(tracer.events))
+        self.assertEqual(15, tracer.dropped)
+        self.assertEqual(15, tracer.events[0]["args"]["i"])
+        self.assertEqual(25, tracer.summary()["tick"]["count"])
+        self.assertEqual(25, sum(tracer.summary()["tick"]["histogram"].values()))
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from config_batch import generate_test_config
+from zokrates_libs.zokrates import Zokrates
+
+
+def proof_hash(proof_json: dict) -> str:
+    """ hash of the canonical json of a proof (proof points and public inputs) """
+    return hashlib.sha256(json.dumps(proof_json, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class VerificationCache:
+    """ {key: passed} kept in a json file; a key covers the proof, verification key, scheme and zokrates version """
+    def __init__(self, path: str):
+        self.path = path
+        self.results = dict()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.results = json.load(f)
+
+    @staticmethod
+    def make_key(proof_digest: str, vkey_digest: str, proving_scheme: str, version: str) -> str:
+        pre = "|".join([proof_digest, vkey_digest, proving_scheme, version])
+        return hashlib.sha256(pre.encode()).hexdigest()
+
+    def get(self, key: str) -> bool:
+        """ None when the proof was never verified with this key and toolchain """
+        return self.results.get(key)
+
+    def put(self, key: str, passed: bool):
+        self.results[key] = passed
+
+    def flush(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.results, f)
+        os.replace(tmp_path, self.path)
+
+
+class BulkVerifier:
+    """
+    verifies many proofs against one verification key with a pool of zokrates processes
+    results are cached per proof, so only new proofs (or all of them after a zokrates upgrade) are verified again
+    """
+    def __init__(self, zok_cli: Zokrates, num_workers: int = None, cache: VerificationCache = None, scratch_dir: str = None):
+        self.zok_cli = zok_cli
+        self.num_workers = os.cpu_count() if num_workers is None else num_workers
+        self.cache = VerificationCache(zok_cli.cache.cache_dir + "verifications.json") if cache is None else cache
+        self.scratch_dir = zok_cli.data_dir + "verify/" if scratch_dir is None else scratch_dir
+        self.failed = dict()
+
+    def verify_all(self, proofs: dict, vkey_path: str = None) -> dict:
+        """ proofs: {name: proof json}; returns {name: passed}, verification errors are kept in self.failed """
+        vkey_path = self.zok_cli.vkey_path if vkey_path is None else vkey_path
+        vkey_digest = file_hash(vkey_path)
+        version = self.zok_cli.version()
+        self.failed = dict()
+
+        results = dict()
+        # {key: (future, names)}: byte-identical proofs are verified once, so no two jobs share a scratch file
+        jobs = dict()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for name, proof_json in proofs.items():
+                proof_digest = proof_hash(proof_json)
+                key = VerificationCache.make_key(proof_digest, vkey_digest, self.zok_cli.proving_scheme, version)
+                if self.cache.get(key) is not None:
+                    results[name] = self.cache.get(key)
+                elif key in jobs:
+                    jobs[key][1].append(name)
+                else:
+                    jobs[key] = (executor.submit(self._verify_one, proof_digest, proof_json, vkey_path), [name])
+
+            for key, (future, names) in jobs.items():
+                try:
+                    passed = future.result()
+                except Exception as e:
+                    for name in names:
+                        print("[Error] verifying {} fails: {}".format(name, e))
+                        self.failed[name] = e
+                    continue
+                for name in names:
+                    results[name] = passed
+                self.cache.put(key, passed)
+        self.cache.flush()
+        return results
+
+    def _verify_one(self, proof_digest: str, proof_json: dict, vkey_path: str) -> bool:
+        Zokrates.mk_dir(self.scratch_dir)
+        proof_path = self.scratch_dir + proof_digest + ".json"
+        with open(proof_path, "w") as f:
+            json.dump(proof_json, f)
+        try:
+            return self.zok_cli.verify(proof_path, vkey_path)
+        finally:
+            os.remove(proof_path)
+
+
+class BulkVerifierTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = os.path.abspath("./test_verifier") + "/"
+        config_path = generate_test_config(self.dir)
+        os.makedirs(self.dir + "data", exist_ok=True)
+        with open(self.dir + "data/verification.key", "w") as f:
+            json.dump({"scheme": "g16"}, f)
+        self.zok = Zokrates(config_path)
+        point = "0x" + "11" * 32
+        self.good = {"proof": {"a": [point, point], "b": [[point, point], [point, point]], "c": [point, point]}, "inputs": ["0x1"]}
+        self.bad = {"proof": {"a": ["0x1", "0x2"], "b": [[point, point], [point, point]], "c": [point, point]}, "inputs": ["0x1"]}
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_verify_all_and_cache(self):
+        verifier = BulkVerifier(self.zok, num_workers=2)
+        self.assertEqual({"good": True, "bad": False}, verifier.verify_all({"good": self.good, "bad": self.bad}))
+
+        # served from the cache: the zokrates binary is not needed anymore
+        self.zok.zokrates_bin_path = self.dir + "missing"
+        cached = BulkVerifier(self.zok, num_workers=2, cache=VerificationCache(verifier.cache.path))
+        self.assertEqual({"good": True, "bad": False}, cached.verify_all({"good": self.good, "bad": self.bad}))
+
+    def test_duplicate_proofs(self):
+        verified = list()
+        verify = self.zok.verify
+        self.zok.verify = lambda proof_path, vkey_path: verified.append(proof_path) or verify(proof_path, vkey_path)
+        proofs = {"first": self.good, "second": json.loads(json.dumps(self.good)), "bad": self.bad}
+        self.assertEqual({"first": True, "second": True, "bad": False}, BulkVerifier(self.zok, num_workers=3).verify_all(proofs))
+        self.assertEqual(2, len(verified))
@@ -1,11 +1,30 @@
+import copy
+import hashlib
 import json
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
 from unittest import TestCase
 
 import toml
 
-PROVING_SCHEME = ["g16", "pghr13", "gm17", "marli"]
+from config_batch import generate_test_config
+from zokrates_libs import tracing
+from zokrates_libs.abi import encode_arguments, load_abi
+from zokrates_libs.artifact_cache import ArtifactCache, circuit_digest
+from zokrates_libs.runner import POLL_INTERVAL, StageResult, run_stage
+
+PROVING_SCHEME = ["g16", "pghr13", "gm17", "marlin"]
+# schemes whose keys are derived from one universal setup (SRS) instead of a per-circuit trusted setup
+# their proofs are verified off-chain only: relay3 of Bitcoin.sol takes (a, b, c) proofs (see calldata.RELAY_SCHEMES)
+UNIVERSAL_SCHEMES = ["marlin"]
+DEFAULT_UNIVERSAL_SETUP_SIZE = 22  # exponent: 2**22 covers the constraints and non-zero entries of the largest batch
+WITNESS_TRANSPORT = ["argv", "stdin", "file"]
+# how generate-proof receives the witness of compute-witness: a file in the data dir, a file on tmpfs or a named pipe
+WITNESS_HANDOFF = ["file", "shm", "fifo"]
+SHM_DIR = "/dev/shm/"
 
 
 class Zokrates:
@@ -38,19 +57,172 @@ class Zokrates:
         self.zokrates_bin_path = self.config["zokrates"]["BIN_PATH"]
         self.zokrates_std_lib_path = self.config["zokrates"]["STDLIB_PATH"]
 
+        # marlin is only implemented by the ark backend; the default backend is used for the other schemes
+        self.backend = self.config["zokrates"].get("BACKEND", "ark" if self.proving_scheme in UNIVERSAL_SCHEMES else None)
+        self.universal_setup_size = self.config["zokrates"].get("UNIVERSAL_SETUP_SIZE", DEFAULT_UNIVERSAL_SETUP_SIZE)
+
+        # compile/setup artifacts are shared by every config that builds the same circuit
+        self.curve_name = context.get("CURVE_NAME", "bn128")
+        self.cache = ArtifactCache(self.config["zokrates"].get("CACHE_DIR", root_dir + "cache/"))
+        self._version = None
+
+        # per-stage timeout in seconds (none by default); on_output(stream_name, line) receives zokrates output
+        self.timeout = self.config["zokrates"].get("TIMEOUT")
+        self.on_output = None
+        self.cancelled = False
+
+        # how compute-witness receives its arguments: "argv" (-a), or ABI json through "stdin" or a "file"
+        self.witness_transport = self.config["zokrates"].get("WITNESS_TRANSPORT", "argv")
+        if self.witness_transport not in WITNESS_TRANSPORT:
+            raise Exception("Unknown witness transport: {}".format(self.witness_transport))
+        self.witness_handoff = self.config["zokrates"].get("WITNESS_HANDOFF", "file")
+        if self.witness_handoff not in WITNESS_HANDOFF:
+            raise Exception("Unknown witness handoff: {}".format(self.witness_handoff))
+
+    def for_job(self, job_dir: str) -> "Zokrates":
+        """ return a copy of this client whose witness and proof are written into job_dir """
+        if not job_dir.endswith("/"):
+            job_dir += "/"
+        job = copy.copy(self)
+        job.witness_path = job_dir + os.path.basename(self.witness_path)
+        job.proof_path = job_dir + os.path.basename(self.proof_path)
+        job.cancelled = False
+        return job
+
+    def cancel(self):
+        """ kills the running zokrates stage (callable from another thread) """
+        self.cancelled = True
+
     # TODO need?
     def change_code(self, file_name: str):
         self.code_path = self.code_dir + file_name
 
-    def integrated_setup(self):
-        self.compile()
-        self.setup()
+    def integrated_setup(self, use_cache: bool = True) -> list:
+        results = list()
+        if self.proving_scheme in UNIVERSAL_SCHEMES:
+            # generated once, then shared by every batch size
+            universal_result = self.universal_setup()
+            results += [universal_result] if universal_result is not None else []
+
+        key = self.artifact_key()
+        if use_cache and self.cache.restore(key, self._setup_artifacts()):
+            print(">>> reuse cached compile/setup artifacts ({})".format(key[:16]))
+            return results
+        ArtifactCache.discard(list(self._setup_artifacts().values()) + [self.verifier_contract_path])
+        compile_result = self.compile()
+        if self.proving_scheme in UNIVERSAL_SCHEMES and compile_result.constraints is not None \
+                and compile_result.constraints > 2 ** self.universal_setup_size:
+            raise Exception("{} constraints exceed the universal setup of 2**{}; raise UNIVERSAL_SETUP_SIZE".format(
+                compile_result.constraints, self.universal_setup_size))
+        results += [compile_result, self.setup()]
+        self.cache.store(key, self._setup_artifacts())
+        return results
+
+    @property
+    def universal_setup_path(self) -> str:
+        return self.cache.cache_dir + "universal/{}_{}_{}.dat".format(self.proving_scheme, self.curve_name, self.universal_setup_size)
+
+    def universal_setup(self, use_cache: bool = True) -> StageResult:
+        """ generates the SRS of 2**universal_setup_size shared by all circuits; returns None when it already exists """
+        if use_cache and os.path.exists(self.universal_setup_path + ".sha256"):
+            return None
+
+        # set zokrates command
+        cmd = [self.zokrates_bin_path, "universal-setup"]
 
-    def prove(self, *args):
-        self.compute_witness(*args)
-        self.generate_proof()
+        # set parameters
+        cmd += ["-c", self.curve_name]
+        cmd += ["-s", self.proving_scheme]
+        cmd += ["-b", self.backend]
+        cmd += ["-n", str(self.universal_setup_size)]
 
-    def compile(self) -> str:
+        # set srs path
+        Zokrates.mk_dir(os.path.dirname(self.universal_setup_path))
+        cmd += ["-u", self.universal_setup_path]
+
+        # run the command
+        ArtifactCache.discard([self.universal_setup_path, self.universal_setup_path + ".sha256"])
+        result = self._run("universal_setup", cmd)
+
+        # keys derived from this SRS are cached under its digest; the digest file marks a complete SRS
+        digest = hashlib.sha256()
+        with open(self.universal_setup_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        with open(self.universal_setup_path + ".sha256", "w") as f:
+            f.write(digest.hexdigest())
+        return result
+
+    def universal_setup_id(self) -> str:
+        if not os.path.exists(self.universal_setup_path + ".sha256"):
+            raise Exception("There is no {} universal setup at {}; run integrated_setup (or universal_setup) first".format(
+                self.proving_scheme, self.universal_setup_path))
+        with open(self.universal_setup_path + ".sha256", "r") as f:
+            return f.read().strip()
+
+    def prove(self, *args, handoff: str = None) -> list:
+        """
+        compute-witness then generate-proof; with "shm" or "fifo" the witness never touches the data dir and is removed
+        afterwards. "fifo" runs both stages at once, so their memory adds up
+        """
+        handoff = self.witness_handoff if handoff is None else handoff
+        if handoff == "file":
+            return [self.compute_witness(*args), self.generate_proof()]
+        if handoff not in WITNESS_HANDOFF:
+            raise Exception("Unknown witness handoff: {}".format(handoff))
+        if handoff == "shm" and not os.path.isdir(SHM_DIR):
+            raise Exception("There is no tmpfs at {}".format(SHM_DIR))
+
+        # a named pipe holds no data, any local directory does
+        handoff_dir = tempfile.mkdtemp(prefix="zk_witness_", dir=SHM_DIR if handoff == "shm" else None)
+        witness_path = os.path.join(handoff_dir, os.path.basename(self.witness_path))
+        try:
+            if handoff == "shm":
+                return [self.compute_witness(*args, witness_path=witness_path), self.generate_proof(witness_path)]
+            os.mkfifo(witness_path)
+            return self._prove_through_fifo(witness_path, *args)
+        finally:
+            shutil.rmtree(handoff_dir, ignore_errors=True)
+
+    def _prove_through_fifo(self, witness_path: str, *args) -> list:
+        results = dict()
+        errors = dict()
+
+        def run(name: str, stage, *stage_args, **stage_kwargs):
+            try:
+                results[name] = stage(*stage_args, **stage_kwargs)
+            except Exception as e:
+                errors[name] = e
+
+        threads = {
+            "compute_witness": threading.Thread(target=run, args=("compute_witness", self.compute_witness) + args,
+                                                kwargs={"witness_path": witness_path}),
+            "generate_proof": threading.Thread(target=run, args=("generate_proof", self.generate_proof, witness_path))
+        }
+        for thread in threads.values():
+            thread.start()
+        while any([thread.is_alive() for thread in threads.values()]):
+            for thread in threads.values():
+                thread.join(POLL_INTERVAL)
+            # a stage failing before it opened the pipe leaves the other one blocked in open(); opening that end releases it
+            if "compute_witness" in errors and threads["generate_proof"].is_alive():
+                Zokrates._open_fifo_end(witness_path, os.O_WRONLY)
+            if "generate_proof" in errors and threads["compute_witness"].is_alive():
+                Zokrates._open_fifo_end(witness_path, os.O_RDONLY)
+        for name in ["compute_witness", "generate_proof"]:
+            if name in errors:
+                raise errors[name]
+        return [results["compute_witness"], results["generate_proof"]]
+
+    @staticmethod
+    def _open_fifo_end(path: str, flags: int):
+        try:
+            os.close(os.open(path, flags | os.O_NONBLOCK))
+        except OSError:
+            # ENXIO: no reader has opened the pipe yet
+            pass
+
+    def compile(self) -> StageResult:
         # set zokrates command
         cmd = [self.zokrates_bin_path, "compile"]
 
@@ -67,9 +239,9 @@ class Zokrates:
         cmd += ["--stdlib-path", self.zokrates_std_lib_path]
 
         # run the command
-        return Zokrates.run_zokrates("compile", cmd)
+        return self._run("compile", cmd)
 
-    def setup(self) -> str:
+    def setup(self) -> StageResult:
         # set zokrates command
         cmd = [self.zokrates_bin_path, "setup"]
 
@@ -83,37 +255,60 @@ class Zokrates:
 
         # select proving scheme
         cmd += ["-s", self.proving_scheme]
+        cmd += ["-b", self.backend] if self.backend is not None else []
+
+        # derive the keys from the shared SRS
+        if self.proving_scheme in UNIVERSAL_SCHEMES:
+            self.universal_setup_id()
+            cmd += ["-u", self.universal_setup_path]
 
         # run the command
-        return Zokrates.run_zokrates("setup", cmd)
+        return self._run("setup", cmd)
 
-    def compute_witness(self, *args) -> str:
+    def compute_witness(self, *args, transport: str = None, witness_path: str = None) -> StageResult:
         # set zokrates command
         cmd = [self.zokrates_bin_path, "compute-witness"]
 
         # set r1cs program path
         cmd += ["-i", self.prog_path]
 
-        # set witness path
-        Zokrates.mk_dir(self.data_dir)
-        cmd += ["-o", self.witness_path]
+        # set witness path (another one for a witness handoff, see prove)
+        witness_path = self.witness_path if witness_path is None else witness_path
+        Zokrates.mk_dir(os.path.dirname(witness_path))
+        cmd += ["-o", witness_path]
 
         # set and encode input
-        encoded = list()
+        values = list()
         for arg in args:
             if isinstance(arg, int):
-                encoded.append(str(arg))
+                values.append(arg)
             elif isinstance(arg, list):
-                encoded += [str(item) for item in arg]
+                values += arg
             else:
                 raise Exception("Invalid Input: {}".format(arg))
 
-        cmd += ["-a"] + encoded
-
-        # run the command
-        return Zokrates.run_zokrates("compute_witness", cmd)
-
-    def generate_proof(self) -> str:
+        transport = self.witness_transport if transport is None else transport
+        if transport == "argv":
+            cmd += ["-a"] + [str(value) for value in values]
+            return self._run("compute_witness", cmd)
+
+        # ABI json arguments, described by abi.json from compile, keep argv short for any batch size
+        cmd += ["-s", self.abi_path, "--abi", "--stdin"]
+        arguments = json.dumps(encode_arguments(load_abi(self.abi_path), values)).encode()
+        if transport == "stdin":
+            return self._run("compute_witness", cmd, arguments)
+        if transport == "file":
+            arguments_path = os.path.dirname(witness_path) + "/arguments.json"
+            with open(arguments_path, "wb") as f:
+                f.write(arguments)
+            try:
+                with open(arguments_path, "rb") as f:
+                    return self._run("compute_witness", cmd, f)
+            finally:
+                os.remove(arguments_path)
+        raise Exception("Unknown witness transport: {}".format(transport))
+
+    def generate_proof(self, witness_path: str = None) -> StageResult:
         # set zokrates command
         cmd = [self.zokrates_bin_path, "generate-proof"]
 
@@ -122,14 +317,22 @@ class Zokrates:
 
         # set parameters
         cmd += ["-p", self.pkey_path]
-        cmd += ["-w", self.witness_path]
+        cmd += ["-w", self.witness_path if witness_path is None else witness_path]
         cmd += ["-s", self.proving_scheme]
+        cmd += ["-b", self.backend] if self.backend is not None else []
+        Zokrates.mk_dir(os.path.dirname(self.proof_path))
         cmd += ["-j", self.proof_path]
 
         # run the command
-        return Zokrates.run_zokrates("generate_proof", cmd)
+        return self._run("generate_proof", cmd)
+
+    def export_verifier(self, curve_name: str = None, use_cache: bool = True) -> StageResult:
+        """ returns None when the verifier is served from the cache """
+        curve_name = self.curve_name if curve_name is None else curve_name
+        key = self.artifact_key(curve_name)
+        if use_cache and self.cache.restore(key, {"verifier.sol": self.verifier_contract_path}):
+            return None
 
-    def export_verifier(self, curve_name: str = "bn128") -> str:
         # set zokrates command
         cmd = [self.zokrates_bin_path, "export-verifier"]
 
@@ -143,21 +346,74 @@ class Zokrates:
         cmd += ["-o", self.verifier_contract_path]
 
         # run the command
-        return Zokrates.run_zokrates("export_verifier", cmd)
+        ArtifactCache.discard([self.verifier_contract_path])
+        result = self._run("export_verifier", cmd)
+
+        # the verifier is only valid for the verification key it was exported from
+        if self.cache.contains(key, ["verification.key"]):
+            self.cache.store(key, {"verifier.sol": self.verifier_contract_path})
+        return result
+
+    def verify(self, proof_path: str = None, vkey_path: str = None) -> bool:
+        """ checks a proof against a verification key off-chain; False when zokrates reports FAILED """
+        proof_path = self.proof_path if proof_path is None else proof_path
+        vkey_path = self.vkey_path if vkey_path is None else vkey_path
+
+        # set zokrates command
+        cmd = [self.zokrates_bin_path, "verify"]
+
+        # set parameters
+        cmd += ["-v", vkey_path]
+        cmd += ["-j", proof_path]
+        cmd += ["-s", self.proving_scheme]
+        cmd += ["-b", self.backend] if self.backend is not None else []
+
+        # run the command
+        result = self._run("verify", cmd)
+        return any(line.strip() == "PASSED" for line in result.output)
+
+    def version(self) -> str:
+        if self._version is None:
+            return_obj = subprocess.run([self.zokrates_bin_path, "--version"], stdout=subprocess.PIPE)
+            self._version = return_obj.stdout.decode().strip()
+        return self._version
+
+    def artifact_key(self, curve_name: str = None) -> str:
+        """ cache key of the circuit (with all imported libs), stdlib, zokrates version, scheme (and SRS) and curve """
+        curve_name = self.curve_name if curve_name is None else curve_name
+        digest = circuit_digest(self.code_path, self.zokrates_std_lib_path)
+        proving_scheme = self.proving_scheme
+        if self.proving_scheme in UNIVERSAL_SCHEMES:
+            # keys are only valid for the SRS they were derived from
+            proving_scheme += ":" + self.universal_setup_id()
+        return ArtifactCache.make_key(digest, self.zokrates_std_lib_path, self.version(), proving_scheme, curve_name)
+
+    def _setup_artifacts(self) -> dict:
+        return {
+            "program": self.prog_path,
+            "abi.json": self.abi_path,
+            "verification.key": self.vkey_path,
+            "proving.key": self.pkey_path
+        }
 
     @staticmethod
     def mk_dir(dir_path: str):
         if not os.path.exists(dir_path):
             os.makedirs(dir_path, exist_ok=True)
 
+    def _run(self, cmd_name: str, cmd: list, stdin=None) -> StageResult:
+        return Zokrates.run_zokrates(cmd_name, cmd, self.on_output, self.timeout, lambda: self.cancelled, stdin)
+
     @staticmethod
-    def run_zokrates(cmd_name: str, cmd: list) -> str:
+    def run_zokrates(cmd_name: str, cmd: list, on_line=None, timeout: float = None, cancelled=None, stdin=None) -> StageResult:
         # print(">> {} starts".format(cmd_name))
-        return_obj = subprocess.run(cmd, stdout=subprocess.PIPE)
-        if return_obj.returncode != 0:
-            print(return_obj.stdout.decode())
-            raise Exception(cmd_name + " error")
-        return return_obj.stdout.hex()
+        with tracing.span("zokrates." + cmd_name, "zokrates") as span:
+            result = run_stage(cmd_name, cmd, on_line, timeout, cancelled, stdin)
+            span.set(status=result.status, cpu_time=result.cpu_time, peak_rss=result.peak_rss)
+        if result.status != "ok":
+            print("\n".join(result.output))
+            raise Exception("{} error ({}, after {:.1f}s)".format(cmd_name, result.status, result.wall_time))
+        return result
 
 
 class ZokratesTest(TestCase):
@@ -188,3 +444,51 @@ def main(private field a, field b) -> bool:
         self.zok.compute_witness(337, 113569)
         self.zok.generate_proof()
         self.zok.export_verifier()
+
+
+class WitnessHandoffTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = os.path.abspath("./test_handoff") + "/"
+        self.zok = Zokrates(generate_test_config(self.dir))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_handoffs(self):
+        self.zok.compile()
+        for handoff in ["shm", "fifo"] if os.path.isdir(SHM_DIR) else ["fifo"]:
+            self.zok.prove(7, 49, handoff=handoff)
+            with open(self.zok.proof_path, "r") as f:
+                self.assertEqual(7, int(json.load(f)["inputs"][0], 16))
+            self.assertFalse(os.path.exists(self.zok.witness_path))
+            self.assertEqual(self.dir + "data/witness", self.zok.witness_path)
+
+    def test_file_transport(self):
+        self.zok.compile()
+        # the fake ABI: epoch head word and the words of one header
+        self.zok.compute_witness(7, [0] * 32, transport="file")
+        self.assertTrue(os.path.exists(self.zok.witness_path))
+        self.assertFalse(os.path.exists(self.dir + "data/arguments.json"))
+
+    def test_fifo_stage_fails(self):
+        # no compiled program: compute-witness fails before it opens the pipe
+        with self.assertRaises(Exception):
+            self.zok.prove(7, 49, handoff="fifo")
+
+
+class UniversalSetupTest(TestCase):
+    def setUp(self) -> None:
+        self.dir = os.path.abspath("./test_universal_setup") + "/"
+        self.zok = Zokrates(generate_test_config(self.dir, proving_scheme="marlin", universal_setup_size=18))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_missing_srs(self):
+        with self.assertRaisesRegex(Exception, "run integrated_setup"):
+            self.zok.artifact_key()
+        self.zok.compile()
+        with self.assertRaisesRegex(Exception, "run integrated_setup"):
+            self.zok.setup()
+        self.zok.integrated_setup()
+        self.assertEqual(self.zok.artifact_key(), self.zok.artifact_key())